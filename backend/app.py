@@ -1,5 +1,6 @@
 """FastAPI приложение аналитики выпуска продукции."""
 
+import math
 from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
@@ -231,7 +232,7 @@ async def upload_prices(file: UploadFile = File(...)):
     data_dir.mkdir(parents=True, exist_ok=True)
     dest = data_dir / PRICE_FILENAME
     dest.write_bytes(content)
-    db.refresh_data()
+    db.refresh_data(["prices"])
     return {"status": "ok", "file": PRICE_FILENAME}
 
 
@@ -490,11 +491,33 @@ def get_disassembly_stats_api(group_by: str = "day", date_from: Optional[str] =
 
 
 @app.get("/api/disassembly/summary", dependencies=[Depends(require_auth)])
-def get_disassembly_summary_api(period: str = "month", top_in: int = 5, top_internal: int = 15, top_out: int = 15):
-    """Сводка разборки: топ поступлений, списаний, отгрузок за период (неделя / месяц / всё время)."""
+def get_disassembly_summary_api(
+    period: str = "month",
+    top_in: int = 5,
+    top_internal: int = 15,
+    top_out: int = 15,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    """Сводка разборки: топ поступлений, списаний, отгрузок за период (неделя / месяц / всё время) или за произвольные даты."""
+    from datetime import datetime as dt
+    d_from = None
+    d_to = None
+    if date_from:
+        try:
+            d_from = dt.strptime(date_from, "%Y-%m-%d").date()
+        except ValueError:
+            pass
+    if date_to:
+        try:
+            d_to = dt.strptime(date_to, "%Y-%m-%d").date()
+        except ValueError:
+            pass
     if period not in ("week", "month", "all"):
         period = "month"
-    return db.get_disassembly_summary(period=period, top_in=top_in, top_internal=top_internal, top_out=top_out)
+    return db.get_disassembly_summary(
+        period=period, top_in=top_in, top_internal=top_internal, top_out=top_out, date_from=d_from, date_to=d_to
+    )
 
 
 @app.get("/api/disassembly/detail", dependencies=[Depends(require_auth)])
@@ -661,8 +684,8 @@ async def admin_replace_disassembly(
     except Exception as e:
         log.append(f"  Ошибка: {e}")
         return {"error": str(e), "log": log}
-    log.append("Пересчёт данных (refresh_data)...")
-    db.refresh_data()
+    log.append("Пересчёт данных разборки (refresh_data: disassembly)...")
+    db.refresh_data(["disassembly"])
     log.append("Готово. Данные разборки перезагружены.")
     return {"status": "ok", "message": "Данные разборки перезагружены", "log": log}
 
@@ -813,10 +836,19 @@ def admin_delete_custom_role(role_id: str):
 # ─── Расширенный журнал изменений (workforce) ─────────────────────────────────
 
 @app.get("/api/admin/workforce-changelog", dependencies=[Depends(require_admin)])
-def admin_workforce_changelog(limit: int = 500):
-    """Подробный журнал изменений графиков и табелей."""
+def admin_workforce_changelog(
+    limit: int = 500,
+    production: Optional[str] = None,
+    username: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    before: Optional[int] = None,
+):
+    """Подробный журнал изменений графиков и табелей (фильтры и постраничная выдача по курсору before)."""
     import workforce as wf_mod
-    return {"entries": wf_mod.get_changelog(limit)}
+    entries = wf_mod.get_changelog(limit, production, username, date_from, date_to, before)
+    next_cursor = entries[-1]["id"] if len(entries) == limit and entries else None
+    return {"entries": entries, "next_cursor": next_cursor}
 
 
 @app.get("/api/admin/download-data", dependencies=[Depends(require_admin)])
@@ -895,6 +927,22 @@ def get_department_stats(production: str = "", department: str = "", date_from:
     return db.get_department_period_stats(production.strip(), department.strip(), d_from, d_to)
 
 
+@app.get("/api/productivity", dependencies=[Depends(require_auth)])
+def get_productivity(date_from: str = "", date_to: str = "", production: str = "", department: str = "", user: str = ""):
+    """Выпуск, часы и ФОТ по табелю за период (всё / производство / участок / сотрудник): выпуск в час, ФОТ на единицу."""
+    from datetime import datetime
+    if not date_from or not date_to:
+        return {"error": "Укажите date_from и date_to (YYYY-MM-DD)"}
+    try:
+        d_from = datetime.strptime(date_from, "%Y-%m-%d").date()
+        d_to = datetime.strptime(date_to, "%Y-%m-%d").date()
+    except ValueError:
+        return {"error": "Формат дат: YYYY-MM-DD"}
+    if d_from > d_to:
+        return {"error": "Дата начала не может быть позже даты конца"}
+    return db.get_productivity_stats(d_from, d_to, production or None, department or None, user or None)
+
+
 @app.get("/api/day/{date_str}", dependencies=[Depends(require_auth)])
 def get_day_stats(date_str: str):
     """Аналитика за день (date_str: YYYY-MM-DD)."""
@@ -1189,29 +1237,43 @@ def wf_save_snapshot(production: str, year: int, month: int, request: Request):
         raise HTTPException(status_code=403, detail="Только менеджер или администратор")
     meta = wf.save_schedule_snapshot(production, year, month)
     wf.log_change(_get_request_username(request), "график: зафиксирован снимок", production, year, month,
-                  f"{meta['employee_count']} сотрудников")
+                  f"версия {meta['version']}, {meta['employee_count']} сотрудников")
     return {"ok": True, **meta}
 
 
 @app.get("/api/workforce/schedule/{production}/{year}/{month}/snapshot")
-def wf_get_snapshot(production: str, year: int, month: int, request: Request):
-    """Получить мета-данные существующего снимка."""
+def wf_get_snapshot(production: str, year: int, month: int, request: Request, version: Optional[int] = None):
+    """Получить мета-данные существующего снимка (по умолчанию последнего)."""
     if production not in wf.PRODUCTIONS:
         raise HTTPException(status_code=404, detail="Производство не найдено")
     _require_schedule_access(request, production)
-    snap = wf.get_schedule_snapshot(production, year, month)
+    snap = wf.get_schedule_snapshot(production, year, month, version)
     if snap is None:
         return {"has_snapshot": False}
-    return {"has_snapshot": True, "saved_at": snap.get("snapshot_saved_at"), "employee_count": len(snap.get("employees", []))}
+    return {
+        "has_snapshot": True,
+        "saved_at": snap.get("snapshot_saved_at"),
+        "employee_count": len(snap.get("employees", [])),
+        "version": snap.get("snapshot_version"),
+    }
+
+
+@app.get("/api/workforce/schedule/{production}/{year}/{month}/snapshots")
+def wf_list_snapshots(production: str, year: int, month: int, request: Request):
+    """Все версии снимков графика за месяц (новые сверху)."""
+    if production not in wf.PRODUCTIONS:
+        raise HTTPException(status_code=404, detail="Производство не найдено")
+    _require_schedule_access(request, production)
+    return {"snapshots": wf.list_schedule_snapshots(production, year, month)}
 
 
 @app.get("/api/workforce/schedule/{production}/{year}/{month}/diff")
-def wf_snapshot_diff(production: str, year: int, month: int, request: Request):
-    """Сравнить текущий график со снимком."""
+def wf_snapshot_diff(production: str, year: int, month: int, request: Request, version: Optional[int] = None):
+    """Сравнить текущий график со снимком (по умолчанию последним)."""
     if production not in wf.PRODUCTIONS:
         raise HTTPException(status_code=404, detail="Производство не найдено")
     _require_schedule_access(request, production)
-    return wf.diff_schedule_with_snapshot(production, year, month)
+    return wf.diff_schedule_with_snapshot(production, year, month, version)
 
 
 @app.post("/api/workforce/schedule/{production}/{year}/{month}/import")
@@ -1229,10 +1291,12 @@ async def wf_import_schedule(production: str, year: int, month: int, request: Re
     schedule = wf.import_schedule_from_tsv(production, year, month, tsv)
     if not schedule.get("employees"):
         raise HTTPException(status_code=400, detail="Не удалось распознать данные. Проверьте формат.")
-    wf.save_schedule(production, year, month, schedule)
-    added = wf.merge_employees_from_schedule(production, schedule)
-    wf.log_change(_get_request_username(request), "график: импорт", production, year, month, f"{len(schedule['employees'])} сотрудников, +{added} в список")
-    return {"ok": True, "count": len(schedule["employees"]), "new_employees": added, "schedule": schedule}
+    imported = wf.apply_month_import(production, year, month, schedule)
+    schedule, added, diff = imported["schedule"], imported["added"], imported["diff"]
+    wf.log_change(_get_request_username(request), "график: импорт", production, year, month,
+                  f"{len(schedule['employees'])} сотрудников, +{added} в список; "
+                  f"новых {len(diff['added'])}, убрано {len(diff['removed'])}, изменено {len(diff['changed'])}")
+    return {"ok": True, "count": len(schedule["employees"]), "new_employees": added, "schedule": schedule, "diff": diff}
 
 
 # ── Табель ────────────────────────────────────────────────────────────────────
@@ -1297,6 +1361,53 @@ async def wf_update_timesheet_cell(production: str, year: int, month: int, reque
     return {"ok": True, "records": ts.get("records", {})}
 
 
+@app.patch("/api/workforce/timesheet/{production}/{year}/{month}/cells")
+async def wf_update_timesheet_cells(production: str, year: int, month: int, request: Request):
+    """Обновить пачку ячеек табеля одним запросом: {"edits": [{"employee_id", "day", "hours"}, ...]}.
+    Все правки применяются одной транзакцией. Бригадиры могут редактировать только сегодняшний день.
+    """
+    if production not in wf.PRODUCTIONS:
+        raise HTTPException(status_code=404, detail="Производство не найдено")
+    access = _require_schedule_access(request, production)
+    body = await request.json()
+    raw_edits = body.get("edits")
+    if not isinstance(raw_edits, list) or not raw_edits:
+        raise HTTPException(status_code=400, detail="edits — непустой список правок")
+    edits = []
+    for item in raw_edits:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Каждая правка — объект {employee_id, day, hours}")
+        emp_id = item.get("employee_id")
+        day = str(item.get("day", ""))
+        hours = item.get("hours")  # None = очистить
+        if not emp_id or not day:
+            raise HTTPException(status_code=400, detail="employee_id и day обязательны в каждой правке")
+        if hours is not None:
+            try:
+                hours = float(hours)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"Некорректные часы: {hours}")
+            if not math.isfinite(hours):
+                raise HTTPException(status_code=400, detail=f"Некорректные часы: {hours}")
+        edits.append((str(emp_id), day, hours))
+
+    # Бригадир может редактировать только сегодняшний день
+    if access["role"] == "brigadier":
+        from datetime import date as _date
+        today = _date.today()
+        if today.year != year or today.month != month or any(day != str(today.day) for _, day, _ in edits):
+            raise HTTPException(
+                status_code=403,
+                detail=f"Бригадир может вносить данные только за сегодняшний день ({today.day} {today.month} {today.year})"
+            )
+    ts = wf.update_timesheet_cells(production, year, month, edits)
+    employees = len({emp_id for emp_id, _, _ in edits})
+    cleared = sum(1 for _, _, hours in edits if hours is None)
+    wf.log_change(_get_request_username(request), "табель: ячейки", production, year, month,
+                  f"{len(edits)} ячеек, сотрудников: {employees}, очищено: {cleared}")
+    return {"ok": True, "applied": len(edits), "records": ts.get("records", {})}
+
+
 # ── Комбинированный импорт График + Табель ───────────────────────────────────
 
 @app.post("/api/workforce/combined-import/{production}/{year}/{month}")
@@ -1324,11 +1435,12 @@ async def wf_combined_import(production: str, year: int, month: int, request: Re
             detail="Не удалось распознать данные. Проверьте формат: строка заголовка должна содержать числа дней (1, 2, 3…), а данные — парами (план | факт) для каждого дня."
         )
 
-    wf.save_schedule(production, year, month, schedule)
-    wf.save_timesheet(production, year, month, timesheet)
-    added = wf.merge_employees_from_schedule(production, schedule)
+    imported = wf.apply_month_import(production, year, month, schedule, timesheet)
+    schedule, timesheet = imported["schedule"], imported["timesheet"]
+    added, diff = imported["added"], imported["diff"]
     wf.log_change(_get_request_username(request), "импорт график+табель", production, year, month,
-                  f"{len(schedule['employees'])} сотрудников, +{added} в список")
+                  f"{len(schedule['employees'])} сотрудников, +{added} в список; "
+                  f"новых {len(diff['added'])}, убрано {len(diff['removed'])}, изменено {len(diff['changed'])}")
 
     ts_filled = sum(1 for v in timesheet.get("records", {}).values() if v)
     return {
@@ -1337,6 +1449,7 @@ async def wf_combined_import(production: str, year: int, month: int, request: Re
         "timesheet_filled": ts_filled,
         "schedule": schedule,
         "timesheet": timesheet,
+        "diff": diff,
     }
 
 
@@ -1365,6 +1478,32 @@ def wf_assign_sections_luminarc():
     return {"ok": True, "count": n}
 
 
+@app.post("/api/workforce/assign-sections", dependencies=[Depends(require_admin)])
+def wf_assign_sections_all():
+    """Распределить по участкам сотрудников всех производств по должности."""
+    counts = wf.assign_sections()
+    return {"ok": True, "counts": counts}
+
+
+@app.get("/api/workforce/section-rules", dependencies=[Depends(require_admin)])
+def wf_get_section_rules():
+    """Действующие правила определения участков и стандартные правила."""
+    return {"rules": wf.get_section_rules(), "default": wf.DEFAULT_SECTION_RULES}
+
+
+@app.put("/api/workforce/section-rules", dependencies=[Depends(require_admin)])
+async def wf_save_section_rules(request: Request):
+    """Сохранить правила участков: {"rules": {производство: {infer, normalize}}} или {"rules": null} — сброс."""
+    body = await request.json()
+    try:
+        wf.save_section_rules(body.get("rules"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    wf.log_change(_get_request_username(request), "участки: правила", None, None, None,
+                  "сброс" if body.get("rules") is None else ", ".join(body["rules"]))
+    return {"ok": True, "rules": wf.get_section_rules()}
+
+
 @app.get("/api/workforce/employees/{production}")
 def wf_get_employees(production: str, request: Request):
     if production not in wf.PRODUCTIONS:
@@ -1403,11 +1542,9 @@ async def wf_import_employees(production: str, request: Request):
         raise HTTPException(status_code=400, detail="Не удалось распознать данные. Проверьте формат.")
     # Можно добавить к существующим или заменить — режим передаётся в теле
     mode = body.get("mode", "replace")  # "replace" или "append"
-    if mode == "append":
-        existing = wf.get_employees(production)
-        employees = existing + employees
-    wf.save_employees(production, employees)
-    return {"ok": True, "count": len(employees), "employees": employees}
+    merged = wf.merge_imported_employees(production, employees, mode)
+    employees = merged["employees"]
+    return {"ok": True, "count": len(employees), "employees": employees, "diff": merged["diff"]}
 
 
 @app.delete("/api/workforce/employees/{production}/{employee_id}")
@@ -1519,15 +1656,27 @@ async def wf_update_section_by_name(production: str, request: Request):
 # ── Журнал изменений ─────────────────────────────────────────────────────────
 
 @app.get("/api/workforce/changelog")
-def wf_changelog(request: Request, limit: int = 200):
-    """Журнал изменений графиков и табелей. Только для администратора."""
+def wf_changelog(
+    request: Request,
+    limit: int = 200,
+    production: Optional[str] = None,
+    username: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    before: Optional[int] = None,
+):
+    """Журнал изменений графиков и табелей. Только для администратора.
+    Фильтры: production, username, date_from/date_to; следующая страница — before=next_cursor.
+    """
     token = request.cookies.get("analytics_session")
-    username = auth.get_username(token)
-    if not username:
+    current_user = auth.get_username(token)
+    if not current_user:
         raise HTTPException(status_code=401, detail="Требуется авторизация")
-    if not auth.is_admin(username):
+    if not auth.is_admin(current_user):
         raise HTTPException(status_code=403, detail="Только для администратора")
-    return {"entries": wf.get_changelog(limit)}
+    entries = wf.get_changelog(limit, production, username, date_from, date_to, before)
+    next_cursor = entries[-1]["id"] if len(entries) == limit and entries else None
+    return {"entries": entries, "next_cursor": next_cursor}
 
 
 # ── Аналитика ─────────────────────────────────────────────────────────────────
@@ -1560,6 +1709,7 @@ def wf_day_analytics(year: int, month: int, day: int, request: Request):
 # Модуль рентабельности
 # ---------------------------------------------------------------------------
 
+import profitability
 import profitability_parser as prof_parser
 import profitability_store as prof_store
 
@@ -1576,28 +1726,51 @@ async def profitability_upload_weekly(
     period_id: str = Form(default=""),
     period_label: str = Form(default=""),
 ):
-    """Загрузка еженедельного отчёта WB."""
+    """
+    Загрузка еженедельного отчёта WB. Повторная загрузка того же файла в период не разбирается
+    и не добавляется (ответ с duplicate: true).
+    """
     data = await file.read()
-    try:
-        # Проверяем что файл парсится
-        prof_parser.parse_weekly_report(data)
-    except Exception as e:
-        return JSONResponse({"error": f"Ошибка чтения файла: {e}"}, status_code=400)
-
+    report_hash = prof_store.content_hash(data)
     if not period_id:
-        # Автодетект недели из дат отчёта
-        period_id = prof_parser.detect_week_from_report(data) or ""
+        # Тот же файл уже есть в каком-то периоде — это повтор, неделю по датам не определяем;
+        # иначе автодетект недели из дат отчёта (по первым строкам)
+        known = prof_store.find_weekly_report(report_hash)
+        period_id = known[0] if known else prof_parser.detect_week_from_report(data) or ""
     if not period_id:
         import time as _time
         period_id = str(int(_time.time()))
     period_id = _parse_period_id(period_id)
+
+    try:
+        duplicate = prof_store.has_weekly_report(period_id, report_hash)
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if duplicate:
+        period = next((p for p in prof_store.list_periods() if p["id"] == period_id), None)
+        return {
+            "ok": True,
+            "duplicate": True,
+            "period": period,
+            "files_count": prof_store.count_weekly_reports(period_id),
+        }
+
+    # Файл с тем же содержимым мог быть разобран раньше (в другом периоде)
+    if not prof_store.has_parsed_weekly(report_hash):
+        try:
+            # Сначала быстрая проверка заголовка, затем разбор; результат сохраняется и дальше отчёт не перечитывается
+            prof_parser.validate_weekly_report(data)
+            parsed = prof_parser.parse_weekly_report(data)
+        except Exception as e:
+            return JSONResponse({"error": f"Ошибка чтения файла: {e}"}, status_code=400)
+        prof_store.save_parsed_weekly(report_hash, parsed)
+
     if not period_label:
         period_label = period_id
-
-    prof_store.save_upload("weekly", data, period_id)
+    prof_store.add_weekly_report(period_id, data, file.filename or "report.xlsx")
     count = prof_store.count_weekly_reports(period_id)
     period = prof_store.save_period(period_id, period_label, file.filename or "report.xlsx")
-    return {"ok": True, "period": period, "files_count": count}
+    return {"ok": True, "duplicate": False, "period": period, "files_count": count}
 
 
 @app.post("/api/profitability/upload/nomenclature", dependencies=[Depends(require_admin)])
@@ -1647,53 +1820,51 @@ def profitability_periods():
 
 @app.get("/api/profitability/data", dependencies=[Depends(require_auth)])
 def profitability_data(period_id: str, compare_id: str = ""):
-    """Расчёт рентабельности для периода. Опционально — сравнение с другим."""
-    report_files = prof_store.load_weekly_reports(period_id)
-    if not report_files:
-        raise HTTPException(status_code=404, detail="Период не найден")
-
-    nomenclature_map = prof_store.load_parsed_nomenclature() or {}
-    costs_map = prof_store.load_parsed_costs() or {}
-    custom_mappings = prof_store.get_custom_mappings()
-    work_rates = prof_store.get_work_rates_for_period(period_id)
-
+    """Расчёт рентабельности для периода. Опционально — сравнение с другим (считаются вместе, параллельно)."""
+    calcs: dict = {}
+    if compare_id:
+        try:
+            calcs = profitability.calculate_periods([period_id, compare_id])
+        except Exception:
+            calcs = {}
     try:
-        import pandas as pd
-        dfs = [prof_parser.parse_weekly_report(f) for f in report_files]
-        report_df = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
-        rows, unmatched = prof_parser.calculate_profitability(
-            report_df, nomenclature_map, costs_map, custom_mappings, work_rates
-        )
+        calc = calcs[period_id] if period_id in calcs else profitability.calculate_period(period_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка расчёта: {e}")
+    if calc is None:
+        raise HTTPException(status_code=404, detail="Период не найден")
 
     result = {
         "period_id": period_id,
-        "files_count": len(report_files),
-        "work_rates": work_rates,
-        "rows": rows,
-        "unmatched": unmatched,
+        "files_count": calc["files_count"],
+        "work_rates": calc["work_rates"],
+        "rows": calc["rows"],
+        "unmatched": calc["unmatched"],
         "compare": None,
     }
 
-    if compare_id:
-        compare_files = prof_store.load_weekly_reports(compare_id)
-        if compare_files:
-            compare_rates = prof_store.get_work_rates_for_period(compare_id)
-            try:
-                import pandas as pd
-                cdfs = [prof_parser.parse_weekly_report(f) for f in compare_files]
-                compare_df = pd.concat(cdfs, ignore_index=True) if len(cdfs) > 1 else cdfs[0]
-                compare_rows, _ = prof_parser.calculate_profitability(
-                    compare_df, nomenclature_map, costs_map, custom_mappings, compare_rates
-                )
-                result["compare"] = {"period_id": compare_id, "rows": compare_rows}
-            except Exception:
-                pass
+    compare = calcs.get(compare_id) if compare_id else None
+    if compare is not None:
+        result["compare"] = {"period_id": compare_id, "rows": compare["rows"]}
 
     return result
 
 
+@app.get("/api/profitability/series", dependencies=[Depends(require_auth)])
+def profitability_series(period_ids: str = "", articles: bool = False, vid: str = ""):
+    """
+    Показатели рентабельности по видам (и артикулам, articles=true) за несколько периодов.
+    period_ids — через запятую, по порядку на графике; пусто — все периоды по возрастанию.
+    """
+    ids = [_parse_period_id(p) for p in period_ids.split(",") if p.strip()]
+    if not ids:
+        ids = sorted(p["id"] for p in prof_store.list_periods())
+    try:
+        return profitability.period_series(ids, include_articles=articles, vid=vid.strip() or None)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка расчёта: {e}")
+
+
 @app.get("/api/profitability/work-rates", dependencies=[Depends(require_auth)])
 def profitability_get_work_rates():
     """Все ставки работы."""
@@ -1718,7 +1889,7 @@ def profitability_get_mappings():
     """Кастомные маппинги артикул → вид номенклатуры."""
     return {
         "mappings": prof_store.get_custom_mappings(),
-        "history": prof_store.get_mappings_history()[-50:],
+        "history": prof_store.get_mappings_history(limit=50),
     }
 
 
@@ -1739,28 +1910,54 @@ async def profitability_set_mappings(request: Request, username: str = Depends(r
 @app.get("/api/profitability/unmatched", dependencies=[Depends(require_auth)])
 def profitability_unmatched(period_id: str):
     """Список несопоставленных артикулов для периода."""
-    data = prof_store.load_upload("weekly", period_id)
+    try:
+        data = profitability.unmatched_articles(period_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
     if data is None:
         raise HTTPException(status_code=404, detail="Период не найден")
+    return data
 
-    nomenclature_map = prof_store.load_parsed_nomenclature() or {}
-    custom_mappings = prof_store.get_custom_mappings()
-    # case-insensitive lookup
-    combined_lower = {k.lower(): v for k, v in nomenclature_map.items()}
-    combined_lower.update({k.lower(): v for k, v in custom_mappings.items()})
 
+@app.get("/api/profitability/suggestions", dependencies=[Depends(require_auth)])
+def profitability_suggestions(period_id: str, limit: int = 3):
+    """Виды-кандидаты для несопоставленных артикулов периода."""
     try:
-        report_df = prof_parser.parse_weekly_report(data)
+        data = profitability.suggest_vids(period_id, limit=max(1, min(limit, 10)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=404, detail="Период не найден")
+    return data
 
-    all_articles = report_df["артикул"].unique().tolist()
-    unmatched = [a for a in all_articles if a and combined_lower.get(a.lower()) is None]
-
-    # Список всех известных видов для UI
-    all_vids = sorted(set(nomenclature_map.values()) | set(custom_mappings.values()))
 
-    return {"unmatched": sorted(unmatched), "all_vids": all_vids}
+@app.post("/api/profitability/suggestions/accept", dependencies=[Depends(require_admin)])
+async def profitability_accept_suggestions(request: Request, username: str = Depends(require_auth)):
+    """
+    Принять лучшие подсказки видов как маппинги: для перечисленных артикулов или для всех с оценкой от min_score
+    (min_score > 0 обязателен, если артикулы не перечислены; кандидаты только по бренду при этом не принимаются).
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return JSONResponse({"error": "Ожидается JSON"}, status_code=400)
+    period_id = body.get("period_id", "")
+    articles = body.get("articles")
+    if articles is not None and (not isinstance(articles, list) or not all(isinstance(a, str) for a in articles)):
+        return JSONResponse({"error": "articles должен быть списком артикулов"}, status_code=400)
+    try:
+        min_score = float(body.get("min_score", 0.0))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "min_score должен быть числом"}, status_code=400)
+    if not math.isfinite(min_score):
+        return JSONResponse({"error": "min_score должен быть числом"}, status_code=400)
+    try:
+        data = profitability.accept_suggestions(period_id, articles=articles, min_score=min_score, username=username)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Период не найден")
+    return {"ok": True, "count": len(data["mappings"]), "mappings": data["mappings"]}
 
 
 @app.delete("/api/profitability/periods/{period_id}", dependencies=[Depends(require_admin)])
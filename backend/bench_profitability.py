@@ -0,0 +1,79 @@
+"""
+Замер calculate_profitability на синтетическом отчёте.
+
+Запуск из папки backend:
+    python bench_profitability.py [--articles 50000] [--rows 200000] [--repeat 3]
+
+Генерирует отчёт (как после parse_weekly_report), файл видов и себестоимости на заданное число артикулов
+и печатает время расчёта (лучшее из повторов).
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from profitability_parser import brand_to_direction, calculate_profitability
+
+_BRANDS = ["Luminarc", "ТвойЧай", "Гравировка", "Люминар", ""]
+
+
+def make_inputs(articles: int, rows: int, seed: int = 0):
+    """Синтетические входы: (report_df, nomenclature_map, costs_map, custom_mappings, work_rates)."""
+    rng = np.random.default_rng(seed)
+    names = np.array([f"ART-{i}" for i in range(articles)], dtype=object)
+    art = names[rng.integers(0, articles, rows)]
+    brand = np.array(_BRANDS, dtype=object)[rng.integers(0, len(_BRANDS), rows)]
+    qty = rng.choice([-1.0, 0.0, 1.0, 1.0, 2.0], rows)
+    price = rng.uniform(50, 1500, rows).round(2)
+    real = qty * price
+    acq = rng.uniform(0, 20, rows)
+    payout = real * 0.7
+    report_df = pd.DataFrame({
+        "артикул": art,
+        "бренд": brand,
+        "дата_продажи": pd.NaT,
+        "количество": qty,
+        "цена": price,
+        "реализация": real,
+        "эквайринг": acq,
+        "к_перечислению": payout,
+        "услуги_мп": real - acq - payout,
+        "логистика": rng.uniform(0, 80, rows),
+        "реклама": np.where(rng.random(rows) < 0.01, rng.uniform(0, 5000, rows), 0.0),
+    })
+    report_df["направление"] = report_df["бренд"].map(brand_to_direction)
+
+    vids = [f"Вид {i}" for i in range(max(articles // 200, 1))]
+    nomenclature_map = {name: vids[i % len(vids)] for i, name in enumerate(names) if i % 10}
+    costs_map = {vid: {"qty": 1.0, "total_cost": 100.0, "unit_cost": 100.0, "level": "vid"} for vid in vids}
+    for name in names[::7]:
+        costs_map[name] = {"qty": 1.0, "total_cost": 80.0, "unit_cost": 80.0, "level": "article"}
+    custom_mappings = {name: vids[0] for name in names[::97]}
+    work_rates = {"luminarc": 12.0, "engraving": 30.0, "tea": 8.0}
+    return report_df, nomenclature_map, costs_map, custom_mappings, work_rates
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--articles", type=int, default=50000)
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    inputs = make_inputs(args.articles, args.rows)
+    best = None
+    for _ in range(max(args.repeat, 1)):
+        t0 = time.perf_counter()
+        rows, unmatched = calculate_profitability(*inputs)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        f"артикулов: {args.articles}, строк отчёта: {args.rows}, видов: {len(rows)}, "
+        f"без вида: {len(unmatched)}, расчёт: {best:.3f} с"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 """Кэш данных и бизнес-логика аналитики."""
 
-import json
+import calendar
 import os
+from bisect import bisect_left, bisect_right
 from pathlib import Path
 from datetime import datetime, date, timedelta
 from typing import Any, Optional
+import numpy as np
 import pandas as pd
 
+import ingest_manifest
 from parser import load_all_data, load_all_employee_output_data
 from productions import build_productions_stats, get_block_config
 
@@ -18,12 +21,22 @@ except ImportError:
     load_nomenclature_prices = None
     get_disassembly_sources_info = None
 
+# Хранилище цен номенклатуры (история цен, загрузка прайса только при изменении файла)
+try:
+    import price_store
+except ImportError:
+    price_store = None
+
+# Табели (часы и ФОТ сотрудников) — вторая сторона куба выработки
+try:
+    import workforce
+except ImportError:
+    workforce = None
+
 # Папка с данными. DATA_DIR из env — для persistent disk на Render (загруженные файлы сохраняются)
 _default = Path(__file__).resolve().parent.parent / "data"
 DATA_DIR = Path(os.environ.get("DATA_DIR", _default))
 ROOT_DIR = Path(__file__).resolve().parent.parent
-# Файл кэша объединённых цен: сохраняем слияние прайса, чтобы при повторной загрузке/рестарте старые цены не пропадали
-NOMENCLATURE_PRICES_CACHE = "nomenclature_prices_cache.json"
 
 _df: Optional[pd.DataFrame] = None
 _df_employee: Optional[pd.DataFrame] = None
@@ -33,6 +46,27 @@ _df_out_warehouse: Optional[pd.DataFrame] = None
 _df_internal_consumption: Optional[pd.DataFrame] = None
 _nomenclature_prices: Optional[dict[str, float]] = None
 _nomenclature_prices_lower: Optional[dict[str, float]] = None  # ключ в нижнем регистре для поиска без учёта регистра
+# Нарастающие дневные итоги разборки по номенклатуре: flow -> {"dates": [...], "cum": DataFrame}
+_disassembly_daily: dict[str, dict[str, Any]] = {}
+# Кэш топов сводки разборки: (flow, period, n) -> список; сбрасывается при перезагрузке данных и смене дня
+_disassembly_top_cache: dict[tuple[str, str, int], list[dict]] = {}
+_disassembly_top_cache_day: Optional[date] = None
+# Словарь номенклатуры разборки (отсортированные уникальные наименования) и признак «цена есть» по каждому
+_disassembly_vocab: list[str] = []
+_disassembly_vocab_by_lower: dict[str, list[int]] = {}
+_disassembly_price_present: list[bool] = []
+_disassembly_missing: Optional[list[str]] = None
+# Куб выработки (день, производство, участок, сотрудник) -> выпуск, часы и ФОТ по табелю.
+# Сторона выработки пересобирается с семейством employee_output (вместе со всеми срезами), сторона табелей —
+# по месяцам: при смене версии месяца в workforce.labor_versions() обновляются только строки куба этого месяца.
+# Срезы: столбцы среза -> {значения: {"dates": [...], "values": ndarray дни x (выпуск, часы, ФОТ), "cum": (дни + 1) x 3}}
+_productivity_output: Optional[pd.DataFrame] = None
+_productivity_names: dict[str, str] = {}
+_productivity_cube: Optional[pd.DataFrame] = None
+_productivity_slices: Optional[dict[tuple, dict[tuple, dict[str, Any]]]] = None
+# Табели по месяцам: (производство workforce, год, месяц) -> (часы и ФОТ по (день, производство, ФИО), ФИО по ключу)
+_productivity_labor: dict[tuple, tuple[pd.DataFrame, dict[str, str]]] = {}
+_productivity_labor_versions: dict[tuple, tuple] = {}
 
 
 def get_data_dir() -> Path:
@@ -55,10 +89,9 @@ def _empty_disassembly_dfs():
     )
 
 
-def refresh_data():
-    """Перезагрузить данные из файлов (продукция + выработка сотрудников + разборка возвратов). Прайс: при повторной загрузке обновляются/добавляются позиции из файла, отсутствующие в новом файле не удаляются. Не роняет приложение при ошибке."""
-    global _df, _df_employee, _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption, _nomenclature_prices, _nomenclature_prices_lower
-    ensure_data_dir()
+def _refresh_production() -> None:
+    """Семейство «выпуск продукции»: перечитать файлы выпуска."""
+    global _df
     try:
         _df = load_all_data(str(DATA_DIR))
         if not _df.empty and "date" in _df.columns:
@@ -73,6 +106,12 @@ def refresh_data():
         import sys
         print(f"[данные] Ошибка загрузки продукции: {e}", file=sys.stderr)
         _df = pd.DataFrame(columns=["article", "nomenclature_type", "product_name", "quantity", "date", "department", "year_month", "date_only"])
+    _record_frame_summary("production", _df)
+
+
+def _refresh_employee_output() -> None:
+    """Семейство «выработка сотрудников»: перечитать файлы выработки."""
+    global _df_employee
     try:
         _df_employee = load_all_employee_output_data(str(DATA_DIR))
         if not _df_employee.empty and "date" in _df_employee.columns:
@@ -81,6 +120,12 @@ def refresh_data():
             )
     except Exception:
         _df_employee = pd.DataFrame(columns=["date", "date_only"])
+    _record_frame_summary("employee_output", _df_employee)
+
+
+def _refresh_disassembly() -> None:
+    """Семейство «разборка возвратов»: перечитать файлы 001–004."""
+    global _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption
     if load_all_disassembly_data:
         try:
             _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption = load_all_disassembly_data(str(DATA_DIR))
@@ -88,52 +133,88 @@ def refresh_data():
             _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption = _empty_disassembly_dfs()
     else:
         _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption = _empty_disassembly_dfs()
-    if load_nomenclature_prices:
-        try:
-            new_prices = load_nomenclature_prices(str(DATA_DIR)) or {}
-            # Берём уже накопленные цены: из кэша на диске (переживает рестарт) или из памяти
-            cache_path = DATA_DIR / NOMENCLATURE_PRICES_CACHE
-            existing = {}
-            if cache_path.exists():
-                try:
-                    with open(cache_path, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    if isinstance(data, dict):
-                        existing = {}
-                        for k, v in data.items():
-                            try:
-                                x = float(v)
-                                if x == x and abs(x) != float("inf"):
-                                    existing[str(k)] = x
-                            except (TypeError, ValueError):
-                                pass
-                except Exception:
-                    pass
-            if not existing and _nomenclature_prices is not None:
-                existing = _nomenclature_prices
-            # Новые/обновлённые из файла перекрывают старые; позиции, которых нет в файле, остаются
-            _nomenclature_prices = {**existing, **new_prices}
-            _nomenclature_prices_lower = {str(k).strip().lower(): v for k, v in _nomenclature_prices.items()}
-            # Сохраняем объединённый прайс на диск, чтобы после рестарта цены не пропадали
-            try:
-                with open(cache_path, "w", encoding="utf-8") as f:
-                    json.dump(_nomenclature_prices, f, ensure_ascii=False, indent=0)
-            except Exception:
-                pass
-        except Exception:
-            if _nomenclature_prices is None:
-                _nomenclature_prices = {}
-                _nomenclature_prices_lower = {}
-    else:
+
+
+def _refresh_prices() -> None:
+    """Семейство «прайс»: при изменении файла обновляются/добавляются позиции, отсутствующие в новом файле не удаляются.
+    Признак «цена есть» в словаре разборки обновляется только по изменившимся позициям."""
+    global _nomenclature_prices, _nomenclature_prices_lower
+    if not price_store:
         _nomenclature_prices = {}
         _nomenclature_prices_lower = {}
+        return
+    try:
+        # Файл прайса перечитывается только при изменении отпечатка; история цен хранится в price_store
+        first_load = _nomenclature_prices is None
+        changed = price_store.sync_from_file(DATA_DIR)
+        if changed or first_load:
+            _nomenclature_prices = price_store.get_current_prices(DATA_DIR)
+            _nomenclature_prices_lower = {str(k).strip().lower(): v for k, v in _nomenclature_prices.items()}
+        if first_load:
+            _recompute_price_presence()
+        elif changed:
+            _mark_prices_present(changed.keys())
+    except Exception:
+        if _nomenclature_prices is None:
+            _nomenclature_prices = {}
+            _nomenclature_prices_lower = {}
+
+
+# Семейства данных: загрузчик и производные кэши, которые нужно пересобрать после его перезагрузки.
+# Производные задаются по имени функции (определены ниже в модуле); общий кэш пересобирается один раз.
+DATA_FAMILIES = ("production", "employee_output", "disassembly", "prices")
+_FAMILY_LOADERS = {
+    "production": _refresh_production,
+    "employee_output": _refresh_employee_output,
+    "disassembly": _refresh_disassembly,
+    "prices": _refresh_prices,
+}
+_FAMILY_DERIVED: dict[str, list[str]] = {
+    "production": [],
+    "employee_output": ["_rebuild_productivity_output"],
+    "disassembly": ["_rebuild_disassembly_daily", "_rebuild_disassembly_vocabulary"],
+    "prices": [],
+}
+
+
+def refresh_data(families: Optional[list[str]] = None):
+    """Перезагрузить данные из файлов. families — какие семейства перечитать (по умолчанию все: выпуск продукции,
+    выработка сотрудников, разборка возвратов, прайс); пересобираются только их производные кэши. Не роняет приложение при ошибке."""
+    ensure_data_dir()
+    # Манифест с диска: записи видов, которые не перечитываются (прайс без изменений), переживают рестарт
+    ingest_manifest.load(DATA_DIR)
+    selected = [f for f in DATA_FAMILIES if families is None or f in families]
+    for family in selected:
+        _FAMILY_LOADERS[family]()
+    rebuilt: set[str] = set()
+    for family in selected:
+        for name in _FAMILY_DERIVED[family]:
+            if name not in rebuilt:
+                rebuilt.add(name)
+                globals()[name]()
+    ingest_manifest.save(DATA_DIR)
+
+
+def _record_frame_summary(kind: str, df: Optional[pd.DataFrame]) -> None:
+    """Сводка загруженного датафрейма в манифест: строки, даты, строк по дням (для админки без пересчёта)."""
+    if df is None or df.empty or "date_only" not in df.columns:
+        ingest_manifest.record_kind(kind, {"rows": 0 if df is None else len(df), "dates": 0, "min_date": None, "max_date": None, "daily_rows": []})
+        return
+    daily = df.groupby("date_only").size().sort_index()
+    ingest_manifest.record_kind(kind, {
+        "rows": len(df),
+        "dates": int(len(daily)),
+        "min_date": str(daily.index.min()),
+        "max_date": str(daily.index.max()),
+        "daily_rows": [{"date": str(d), "rows": int(n)} for d, n in daily.items()],
+    })
 
 
 def get_df() -> pd.DataFrame:
     """Получить датафрейм продукции."""
     global _df
     if _df is None:
-        refresh_data()
+        refresh_data(["production"])
     return _df
 
 
@@ -141,7 +222,7 @@ def get_employee_output_df() -> pd.DataFrame:
     """Получить датафрейм выработки сотрудников."""
     global _df_employee
     if _df_employee is None:
-        refresh_data()
+        refresh_data(["employee_output"])
     return _df_employee
 
 
@@ -156,10 +237,12 @@ def get_employee_names() -> list[str]:
 
 
 def get_employee_period_stats(user: str, date_from: date, date_to: date) -> dict[str, Any]:
-    """По сотруднику и периоду: даты выхода, кол-во дней, участки, продукция (вид — наименование, кол-во)."""
+    """По сотруднику и периоду: даты выхода, кол-во дней, участки, продукция (вид — наименование, кол-во),
+    выпуск в час и ФОТ на единицу по табелю (куб выработки)."""
     emp_df = get_employee_output_df()
     if emp_df.empty:
-        return {"work_dates": [], "days_count": 0, "departments": [], "products": []}
+        return {"work_dates": [], "days_count": 0, "departments": [], "products": [],
+                "productivity": get_productivity_stats(date_from, date_to, user=user)}
     emp_df = emp_df.copy()
     if "date_only" not in emp_df.columns:
         emp_df["date_only"] = emp_df["date"].apply(lambda x: x.date() if hasattr(x, "date") else x)
@@ -169,7 +252,8 @@ def get_employee_period_stats(user: str, date_from: date, date_to: date) -> dict
     mask_to = emp_df["date_only"] <= date_to
     sub = emp_df.loc[mask_user & mask_from & mask_to]
     if sub.empty:
-        return {"work_dates": [], "days_count": 0, "departments": [], "products": []}
+        return {"work_dates": [], "days_count": 0, "departments": [], "products": [],
+                "productivity": get_productivity_stats(date_from, date_to, user=user)}
     work_dates = sorted(sub["date_only"].unique().tolist())
     work_dates_str = [str(d) for d in work_dates]
     dept_pairs = sub.groupby(["production", "department"]).size().reset_index(name="_n")
@@ -192,6 +276,7 @@ def get_employee_period_stats(user: str, date_from: date, date_to: date) -> dict
         "days_count": len(work_dates),
         "departments": departments,
         "products": products,
+        "productivity": get_productivity_stats(date_from, date_to, user=user),
     }
 
 
@@ -282,6 +367,246 @@ def get_department_period_stats(
     }
 
 
+# ─── Куб выработки: выпуск и часы по табелю ──────────────────────────────────
+# Выработка (_df_employee) сопоставляется с табелями workforce по нормализованному ФИО и производству.
+# Часы сотрудника за день делятся поровну между участками, где у него в этот день есть выработка;
+# часы без выработки относятся к участку «—» (входят в итоги производства и сотрудника).
+# Для каждого среза (любой набор из производства, участка, сотрудника) хранятся нарастающие итоги по дням —
+# итоги за любой период считаются разностью двух строк.
+
+_PRODUCTIVITY_DIMS = ("production", "department", "name_key")
+_PRODUCTIVITY_VALUES = ["output", "hours", "cost"]
+
+
+def _name_key(name) -> str:
+    """Ключ сопоставления ФИО выработки и табеля: без регистра и лишних пробелов, «ё» = «е»."""
+    return " ".join(str(name or "").split()).lower().replace("ё", "е")
+
+
+def _rebuild_productivity_output() -> None:
+    """Сторона выработки куба: выпуск по (день, производство, участок, ФИО). Срезы пересобираются при следующем запросе."""
+    global _productivity_output, _productivity_names, _productivity_slices
+    cols = ["date_only", "production", "department", "user", "output"]
+    emp_df = _df_employee
+    if emp_df is None or emp_df.empty or not set(cols) <= set(emp_df.columns):
+        _productivity_output = pd.DataFrame(columns=["date_only", "production", "department", "name_key", "output"])
+        _productivity_names = {}
+    else:
+        sub = emp_df[cols].copy()
+        for col in ("production", "department", "user"):
+            sub[col] = sub[col].fillna("").astype(str).str.strip()
+        sub = sub[sub["user"] != ""]
+        sub["name_key"] = sub["user"].map(_name_key)
+        sub["output"] = pd.to_numeric(sub["output"], errors="coerce").fillna(0.0)
+        _productivity_names = dict(zip(sub["name_key"], sub["user"]))
+        _productivity_output = sub.groupby(
+            ["date_only", "production", "department", "name_key"], as_index=False
+        )["output"].sum()
+    _productivity_slices = None
+
+
+def _productivity_labor_month(prod_key: str, year: int, month: int) -> tuple[pd.DataFrame, dict[str, str]]:
+    """Сторона табелей куба за месяц: часы и ФОТ по (день, производство, ФИО) и ФИО из табелей по ключу."""
+    prod_name = workforce.PRODUCTIONS[prod_key]
+    rows = []
+    names: dict[str, str] = {}
+    for d, name, hours, cost in workforce.get_daily_fact_labor(prod_key, year, month):
+        key = _name_key(name)
+        names.setdefault(key, name)
+        rows.append((date.fromordinal(d), prod_name, key, hours, cost))
+    labor = pd.DataFrame(rows, columns=["date_only", "production", "name_key", "hours", "cost"])
+    labor = labor.groupby(["date_only", "production", "name_key"], as_index=False)[["hours", "cost"]].sum()
+    return labor, names
+
+
+def _sync_productivity_labor() -> set[tuple]:
+    """Перечитать табели изменившихся месяцев (по workforce.labor_versions()). Возвращает изменившиеся месяцы."""
+    global _productivity_labor_versions
+    versions = workforce.labor_versions() if workforce is not None else {}
+    changed = {
+        key for key in versions.keys() | _productivity_labor_versions.keys()
+        if versions.get(key) != _productivity_labor_versions.get(key)
+    }
+    for key in changed:
+        if key in versions:
+            _productivity_labor[key] = _productivity_labor_month(*key)
+        else:
+            _productivity_labor.pop(key, None)
+    _productivity_labor_versions = versions
+    return changed
+
+
+def _productivity_labor_all() -> tuple[pd.DataFrame, dict[str, str]]:
+    parts = [labor for labor, _ in _productivity_labor.values() if not labor.empty]
+    names = {k: v for _, part_names in _productivity_labor.values() for k, v in part_names.items()}
+    if not parts:
+        return pd.DataFrame(columns=["date_only", "production", "name_key", "hours", "cost"]), names
+    return pd.concat(parts, ignore_index=True), names
+
+
+def _join_productivity(output: pd.DataFrame, labor: pd.DataFrame) -> pd.DataFrame:
+    """Строки куба: выработка с долей часов/ФОТ сотрудника за день плюс часы без выработки (участок «—»)."""
+    keys = ["date_only", "production", "name_key"]
+    share = 1.0 / output.groupby(keys)["department"].transform("size")
+    merged = output.merge(labor, on=keys, how="left")
+    merged["hours"] = merged["hours"].fillna(0.0) * share.values
+    merged["cost"] = merged["cost"].fillna(0.0) * share.values
+    idle = labor.merge(output[keys].drop_duplicates(), on=keys, how="left", indicator=True)
+    idle = idle[idle["_merge"] == "left_only"].drop(columns="_merge")
+    idle["department"] = "—"
+    idle["output"] = 0.0
+    parts = [p for p in (merged, idle) if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=["date_only", *_PRODUCTIVITY_DIMS, *_PRODUCTIVITY_VALUES])
+    cube = pd.concat(parts, ignore_index=True)
+    cube[_PRODUCTIVITY_VALUES] = cube[_PRODUCTIVITY_VALUES].astype(float)
+    return cube
+
+
+def _productivity_groups(cube: pd.DataFrame, dims: tuple) -> dict[tuple, tuple[list, np.ndarray]]:
+    """Итоги по дням для среза: {значения столбцов среза: (даты по возрастанию, итоги дни x (выпуск, часы, ФОТ))}."""
+    if cube.empty:
+        return {}
+    daily = cube.groupby([*dims, "date_only"], sort=True)[_PRODUCTIVITY_VALUES].sum()
+    if dims:
+        parts = ((k if isinstance(k, tuple) else (k,), g) for k, g in daily.groupby(level=list(dims), sort=False))
+    else:
+        parts = [((), daily)]
+    return {key: (list(g.index.get_level_values("date_only")), g.to_numpy(dtype=float)) for key, g in parts}
+
+
+def _productivity_entry(dates: list, values: np.ndarray) -> dict[str, Any]:
+    cum = np.zeros((len(values) + 1, len(_PRODUCTIVITY_VALUES)))
+    np.cumsum(values, axis=0, out=cum[1:])
+    return {"dates": dates, "values": values, "cum": cum}
+
+
+def _productivity_dim_sets() -> list[tuple]:
+    return [
+        tuple(d for i, d in enumerate(_PRODUCTIVITY_DIMS) if mask & (1 << i))
+        for mask in range(1 << len(_PRODUCTIVITY_DIMS))
+    ]
+
+
+def _build_productivity_slices(cube: pd.DataFrame) -> dict[tuple, dict[tuple, dict[str, Any]]]:
+    """Нарастающие итоги по дням для всех срезов: строка i — сумма за дни до dates[i] (не включая)."""
+    return {
+        dims: {key: _productivity_entry(dates, values) for key, (dates, values) in _productivity_groups(cube, dims).items()}
+        for dims in _productivity_dim_sets()
+    }
+
+
+def _month_bounds(year: int, month: int) -> tuple[date, date]:
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _refresh_productivity_months(changed: set[tuple]) -> None:
+    """
+    Обновить куб после изменения табелей за месяцы changed ((производство workforce, год, месяц)):
+    строки куба этих производств-месяцев пересобираются, в срезах заменяются только дни этих месяцев.
+    """
+    global _productivity_cube
+    cube, output = _productivity_cube, _productivity_output
+    parts = []
+    for prod_key, year, month in changed:
+        prod_name = workforce.PRODUCTIONS.get(prod_key, prod_key)
+        lo, hi = _month_bounds(year, month)
+        in_cube = (cube["production"] == prod_name) & (cube["date_only"] >= lo) & (cube["date_only"] <= hi)
+        cube = cube[~in_cube]
+        out_part = output[(output["production"] == prod_name) & (output["date_only"] >= lo) & (output["date_only"] <= hi)]
+        labor, names = _productivity_labor.get((prod_key, year, month)) or (
+            pd.DataFrame(columns=["date_only", "production", "name_key", "hours", "cost"]), {},
+        )
+        for key, name in names.items():
+            _productivity_names.setdefault(key, name)
+        parts.append(_join_productivity(out_part, labor))
+    parts = [p for p in (cube, *parts) if not p.empty]
+    cube = pd.concat(parts, ignore_index=True) if parts else cube
+    _productivity_cube = cube
+
+    # Итоги затронутых дней пересчитываются по строкам куба этих дней (все производства — для общих срезов)
+    bounds = sorted({_month_bounds(year, month) for _, year, month in changed})
+    in_months = np.zeros(len(cube), dtype=bool)
+    for lo, hi in bounds:
+        in_months |= ((cube["date_only"] >= lo) & (cube["date_only"] <= hi)).to_numpy()
+
+    def _affected(dates: list) -> bool:
+        return any(bisect_left(dates, lo) < bisect_right(dates, hi) for lo, hi in bounds)
+
+    def _keep(d) -> bool:
+        return not any(lo <= d <= hi for lo, hi in bounds)
+
+    for dims in _productivity_dim_sets():
+        groups = _productivity_slices[dims]
+        fresh = _productivity_groups(cube[in_months], dims)
+        for key in fresh.keys() | {k for k, entry in groups.items() if _affected(entry["dates"])}:
+            entry = groups.get(key)
+            dates, values = fresh.get(key, ([], np.zeros((0, len(_PRODUCTIVITY_VALUES)))))
+            if entry is not None:
+                keep = [i for i, d in enumerate(entry["dates"]) if _keep(d)]
+                dates = [entry["dates"][i] for i in keep] + dates
+                values = np.concatenate([entry["values"][keep], values])
+                order = sorted(range(len(dates)), key=dates.__getitem__)
+                dates, values = [dates[i] for i in order], values[order]
+            if dates:
+                groups[key] = _productivity_entry(dates, values)
+            else:
+                groups.pop(key, None)
+
+
+def _productivity_index() -> dict[tuple, dict[tuple, dict[str, Any]]]:
+    """Срезы куба; пересобираются после перезагрузки выработки, после изменения табелей — только изменившиеся месяцы."""
+    global _productivity_slices, _productivity_cube, _productivity_names
+    if _productivity_output is None:
+        get_employee_output_df()
+        if _productivity_output is None:
+            _rebuild_productivity_output()
+    changed = _sync_productivity_labor()
+    # Если изменилась большая часть месяцев (например, справочник ставок), полная пересборка быстрее
+    if _productivity_slices is None or len(changed) * 2 > len(_productivity_labor_versions):
+        labor, labor_names = _productivity_labor_all()
+        _productivity_names = {**labor_names, **_productivity_names}
+        _productivity_cube = _join_productivity(_productivity_output, labor)
+        _productivity_slices = _build_productivity_slices(_productivity_cube)
+    elif changed:
+        _refresh_productivity_months(changed)
+    return _productivity_slices
+
+
+def get_productivity_stats(
+    date_from: date,
+    date_to: date,
+    production: Optional[str] = None,
+    department: Optional[str] = None,
+    user: Optional[str] = None,
+) -> dict[str, Any]:
+    """Выпуск, часы и ФОТ по табелю за период по срезу куба (производство / участок / сотрудник — любые из них),
+    выпуск в час, в смену и ФОТ на единицу выпуска."""
+    filters = {"production": (production or "").strip(), "department": (department or "").strip(), "name_key": _name_key(user)}
+    dims = tuple(d for d in _PRODUCTIVITY_DIMS if filters[d])
+    entry = _productivity_index().get(dims, {}).get(tuple(filters[d] for d in dims))
+    totals = np.zeros(len(_PRODUCTIVITY_VALUES))
+    days = 0
+    if entry and date_from <= date_to:
+        i0, i1 = bisect_left(entry["dates"], date_from), bisect_right(entry["dates"], date_to)
+        if i1 > i0:
+            totals = entry["cum"][i1] - entry["cum"][i0]
+            days = i1 - i0
+    output, hours, cost = (float(v) for v in totals)
+    return {
+        "production": filters["production"] or None,
+        "department": filters["department"] or None,
+        "user": _productivity_names.get(filters["name_key"], (user or "").strip()) if filters["name_key"] else None,
+        "days": days,
+        "total_output": round(output, 2),
+        "total_hours": round(hours, 1),
+        "total_cost": round(cost, 2),
+        "avg_per_hour": round(output / hours, 2) if hours > 1e-9 else 0,
+        "avg_per_shift": round(output / days, 2) if days else 0,
+        "cost_per_unit": round(cost / output, 2) if output > 1e-9 else 0,
+    }
+
+
 def get_daily_output_stats(target_date: date) -> dict[str, Any]:
     """Выработка сотрудников за день: по участкам, по сотрудникам, детализация по номенклатуре. Сравнение выпуск vs выработка."""
     emp_df = get_employee_output_df()
@@ -802,17 +1127,13 @@ def get_last_n_days_detailed_for_ai(target_date: date, days: int = 10) -> list[d
 
 
 def get_data_date_range() -> dict:
-    """Диагностика: диапазон дат и количество записей по дням (для отладки пропавших данных)."""
-    df = get_df()
-    if df.empty:
-        return {"dates": [], "min_date": None, "max_date": None}
-    daily_counts = df.groupby("date_only", as_index=False).size()
-    daily_counts = daily_counts.sort_values("date_only")
-    dates = [{"date": str(row["date_only"]), "rows": int(row["size"])} for _, row in daily_counts.iterrows()]
+    """Диагностика: диапазон дат и количество записей по дням (для отладки пропавших данных). Из манифеста загрузки."""
+    ingest_manifest.load(DATA_DIR)
+    summary = ingest_manifest.get_kind("production")
     return {
-        "dates": dates,
-        "min_date": str(df["date_only"].min()) if not df.empty else None,
-        "max_date": str(df["date_only"].max()) if not df.empty else None,
+        "dates": list(summary.get("daily_rows") or []),
+        "min_date": summary.get("min_date"),
+        "max_date": summary.get("max_date"),
     }
 
 
@@ -873,7 +1194,7 @@ def get_disassembly_dfs() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.
     """Возвращает (поступление наборов на склад, поступление ингредиентов после разборки, отгрузка, внутреннее потребление)."""
     global _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption
     if _df_in_warehouse is None:
-        refresh_data()
+        refresh_data(["disassembly"])
     return _df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption
 
 
@@ -890,7 +1211,7 @@ def get_disassembly_stats(
     in_df, ingredients_df, out_df, internal_df = get_disassembly_dfs()
     global _nomenclature_prices
     if _nomenclature_prices is None:
-        refresh_data()
+        refresh_data(["prices"])
     prices = _nomenclature_prices or {}
     prices_lower = _nomenclature_prices_lower or {}
 
@@ -1163,18 +1484,92 @@ def get_disassembly_stats(
     }
 
 
+def _build_daily_cumulative(df: pd.DataFrame) -> dict[str, Any]:
+    """
+    Нарастающие итоги по номенклатуре: строка i — за все даты до dates[i] (не включая), последняя — за всё время.
+    cum — количество, rows — число строк (позиция попадает в топ окна, если в окне есть её строки, даже с нулевой суммой).
+    """
+    if df is None or df.empty or not {"date_only", "nomenclature", "quantity"} <= set(df.columns):
+        return {"dates": [], "cum": pd.DataFrame(), "rows": pd.DataFrame()}
+    grouped = df.groupby(["date_only", "nomenclature"])["quantity"]
+    daily = grouped.sum().unstack(fill_value=0).sort_index()
+    daily_rows = grouped.size().unstack(fill_value=0).reindex(index=daily.index, columns=daily.columns, fill_value=0)
+
+    def cumulative(frame: pd.DataFrame) -> pd.DataFrame:
+        zero = pd.DataFrame([[0.0] * len(frame.columns)], columns=frame.columns)
+        return pd.concat([zero, frame.cumsum().reset_index(drop=True)], ignore_index=True).astype(float)
+
+    return {"dates": list(daily.index), "cum": cumulative(daily), "rows": cumulative(daily_rows)}
+
+
+def _rebuild_disassembly_daily() -> None:
+    """Пересчитать дневные итоги разборки по номенклатуре и сбросить кэш топов (вызывается после загрузки данных)."""
+    global _disassembly_daily, _disassembly_top_cache
+    flows = {
+        "in": _df_in_warehouse,
+        "ingredients": _df_ingredients,
+        "out": _df_out_warehouse,
+        "internal": _df_internal_consumption,
+    }
+    _disassembly_daily = {flow: _build_daily_cumulative(df) for flow, df in flows.items()}
+    _disassembly_top_cache = {}
+
+
+def _disassembly_window_totals(
+    flow: str, date_from: Optional[date], date_to: Optional[date], kind: str = "cum"
+) -> pd.Series:
+    """Сумма по номенклатуре за [date_from; date_to] по нарастающим итогам (разность двух строк); kind="rows" — число строк."""
+    if not _disassembly_daily:
+        get_disassembly_dfs()
+    daily = _disassembly_daily.get(flow) or {}
+    dates, cum = daily.get("dates") or [], daily.get(kind)
+    if not dates or cum is None or cum.empty:
+        return pd.Series(dtype=float)
+    i0 = bisect_left(dates, date_from) if date_from else 0
+    i1 = bisect_right(dates, date_to) if date_to else len(dates)
+    if i1 <= i0:
+        return pd.Series(dtype=float)
+    return cum.iloc[i1] - cum.iloc[i0]
+
+
+def _disassembly_top_n(flow: str, date_from: Optional[date], date_to: Optional[date], n: int) -> list[dict]:
+    """Топ-N номенклатуры по количеству за окно (позиции, у которых в окне есть строки, в т.ч. с нулевой суммой)."""
+    totals = _disassembly_window_totals(flow, date_from, date_to)
+    rows = _disassembly_window_totals(flow, date_from, date_to, kind="rows")
+    if not totals.empty:
+        totals = totals[rows > 0.5]
+    if totals.empty or n <= 0:
+        return []
+    top = totals.sort_values(ascending=False, kind="stable").head(n)
+    return [{"name": name, "quantity": int(round(float(qty)))} for name, qty in top.items()]
+
+
 def get_disassembly_summary(
     period: str = "month",
     top_in: int = 5,
     top_internal: int = 15,
     top_out: int = 15,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
 ) -> dict[str, Any]:
     """
     Сводка для инфографики: топ по номенклатуре за период (неделя / месяц / всё время).
-    period: "week" | "month" | "all"
+    period: "week" | "month" | "all"; при заданных date_from/date_to — произвольное окно (без кэша).
+    Стандартные окна кэшируются до перезагрузки данных или смены календарного дня.
     """
-    in_df, ingredients_df, out_df, internal_df = get_disassembly_dfs()
+    global _disassembly_top_cache, _disassembly_top_cache_day
+    get_disassembly_dfs()
     today = date.today()
+    if date_from or date_to:
+        date_to = date_to or today
+        return {
+            "period": "custom",
+            "date_from": str(date_from) if date_from else None,
+            "date_to": str(date_to),
+            "top_received": _disassembly_top_n("in", date_from, date_to, top_in),
+            "top_internal": _disassembly_top_n("internal", date_from, date_to, top_internal),
+            "top_out": _disassembly_top_n("out", date_from, date_to, top_out),
+        }
     if period == "week":
         date_from = today - timedelta(days=7)
     elif period == "month":
@@ -1183,35 +1578,23 @@ def get_disassembly_summary(
         date_from = None
     date_to = today
 
-    def _filter_df(df: pd.DataFrame):
-        if df.empty or "date_only" not in df.columns:
-            return df
-        mask = df["date_only"] <= date_to
-        if date_from:
-            mask = mask & (df["date_only"] >= date_from)
-        return df[mask]
-
-    def _top_n(df: pd.DataFrame, n: int) -> list[dict]:
-        if df.empty or "nomenclature" not in df.columns:
-            return []
-        agg = df.groupby("nomenclature", as_index=False)["quantity"].sum()
-        agg = agg.sort_values("quantity", ascending=False).head(n)
-        return [
-            {"name": row["nomenclature"], "quantity": int(round(float(row["quantity"])))}
-            for _, row in agg.iterrows()
-        ]
+    if _disassembly_top_cache_day != today:
+        _disassembly_top_cache = {}
+        _disassembly_top_cache_day = today
 
-    in_f = _filter_df(in_df)
-    out_f = _filter_df(out_df)
-    internal_f = _filter_df(internal_df)
+    def _cached_top(flow: str, n: int) -> list[dict]:
+        key = (flow, period, n)
+        if key not in _disassembly_top_cache:
+            _disassembly_top_cache[key] = _disassembly_top_n(flow, date_from, date_to, n)
+        return [dict(item) for item in _disassembly_top_cache[key]]
 
     return {
         "period": period,
         "date_from": str(date_from) if date_from else None,
         "date_to": str(date_to),
-        "top_received": _top_n(in_f, top_in),
-        "top_internal": _top_n(internal_f, top_internal),
-        "top_out": _top_n(out_f, top_out),
+        "top_received": _cached_top("in", top_in),
+        "top_internal": _cached_top("internal", top_internal),
+        "top_out": _cached_top("out", top_out),
     }
 
 
@@ -1229,7 +1612,7 @@ def get_disassembly_detail_by_date(
     """
     global _nomenclature_prices, _nomenclature_prices_lower
     if _nomenclature_prices is None:
-        refresh_data()
+        refresh_data(["prices"])
     prices = _nomenclature_prices or {}
     prices_lower = _nomenclature_prices_lower or {}
 
@@ -1308,7 +1691,7 @@ def get_disassembly_full_detail_by_date(target_date: str) -> dict[str, Any]:
     """
     global _nomenclature_prices, _nomenclature_prices_lower
     if _nomenclature_prices is None:
-        refresh_data()
+        refresh_data(["prices"])
     prices = _nomenclature_prices or {}
     prices_lower = _nomenclature_prices_lower or {}
 
@@ -1389,29 +1772,62 @@ def get_disassembly_full_detail_by_date(target_date: str) -> dict[str, Any]:
     return {"date": target_date, "rows": rows}
 
 
+def _rebuild_disassembly_vocabulary() -> None:
+    """Пересобрать словарь номенклатуры разборки (после загрузки файлов разборки) и признаки наличия цены."""
+    global _disassembly_vocab, _disassembly_vocab_by_lower
+    cols = [
+        df["nomenclature"]
+        for df in (_df_in_warehouse, _df_ingredients, _df_out_warehouse, _df_internal_consumption)
+        if df is not None and not df.empty and "nomenclature" in df.columns
+    ]
+    if cols:
+        names = pd.concat(cols, ignore_index=True).dropna().astype(str).str.strip()
+        _disassembly_vocab = sorted(names[names != ""].unique().tolist())
+    else:
+        _disassembly_vocab = []
+    _disassembly_vocab_by_lower = {}
+    for i, name in enumerate(_disassembly_vocab):
+        _disassembly_vocab_by_lower.setdefault(name.lower(), []).append(i)
+    _recompute_price_presence()
+
+
+def _recompute_price_presence() -> None:
+    """Признак «цена есть» для всего словаря (после загрузки словаря или полной перезагрузки прайса)."""
+    global _disassembly_price_present, _disassembly_missing
+    prices_lower = _nomenclature_prices_lower or {}
+    _disassembly_price_present = [name.lower() in prices_lower for name in _disassembly_vocab]
+    _disassembly_missing = None
+
+
+def _mark_prices_present(names) -> None:
+    """Инкрементально отметить позиции, по которым пришли цены (цены из прайса не удаляются)."""
+    global _disassembly_missing
+    touched = False
+    for name in names:
+        for i in _disassembly_vocab_by_lower.get(str(name).strip().lower(), []):
+            if not _disassembly_price_present[i]:
+                _disassembly_price_present[i] = True
+                touched = True
+    if touched:
+        _disassembly_missing = None
+
+
 def get_disassembly_nomenclature_list() -> list[str]:
     """Все уникальные наименования номенклатуры из данных разборки (как в таблицах — для копирования в 1С)."""
-    in_df, ingredients_df, out_df, internal_df = get_disassembly_dfs()
-    seen: set[str] = set()
-    for df in (in_df, ingredients_df, out_df, internal_df):
-        if df.empty or "nomenclature" not in df.columns:
-            continue
-        for v in df["nomenclature"].dropna().astype(str).str.strip():
-            if v:
-                seen.add(v)
-    return sorted(seen)
+    get_disassembly_dfs()
+    return list(_disassembly_vocab)
 
 
 def get_disassembly_missing_prices() -> list[str]:
     """Номенклатура из данных разборки, по которой не загружена себестоимость (нет в прайсе)."""
+    global _disassembly_missing
     try:
-        global _nomenclature_prices, _nomenclature_prices_lower
+        get_disassembly_dfs()
         if _nomenclature_prices is None:
-            refresh_data()
-        prices_lower = (_nomenclature_prices_lower or {}).copy()
-        all_names = set(get_disassembly_nomenclature_list())
-        missing = [n for n in all_names if (n or "").strip().lower() not in prices_lower]
-        return sorted(missing)
+            refresh_data(["prices"])
+        if _disassembly_missing is None:
+            _disassembly_missing = [n for n, ok in zip(_disassembly_vocab, _disassembly_price_present) if not ok]
+        return list(_disassembly_missing)
     except Exception:
         return []
 
@@ -1634,8 +2050,9 @@ def get_generic_period_stats(production_name: str, date_from: date, date_to: dat
 
 
 def get_data_sources_status() -> dict[str, Any]:
-    """Статус источников данных для админки: 001–004, цены, выработка, выпуск — файл, строки, даты."""
-    refresh_data()
+    """Статус источников данных для админки: 001–004, цены, выработка, выпуск — файл, строки, даты.
+    Отвечает по манифесту загрузки (ingest_manifest): Excel-файлы не перечитываются."""
+    ingest_manifest.load(DATA_DIR)
     result: dict[str, Any] = {}
     if load_all_disassembly_data and get_disassembly_sources_info:
         try:
@@ -1644,24 +2061,24 @@ def get_data_sources_status() -> dict[str, Any]:
             result["disassembly"] = {"error": str(e)}
     else:
         result["disassembly"] = {"001": {}, "002": {}, "003": {}, "004": {}}
-    price_path = DATA_DIR / "цена поступления номенклатуры.xlsx"
-    prices = (load_nomenclature_prices(str(DATA_DIR)) if load_nomenclature_prices else {}) or {}
+    prices = ingest_manifest.get_kind("prices")
     result["prices"] = {
         "file": "цена поступления номенклатуры.xlsx",
-        "exists": price_path.exists(),
-        "count": len(prices),
+        "exists": bool(prices.get("exists", (DATA_DIR / "цена поступления номенклатуры.xlsx").exists())),
+        "count": prices.get("rows", 0),
         "label": "Себестоимость (прайс)",
     }
-    df = get_df()
+    production = ingest_manifest.get_kind("production")
     result["production"] = {
-        "rows": len(df),
-        "dates": int(df["date_only"].nunique()) if not df.empty and "date_only" in df.columns else 0,
+        "rows": production.get("rows", 0),
+        "dates": production.get("dates", 0),
         "label": "Выпуск продукции",
     }
-    emp = get_employee_output_df()
+    employee = ingest_manifest.get_kind("employee_output")
     result["employee_output"] = {
-        "rows": len(emp),
-        "dates": int(emp["date_only"].nunique()) if not emp.empty and "date_only" in emp.columns else 0,
+        "rows": employee.get("rows", 0),
+        "dates": employee.get("dates", 0),
         "label": "Выработка сотрудников",
     }
+    result["files"] = ingest_manifest.get_files()
     return result
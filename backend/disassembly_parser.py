@@ -7,12 +7,15 @@
 """
 
 import re
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
 import pandas as pd
 
+import ingest_manifest
+
 
 def parse_date_from_doc(value) -> Optional[datetime]:
     """Извлекает дату из строки документа вида «... от 03.01.2026 19:00:00» или «... от 25.01.2026»."""
@@ -211,6 +214,13 @@ _FNAME_PREFIX_INGREDIENTS = "002"
 _FNAME_PREFIX_INTERNAL = "003"
 _FNAME_PREFIX_OUT = "004"
 
+DISASSEMBLY_LABELS = {
+    "001": "Перемещение возвратов на склад разборки LUMINARC",
+    "002": "Поступление ингредиентов после разбора на склад разборки LUMINARC",
+    "003": "Списание битой посуды со склада LUMINARC",
+    "004": "Перемещение со склада разборки LUMINARC на основной склад",
+}
+
 
 def _disassembly_file_type_by_name(filepath: Path) -> Optional[str]:
     """По префиксу имени файла возвращает 'in' | 'out' | 'internal' | 'ingredients' или None."""
@@ -276,18 +286,28 @@ def load_all_disassembly_data(data_dir: str) -> tuple[pd.DataFrame, pd.DataFrame
         except Exception as e:
             print(f"Ошибка разборки {f}: {e}")
 
-    def _load_all_and_merge(candidates: list, loader, columns: list) -> pd.DataFrame:
-        """Загружает все файлы типа; внутри файла — sum(quantity), между файлами — max (как выпуск/выработка)."""
+    def _load_all_and_merge(candidates: list, loader, columns: list, code: str) -> pd.DataFrame:
+        """Загружает все файлы типа; внутри файла — sum(quantity), между файлами — max (как выпуск/выработка).
+        Попутно пишет в манифест запись по каждому файлу и сводку по типу (строки, даты — как в админке)."""
+        kind = f"disassembly_{code}"
+        ingest_manifest.reset_kind(kind)
+        raw_rows = 0
+        raw_dates: set = set()
         if not candidates:
+            ingest_manifest.record_kind(kind, {"file": "—", "rows": 0, "dates": 0, "label": DISASSEMBLY_LABELS[code]})
             return pd.DataFrame(columns=columns)
         aggregated_per_file = []
         for fp in candidates:
+            t0 = time.perf_counter()
             try:
                 df = loader(fp)
+                ingest_manifest.record_file(fp, kind, df, time.perf_counter() - t0)
                 if df.empty or "date" not in df.columns:
                     continue
                 df = df.copy()
                 df["date_only"] = df["date"].apply(lambda x: x.date() if hasattr(x, "date") else x)
+                raw_rows += len(df)
+                raw_dates.update(df["date_only"].dropna().tolist())
                 df["_norm_doc"] = df["document"].astype(str).apply(_normalize_document)
                 group_cols = ["date_only", "_norm_doc", "nomenclature"]
                 if "article" in df.columns:
@@ -295,7 +315,14 @@ def load_all_disassembly_data(data_dir: str) -> tuple[pd.DataFrame, pd.DataFrame
                 agg_df = df.groupby(group_cols, as_index=False).agg({"quantity": "sum", "document": "first"})
                 aggregated_per_file.append(agg_df)
             except Exception as e:
+                ingest_manifest.record_file(fp, kind, None, time.perf_counter() - t0, error=str(e))
                 print(f"Ошибка загрузки {fp}: {e}")
+        ingest_manifest.record_kind(kind, {
+            "file": f"{len(candidates)} файл(ов)",
+            "rows": raw_rows,
+            "dates": len(raw_dates),
+            "label": DISASSEMBLY_LABELS[code],
+        })
         if not aggregated_per_file:
             return pd.DataFrame(columns=columns)
         combined = pd.concat(aggregated_per_file, ignore_index=True)
@@ -307,10 +334,10 @@ def load_all_disassembly_data(data_dir: str) -> tuple[pd.DataFrame, pd.DataFrame
         merged = merged.drop(columns=["_norm_doc"], errors="ignore")
         return merged
 
-    in_df = _load_all_and_merge(in_candidates, load_movement_to_warehouse, ["date", "document", "nomenclature", "quantity"])
-    ingredients_df = _load_all_and_merge(ingredients_candidates, load_ingredients_after_disassembly, ["date", "document", "nomenclature", "quantity"])
-    out_df = _load_all_and_merge(out_candidates, load_movement_from_warehouse, ["date", "document", "nomenclature", "quantity"])
-    internal_df = _load_all_and_merge(internal_candidates, load_internal_consumption, ["date", "document", "nomenclature", "article", "quantity"])
+    in_df = _load_all_and_merge(in_candidates, load_movement_to_warehouse, ["date", "document", "nomenclature", "quantity"], "001")
+    ingredients_df = _load_all_and_merge(ingredients_candidates, load_ingredients_after_disassembly, ["date", "document", "nomenclature", "quantity"], "002")
+    out_df = _load_all_and_merge(out_candidates, load_movement_from_warehouse, ["date", "document", "nomenclature", "quantity"], "004")
+    internal_df = _load_all_and_merge(internal_candidates, load_internal_consumption, ["date", "document", "nomenclature", "article", "quantity"], "003")
 
     # Группировка по (дата, документ, номенклатура): суммируем quantity, т.к. в одном документе может быть несколько строк с одной номенклатурой.
     # Раньше стояло "max" — это занижало итоги (учитывалась только одна строка вместо суммы).
@@ -367,81 +394,25 @@ def get_disassembly_sources_info(data_dir: str) -> dict:
     """
     Возвращает по каждому типу 001–004: какой файл выбран, сколько строк и дат.
     Для диагностики в админке (почему нет отгруженных и т.д.).
+    Берётся из манифеста загрузки (заполняется в load_all_disassembly_data) — файлы не перечитываются.
     """
-    path = Path(data_dir)
-    if not path.exists():
-        return {"001": {"file": None, "rows": 0, "dates": 0, "error": "Папка не найдена"},
-                "002": {"file": None, "rows": 0, "dates": 0, "error": "Папка не найдена"},
-                "003": {"file": None, "rows": 0, "dates": 0, "error": "Папка не найдена"},
-                "004": {"file": None, "rows": 0, "dates": 0, "error": "Папка не найдена"}}
-
-    in_candidates: list[Path] = []
-    ingredients_candidates: list[Path] = []
-    out_candidates: list[Path] = []
-    internal_candidates: list[Path] = []
-
-    for f in path.glob("**/*.xlsx"):
-        if f.name.startswith("~$"):
-            continue
-        try:
-            name_type = _disassembly_file_type_by_name(f)
-            if name_type == "in":
-                in_candidates.append(f)
-                continue
-            if name_type == "ingredients":
-                ingredients_candidates.append(f)
-                continue
-            if name_type == "out":
-                out_candidates.append(f)
-                continue
-            if name_type == "internal":
-                internal_candidates.append(f)
-                continue
-            if _is_movement_to_warehouse_file(f):
-                in_candidates.append(f)
-            elif _is_ingredients_after_disassembly_file(f):
-                ingredients_candidates.append(f)
-            elif _is_internal_consumption_file(f):
-                internal_candidates.append(f)
-            elif _is_movement_from_warehouse_file(f):
-                out_candidates.append(f)
-        except Exception:
-            pass
-
-    def _load_all_info(candidates: list, loader) -> tuple:
-        """По аналогии с загрузкой: все файлы типа объединяются, возвращаем (описание, строк, дат)."""
-        if not candidates:
-            return "—", 0, 0
-        n_files = len(candidates)
-        try:
-            frames = []
-            for fp in candidates:
-                df = loader(fp)
-                if df.empty or "date" not in df.columns:
-                    continue
-                df = df.copy()
-                df["date_only"] = df["date"].apply(lambda x: x.date() if hasattr(x, "date") else x)
-                frames.append(df)
-            if not frames:
-                return f"{n_files} файл(ов)", 0, 0
-            combined = pd.concat(frames, ignore_index=True)
-            rows = len(combined)
-            dates = int(combined["date_only"].nunique()) if "date_only" in combined.columns else 0
-            return f"{n_files} файл(ов)", rows, dates
-        except Exception:
-            return f"{n_files} файл(ов)", 0, 0
-
-    f001, r001, d001 = _load_all_info(in_candidates, load_movement_to_warehouse)
-    f002, r002, d002 = _load_all_info(ingredients_candidates, load_ingredients_after_disassembly)
-    f003, r003, d003 = _load_all_info(internal_candidates, load_internal_consumption)
-    f004, r004, d004 = _load_all_info(out_candidates, load_movement_from_warehouse)
-
-    return {
-        "001": {"file": f001, "rows": r001, "dates": d001, "label": "Перемещение возвратов на склад разборки LUMINARC"},
-        "002": {"file": f002, "rows": r002, "dates": d002, "label": "Поступление ингредиентов после разбора на склад разборки LUMINARC"},
-        "003": {"file": f003, "rows": r003, "dates": d003, "label": "Списание битой посуды со склада LUMINARC"},
-        "004": {"file": f004, "rows": r004, "dates": d004, "label": "Перемещение со склада разборки LUMINARC на основной склад"},
-    }
+    if not Path(data_dir).exists():
+        return {code: {"file": None, "rows": 0, "dates": 0, "error": "Папка не найдена"} for code in DISASSEMBLY_LABELS}
+    ingest_manifest.load(Path(data_dir))
+    result = {}
+    for code, label in DISASSEMBLY_LABELS.items():
+        summary = ingest_manifest.get_kind(f"disassembly_{code}")
+        errors = [f"{e['file']}: {e['error']}" for e in ingest_manifest.get_files(f"disassembly_{code}") if e.get("error")]
+        item = {
+            "file": summary.get("file", "—"),
+            "rows": summary.get("rows", 0),
+            "dates": summary.get("dates", 0),
+            "label": label,
+        }
+        if errors:
+            item["errors"] = errors
+        result[code] = item
+    return result
 
 
 def load_nomenclature_prices(data_dir: str) -> dict[str, float]:
@@ -458,22 +429,14 @@ def load_nomenclature_prices(data_dir: str) -> dict[str, float]:
         if df.empty or len(df) < 3:
             return {}
         # Данные с 3-й строки (индекс 2); колонка 0 — номенклатура, последняя — цена
-        out = {}
-        for i in range(2, len(df)):
-            name = df.iloc[i, 0]
-            if pd.isna(name):
-                continue
-            name = str(name).strip()
-            if not name:
-                continue
-            val = df.iloc[i, -1]
-            try:
-                price = float(val)
-            except (TypeError, ValueError):
-                continue
-            if price < 0:
-                continue
-            out[name] = price
-        return out
+        body = df.iloc[2:]
+        names = body.iloc[:, 0]
+        prices = pd.to_numeric(body.iloc[:, -1], errors="coerce")
+        mask = names.notna() & prices.notna() & (prices >= 0)
+        names = names[mask].astype(str).str.strip()
+        prices = prices[mask].astype(float)
+        keep = names != ""
+        # При повторе наименования берётся последняя строка (как при построчном заполнении словаря)
+        return dict(zip(names[keep].tolist(), prices[keep].tolist()))
     except Exception:
         return {}
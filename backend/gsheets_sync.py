@@ -126,10 +126,7 @@ def sync_schedules_from_gsheets(
             continue
 
         try:
-            wf.save_schedule(prod, year, month, schedule)
-            if timesheet:
-                wf.save_timesheet(prod, year, month, timesheet)
-            wf.merge_employees_from_schedule(prod, schedule)
+            schedule = wf.apply_month_import(prod, year, month, schedule, timesheet or None)["schedule"]
             emp_count = len(schedule.get("employees", []))
             result["synced"].append({
                 "production": prod,
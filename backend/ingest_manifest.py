@@ -0,0 +1,132 @@
+"""
+Манифест загрузки файлов данных (побочный продукт парсинга).
+
+Каждый загрузчик (выпуск, выработка, разборка 001–004, прайс) при чтении файла записывает сюда:
+вид файла, число строк, диапазон дат, время разбора, отпечаток файла и ошибку (если была).
+После загрузки вида сохраняется сводка по виду (строки, даты, по дням и т.п.).
+Админка отвечает по манифесту и никогда не перечитывает Excel.
+
+Файл: DATA_DIR/ingest_manifest.json — {"files": {путь: запись}, "kinds": {вид: сводка}, "updated_at": ...}
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import pandas as pd
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+
+_files: dict[str, dict[str, Any]] = {}
+_kinds: dict[str, dict[str, Any]] = {}
+_updated_at: Optional[float] = None
+_loaded_from: Optional[Path] = None
+
+
+def file_fingerprint(path: Path) -> str:
+    """Отпечаток файла: размер и время изменения (без чтения содержимого)."""
+    path = Path(path)
+    if not path.exists():
+        return ""
+    st = path.stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def reset_kind(kind: str) -> None:
+    """Забыть записи вида перед его повторной загрузкой (удалённые файлы не должны оставаться в манифесте)."""
+    global _updated_at
+    for key in [k for k, v in _files.items() if v.get("kind") == kind]:
+        del _files[key]
+    _kinds.pop(kind, None)
+    _updated_at = time.time()
+
+
+def record_file(
+    path: Path,
+    kind: str,
+    df: Optional[pd.DataFrame] = None,
+    parse_seconds: float = 0.0,
+    error: Optional[str] = None,
+    date_col: str = "date",
+) -> dict[str, Any]:
+    """Записать результат разбора одного файла."""
+    global _updated_at
+    path = Path(path)
+    rows = 0
+    date_min = date_max = None
+    dates = 0
+    if df is not None and not df.empty:
+        rows = len(df)
+        if date_col in df.columns:
+            days = pd.to_datetime(df[date_col], errors="coerce").dropna().dt.date
+            if not days.empty:
+                date_min, date_max = str(days.min()), str(days.max())
+                dates = int(days.nunique())
+    entry = {
+        "file": path.name,
+        "path": str(path),
+        "kind": kind,
+        "rows": rows,
+        "dates": dates,
+        "date_min": date_min,
+        "date_max": date_max,
+        "parse_seconds": round(float(parse_seconds), 3),
+        "fingerprint": file_fingerprint(path),
+        "error": error,
+        "parsed_at": time.time(),
+    }
+    _files[str(path)] = entry
+    _updated_at = time.time()
+    return entry
+
+
+def record_kind(kind: str, summary: dict[str, Any]) -> None:
+    """Сводка по виду данных после загрузки всех его файлов."""
+    global _updated_at
+    _kinds[kind] = {**summary, "files": len(get_files(kind)), "updated_at": time.time()}
+    _updated_at = time.time()
+
+
+def get_files(kind: Optional[str] = None) -> list[dict[str, Any]]:
+    """Записи по файлам (все или одного вида), по имени файла."""
+    items = [v for v in _files.values() if kind is None or v.get("kind") == kind]
+    return sorted(items, key=lambda v: v.get("file") or "")
+
+
+def get_kind(kind: str) -> dict[str, Any]:
+    """Сводка по виду (пустой словарь, если вид ещё не загружался)."""
+    return _kinds.get(kind) or {}
+
+
+def save(data_dir: Path) -> None:
+    """Сохранить манифест на диск (чтобы админка видела его и до первой перезагрузки после рестарта)."""
+    path = Path(data_dir) / MANIFEST_FILENAME
+    data = {"files": _files, "kinds": _kinds, "updated_at": _updated_at}
+    try:
+        path.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+    except Exception:
+        pass
+
+
+def load(data_dir: Path) -> None:
+    """Подхватить манифест с диска, если в памяти ещё ничего нет."""
+    global _files, _kinds, _updated_at, _loaded_from
+    if _files or _kinds or _loaded_from == Path(data_dir):
+        return
+    _loaded_from = Path(data_dir)
+    path = Path(data_dir) / MANIFEST_FILENAME
+    if not path.exists():
+        return
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return
+    if isinstance(data, dict):
+        _files = dict(data.get("files") or {})
+        _kinds = dict(data.get("kinds") or {})
+        _updated_at = data.get("updated_at")
+
+
+def updated_at() -> Optional[float]:
+    return _updated_at
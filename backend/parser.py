@@ -1,11 +1,14 @@
 """Парсер Excel-файлов выпуска продукции."""
 
 import os
+import time
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
 import pandas as pd
 
+import ingest_manifest
+
 
 def parse_date(value) -> Optional[datetime]:
     """Парсинг даты из различных форматов (текст, datetime, Excel-серийный номер)."""
@@ -245,6 +248,7 @@ def load_all_employee_output_data(data_dir: str) -> pd.DataFrame:
     path = Path(data_dir)
     if not path.exists():
         path.mkdir(parents=True, exist_ok=True)
+    ingest_manifest.reset_kind("employee_output")
     seen = set()
     aggregated_per_file = []
     for f in path.glob("**/*.xlsx"):
@@ -256,8 +260,10 @@ def load_all_employee_output_data(data_dir: str) -> pd.DataFrame:
         if key in seen:
             continue
         seen.add(key)
+        t0 = time.perf_counter()
         try:
             df = load_employee_output_file(f)
+            ingest_manifest.record_file(f, "employee_output", df, time.perf_counter() - t0)
             if df.empty:
                 continue
             df = df.copy()
@@ -267,6 +273,7 @@ def load_all_employee_output_data(data_dir: str) -> pd.DataFrame:
                 agg = df.groupby(group_cols, as_index=False)["output"].sum()
                 aggregated_per_file.append(agg)
         except Exception as e:
+            ingest_manifest.record_file(f, "employee_output", None, time.perf_counter() - t0, error=str(e))
             print(f"Ошибка выработки {f}: {e}")
     if not aggregated_per_file:
         return pd.DataFrame(columns=["production", "department", "user", "nomenclature_type", "product_name", "date", "output"])
@@ -287,6 +294,7 @@ def load_all_data(data_dir: str) -> pd.DataFrame:
     if not path.exists():
         path.mkdir(parents=True, exist_ok=True)
     
+    ingest_manifest.reset_kind("production")
     seen = set()
     frames = []
     
@@ -301,10 +309,13 @@ def load_all_data(data_dir: str) -> pd.DataFrame:
         if key in seen:
             return
         seen.add(key)
+        t0 = time.perf_counter()
         try:
             df = load_excel_file(f)
             frames.append(df)
+            ingest_manifest.record_file(f, "production", df, time.perf_counter() - t0)
         except Exception as e:
+            ingest_manifest.record_file(f, "production", None, time.perf_counter() - t0, error=str(e))
             print(f"Ошибка загрузки {f}: {e}")
     
     if path.exists():
@@ -0,0 +1,168 @@
+"""
+Хранилище цен номенклатуры (себестоимость для разборки возвратов).
+
+Файл DATA_DIR/nomenclature_prices.sqlite3:
+  prices — история цен: (наименование, дата начала действия, цена); индекс по наименованию в нижнем регистре
+  meta   — служебные значения (отпечаток последнего загруженного прайса)
+
+Прайс «цена поступления номенклатуры.xlsx» перечитывается только при изменении отпечатка файла
+(размер + время изменения). Новая строка истории пишется только для позиций, у которых цена
+действительно изменилась; позиции, отсутствующие в новом файле, не удаляются.
+Старый кэш nomenclature_prices_cache.json переносится в хранилище один раз (дата начала — пустая строка,
+т.е. «действует всегда»).
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import closing
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional
+
+import ingest_manifest
+from disassembly_parser import load_nomenclature_prices
+
+PRICE_FILENAME = "цена поступления номенклатуры.xlsx"
+DB_FILENAME = "nomenclature_prices.sqlite3"
+LEGACY_CACHE_FILENAME = "nomenclature_prices_cache.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    effective_date TEXT NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (name, effective_date)
+);
+CREATE INDEX IF NOT EXISTS idx_prices_name_lower ON prices (name_lower, effective_date);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _connect(data_dir: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(Path(data_dir) / DB_FILENAME))
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def _latest_prices(conn: sqlite3.Connection, on_date: Optional[str] = None) -> dict[str, float]:
+    """Последняя цена по каждой позиции (на дату on_date включительно, если задана)."""
+    if on_date is None:
+        rows = conn.execute(
+            "SELECT p.name, p.price FROM prices p "
+            "JOIN (SELECT name, MAX(effective_date) AS d FROM prices GROUP BY name) last "
+            "ON p.name = last.name AND p.effective_date = last.d"
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT p.name, p.price FROM prices p "
+            "JOIN (SELECT name, MAX(effective_date) AS d FROM prices WHERE effective_date <= ? GROUP BY name) last "
+            "ON p.name = last.name AND p.effective_date = last.d",
+            (on_date,),
+        ).fetchall()
+    return {name: float(price) for name, price in rows}
+
+
+def _migrate_legacy_cache(conn: sqlite3.Connection, data_dir: Path) -> None:
+    """Однократный перенос старого JSON-кэша цен в хранилище."""
+    if _get_meta(conn, "legacy_migrated"):
+        return
+    cache_path = Path(data_dir) / LEGACY_CACHE_FILENAME
+    rows = []
+    if cache_path.exists():
+        try:
+            data = json.loads(cache_path.read_text(encoding="utf-8"))
+        except Exception:
+            data = {}
+        if isinstance(data, dict):
+            for k, v in data.items():
+                try:
+                    x = float(v)
+                except (TypeError, ValueError):
+                    continue
+                if x == x and abs(x) != float("inf"):
+                    name = str(k)
+                    rows.append((name, name.strip().lower(), "", x))
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO prices (name, name_lower, effective_date, price) VALUES (?, ?, ?, ?)", rows
+        )
+        _set_meta(conn, "legacy_migrated", "1")
+
+
+def sync_from_file(data_dir: Path, force: bool = False) -> Optional[dict[str, float]]:
+    """
+    Подтянуть прайс из файла в хранилище.
+    Возвращает None, если файл не менялся с прошлой загрузки (чтение пропущено),
+    иначе — словарь позиций, цена которых добавлена или изменилась (может быть пустым).
+    """
+    data_dir = Path(data_dir)
+    price_path = data_dir / PRICE_FILENAME
+    with closing(_connect(data_dir)) as conn:
+        _migrate_legacy_cache(conn, data_dir)
+        fingerprint = ingest_manifest.file_fingerprint(price_path)
+        if not force and fingerprint == (_get_meta(conn, "file_fingerprint") or ""):
+            return None
+        t0 = time.perf_counter()
+        new_prices = load_nomenclature_prices(str(data_dir)) if price_path.exists() else {}
+        ingest_manifest.reset_kind("prices")
+        if price_path.exists():
+            entry = ingest_manifest.record_file(price_path, "prices", None, time.perf_counter() - t0)
+            entry["rows"] = len(new_prices)
+        ingest_manifest.record_kind("prices", {"rows": len(new_prices), "exists": price_path.exists()})
+        current = _latest_prices(conn)
+        changed = {name: price for name, price in new_prices.items() if current.get(name) != price}
+        effective = datetime.fromtimestamp(price_path.stat().st_mtime).date().isoformat() if price_path.exists() else ""
+        with conn:
+            if changed:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO prices (name, name_lower, effective_date, price) VALUES (?, ?, ?, ?)",
+                    [(name, name.strip().lower(), effective, price) for name, price in changed.items()],
+                )
+            _set_meta(conn, "file_fingerprint", fingerprint)
+            _set_meta(conn, "file_count", str(len(new_prices)))
+        return changed
+
+
+def get_current_prices(data_dir: Path) -> dict[str, float]:
+    """Текущие цены {наименование: цена} — последняя известная цена по каждой позиции."""
+    with closing(_connect(data_dir)) as conn:
+        _migrate_legacy_cache(conn, data_dir)
+        return _latest_prices(conn)
+
+
+def get_prices_on(data_dir: Path, on_date: date) -> dict[str, float]:
+    """
+    Цены, действовавшие на дату on_date (последняя цена с датой начала не позже on_date).
+    Позиции, цена которых появилась позже on_date, берутся по самой ранней известной цене.
+    """
+    with closing(_connect(data_dir)) as conn:
+        _migrate_legacy_cache(conn, data_dir)
+        earliest = {
+            name: float(price)
+            for name, price in conn.execute(
+                "SELECT p.name, p.price FROM prices p "
+                "JOIN (SELECT name, MIN(effective_date) AS d FROM prices GROUP BY name) first "
+                "ON p.name = first.name AND p.effective_date = first.d"
+            ).fetchall()
+        }
+        return {**earliest, **_latest_prices(conn, on_date.isoformat())}
+
+
+def get_file_price_count(data_dir: Path) -> int:
+    """Сколько позиций было в последнем загруженном файле прайса."""
+    with closing(_connect(data_dir)) as conn:
+        try:
+            return int(_get_meta(conn, "file_count") or 0)
+        except ValueError:
+            return 0
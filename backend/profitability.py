@@ -0,0 +1,549 @@
+"""
+Расчёт рентабельности по периодам (поверх profitability_store и profitability_parser).
+
+Результаты расчёта кэшируются в памяти (LRU на RESULT_CACHE_SIZE записей). Ключ — период, хэши его отчётов,
+версии номенклатуры, себестоимостей и маппингов (profitability_store.get_input_versions) и ставки периода:
+любая загрузка или правка входных данных меняет ключ, и устаревший результат больше не используется.
+Кэшированные результаты общие для всех запросов — вызывающий код их не изменяет.
+
+После правки маппингов период не пересчитывается целиком: от его последнего расчёта заново определяются виды
+только затронутых артикулов, и перестраиваются только группы их старых и новых видов.
+
+Несколько периодов (основной и сравнение) считаются вместе: ещё не разобранные отчёты всех периодов
+разбираются параллельно в пуле процессов, справочники (prepare_lookups) готовятся один раз,
+расчёты периодов идут параллельно в потоках.
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+import profitability_parser as prof_parser
+import profitability_store as prof_store
+import profitability_suggest as prof_suggest
+
+RESULT_CACHE_SIZE = 32
+PARSE_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+_results: "OrderedDict[tuple, Any]" = OrderedDict()
+_results_guard = threading.Lock()
+
+# Последний расчёт каждого периода: после правки маппингов пересчитываются только затронутые артикулы.
+# {period_id: {"key": ключ без версии маппингов, "custom": маппинги расчёта, "positions": {артикул в нижнем
+# регистре: строки agg}, "agg", "value"}}
+_last_calc: "OrderedDict[str, dict]" = OrderedDict()
+LAST_CALC_SIZE = 8
+
+
+def _memo_get(key: tuple):
+    with _results_guard:
+        value = _results.get(key)
+        if value is not None:
+            _results.move_to_end(key)
+        return value
+
+
+def _memo_put(key: tuple, value):
+    with _results_guard:
+        _results[key] = value
+        _results.move_to_end(key)
+        while len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
+    return value
+
+
+def _memo(key: tuple, compute: Callable[[], Any]):
+    """Значение из LRU-кэша результатов (compute вызывается только при промахе)."""
+    value = _memo_get(key)
+    return value if value is not None else _memo_put(key, compute())
+
+
+def _memo_inputs(key: tuple, kinds: tuple, versions: dict, load: Callable[[], Any]):
+    """
+    Как _memo, для значений, прочитанных из входных данных: load выполняется вместе с чтением версий
+    (profitability_store.read_inputs). Если версии kinds уже не те, что в ключе (запись прошла после того,
+    как вызывающий прочитал версии), значение возвращается, но под старым ключом не кэшируется.
+    """
+    value = _memo_get(key)
+    if value is not None:
+        return value
+    current, value = prof_store.read_inputs(load)
+    if all(current.get(kind, 0) == versions.get(kind, 0) for kind in kinds):
+        _memo_put(key, value)
+    return value
+
+
+def clear_cache() -> None:
+    with _results_guard:
+        _results.clear()
+        _last_calc.clear()
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_guard = threading.Lock()
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    # spawn: дочерние процессы не наследуют потоки и блокировки веб-сервера
+    global _parse_pool
+    with _parse_pool_guard:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_pool
+
+
+def _reset_parse_pool(pool: ProcessPoolExecutor) -> None:
+    """Отбросить сломанный пул (если его ещё не заменили)."""
+    global _parse_pool
+    with _parse_pool_guard:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_report_file(path: str) -> pd.DataFrame:
+    return prof_parser.parse_weekly_report(Path(path).read_bytes())
+
+
+def _parse_missing_reports(period_ids: list[str]) -> None:
+    """Разобрать и сохранить отчёты периодов, для которых ещё нет артефакта; несколько файлов — в пуле процессов."""
+    missing: dict[str, Path] = {}
+    for period_id in period_ids:
+        for report_hash, path in prof_store.unparsed_weekly_reports(period_id):
+            missing.setdefault(report_hash, path)
+    if not missing:
+        return
+    parsed: dict[str, pd.DataFrame] = {}
+    if len(missing) > 1:
+        try:
+            pool = _get_parse_pool()
+            futures = {h: pool.submit(_parse_report_file, str(p)) for h, p in missing.items()}
+            for h, f in futures.items():
+                parsed[h] = f.result()
+        except BrokenProcessPool:
+            # Рабочий процесс упал (например, по памяти): пул больше не принимает задач — пересоздаётся
+            # при следующем разборе, а оставшиеся отчёты разбираются в текущем процессе
+            _reset_parse_pool(pool)
+    for h, p in missing.items():
+        if h not in parsed:
+            parsed[h] = _parse_report_file(str(p))
+    for report_hash, df in parsed.items():
+        prof_store.save_parsed_weekly(report_hash, df)
+
+
+def _report_df(period_id: str) -> Optional[pd.DataFrame]:
+    frames = prof_store.load_weekly_frames(period_id)
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _lookups(versions: dict) -> dict:
+    """Справочники для calculate_profitability (общие для всех периодов при тех же версиях входных данных)."""
+    key = ("lookups", versions.get("nomenclature", 0), versions.get("costs", 0), versions.get("mappings", 0))
+
+    def load() -> dict:
+        # После правки маппингов справочники из reference.sqlite3 не перечитываются
+        nomenclature_map, costs_map = _memo_inputs(
+            ("reference", versions.get("nomenclature", 0), versions.get("costs", 0)),
+            ("nomenclature", "costs"),
+            versions,
+            lambda: (prof_store.load_parsed_nomenclature() or {}, prof_store.load_parsed_costs() or {}),
+        )
+        custom_mappings = prof_store.get_custom_mappings()
+        return {
+            "nomenclature_map": nomenclature_map,
+            "costs_map": costs_map,
+            "custom_mappings": custom_mappings,
+            "prepared": prof_parser.prepare_lookups(nomenclature_map, costs_map, custom_mappings),
+        }
+
+    return _memo_inputs(key, ("nomenclature", "costs", "mappings"), versions, load)
+
+
+def _period_bases(hashes_by_period: dict[str, tuple]) -> dict[str, tuple[pd.DataFrame, float]]:
+    """
+    Свёртки отчётов периодов по артикулам (aggregate_report): из кэша, из хранилища или из разобранных отчётов.
+    Построенные свёртки сохраняются (profitability_store.save_period_aggregate).
+    """
+    bases: dict[str, tuple[pd.DataFrame, float]] = {}
+    missing: list[str] = []
+    for period_id, hashes in hashes_by_period.items():
+        key = ("base", period_id, hashes)
+        value = _memo_get(key)
+        if value is None:
+            value = prof_store.load_period_aggregate(period_id, list(hashes))
+            if value is not None:
+                _memo_put(key, value)
+        if value is None:
+            missing.append(period_id)
+        else:
+            bases[period_id] = value
+    if missing:
+        _parse_missing_reports(missing)
+        for period_id in missing:
+            hashes = hashes_by_period[period_id]
+            base, total_ads = prof_parser.aggregate_report(_report_df(period_id))
+            prof_store.save_period_aggregate(period_id, list(hashes), base, total_ads)
+            bases[period_id] = _memo_put(("base", period_id, hashes), (base, total_ads))
+    return bases
+
+
+def _period_inputs(period_ids: list[str]) -> dict[str, tuple]:
+    """Периоды с отчётами: {period_id: (хэши отчётов, ставки периода)}."""
+    inputs = {}
+    for period_id in dict.fromkeys(period_ids):
+        hashes = tuple(prof_store.weekly_report_hashes(period_id))
+        if hashes:
+            inputs[period_id] = (hashes, prof_store.get_work_rates_for_period(period_id))
+    return inputs
+
+
+def _versions_key(versions: dict, work_rates: dict) -> tuple:
+    return (
+        versions.get("nomenclature", 0), versions.get("costs", 0), versions.get("mappings", 0),
+        tuple(sorted(work_rates.items())),
+    )
+
+
+def _period_metrics(period_id: str, hashes: tuple, work_rates: dict, base, versions: dict, lookups: dict) -> pd.DataFrame:
+    """Показатели по артикулам периода (article_metrics) при текущих справочниках и ставках."""
+    def compute() -> pd.DataFrame:
+        prepared = lookups["prepared"]
+        frame, total_ads = base
+        return prof_parser.article_metrics(
+            frame, prof_parser.assign_vids(frame, prepared), prepared, work_rates, total_ads
+        )
+
+    return _memo(("metrics", period_id, hashes, *_versions_key(versions, work_rates)), compute)
+
+
+def _changed_mapping_keys(old: dict[str, str], new: dict[str, str]) -> set[str]:
+    """Артикулы (в нижнем регистре), у которых кастомный маппинг добавлен, изменён или удалён."""
+    return {k.lower() for k in old.keys() | new.keys() if old.get(k) != new.get(k)}
+
+
+def _article_positions(agg: pd.DataFrame) -> dict[str, list[int]]:
+    positions: dict[str, list[int]] = {}
+    for i, article in enumerate(agg["артикул"].str.lower().tolist()):
+        positions.setdefault(article, []).append(i)
+    return positions
+
+
+def _rebucket_period(state: dict, base, lookups: dict) -> tuple[pd.DataFrame, dict]:
+    """Расчёт периода из предыдущего (state) после правки маппингов: меняются только затронутые артикулы и их виды."""
+    changed = _changed_mapping_keys(state["custom"], lookups["custom_mappings"])
+    positions = sorted(i for k in changed for i in state["positions"].get(k, ()))
+    old_agg, old_value = state["agg"], state["value"]
+    if not positions:
+        return old_agg, old_value
+    frame, _ = base
+    agg = prof_parser.rebucket_articles(old_agg, frame, positions, lookups["prepared"])
+    old_vids = old_agg["вид"].iloc[positions].tolist()
+    new_vids = agg["вид"].iloc[positions].tolist()
+    articles = agg["артикул"].iloc[positions].tolist()
+    now_unmatched = {a for a, vid in zip(articles, new_vids) if vid == ""}
+    unmatched = (set(old_value["unmatched"]) - set(articles)) | now_unmatched
+    value = {
+        **old_value,
+        "rows": prof_parser.update_profitability_rows(old_value["rows"], agg, positions, set(old_vids) | set(new_vids)),
+        "unmatched": sorted(unmatched),
+    }
+    return agg, value
+
+
+def calculate_periods(period_ids: list[str]) -> dict[str, Optional[dict]]:
+    """
+    Рентабельность нескольких периодов: {period_id: {files_count, work_rates, rows, unmatched}}.
+    None — у периода нет отчётов.
+    """
+    versions = prof_store.get_input_versions()
+    inputs = _period_inputs(period_ids)
+    result: dict[str, Optional[dict]] = {period_id: None for period_id in period_ids}
+    pending: dict[str, tuple] = {}
+    for period_id, (hashes, work_rates) in inputs.items():
+        key = ("period", period_id, hashes, *_versions_key(versions, work_rates))
+        cached = _memo_get(key)
+        if cached is not None:
+            result[period_id] = cached
+        else:
+            pending[period_id] = key
+    if not pending:
+        return result
+
+    bases = _period_bases({period_id: inputs[period_id][0] for period_id in pending})
+    lookups = _lookups(versions)
+
+    def run(period_id: str) -> dict:
+        hashes, work_rates = inputs[period_id]
+        versions_key = _versions_key(versions, work_rates)
+        # Всё, кроме версии маппингов: при совпадении достаточно перераспределить изменённые артикулы
+        state_key = (hashes, versions_key[0], versions_key[1], versions_key[3])
+        with _results_guard:
+            state = _last_calc.get(period_id)
+        if state is not None and state["key"] == state_key:
+            agg, value = _rebucket_period(state, bases[period_id], lookups)
+            _memo_put(("metrics", period_id, hashes, *versions_key), agg)
+            positions = state["positions"]
+        else:
+            agg = _period_metrics(period_id, hashes, work_rates, bases[period_id], versions, lookups)
+            unmatched = sorted(agg.loc[agg["вид"] == "", "артикул"].unique().tolist())
+            value = {
+                "files_count": len(hashes),
+                "work_rates": work_rates,
+                "rows": prof_parser.build_profitability_rows(agg),
+                "unmatched": unmatched,
+            }
+            positions = _article_positions(agg)
+        with _results_guard:
+            _last_calc[period_id] = {
+                "key": state_key, "custom": lookups["custom_mappings"], "positions": positions, "agg": agg, "value": value,
+            }
+            _last_calc.move_to_end(period_id)
+            while len(_last_calc) > LAST_CALC_SIZE:
+                _last_calc.popitem(last=False)
+        return _memo_put(pending[period_id], value)
+
+    if len(pending) == 1:
+        (period_id,) = pending
+        result[period_id] = run(period_id)
+    else:
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            for period_id, value in zip(pending, executor.map(run, pending)):
+                result[period_id] = value
+    return result
+
+
+def calculate_period(period_id: str) -> Optional[dict]:
+    """
+    Рентабельность периода: {files_count, work_rates, rows, unmatched}.
+    None — у периода нет отчётов.
+    """
+    return calculate_periods([period_id])[period_id]
+
+
+def _period_combined_map(period_id: str, hashes: tuple, base: pd.DataFrame, versions: dict, custom_mappings: dict) -> dict:
+    """
+    Маппинг артикулов периода {артикул в нижнем регистре: вид}: из файла видов читаются только артикулы периода
+    (один раз на версию номенклатуры), поверх — кастомные маппинги.
+    """
+    combined_lower = dict(_memo_inputs(
+        ("period_nomenclature", period_id, hashes, versions.get("nomenclature", 0)),
+        ("nomenclature",),
+        versions,
+        lambda: prof_store.load_nomenclature_for(base["артикул"].unique().tolist()),
+    ))
+    combined_lower.update({k.lower(): v for k, v in custom_mappings.items()})
+    return combined_lower
+
+
+def unmatched_articles(period_id: str) -> Optional[dict]:
+    """
+    Артикулы периода без вида номенклатуры (по файлу видов и кастомным маппингам) и все известные виды:
+    {unmatched, all_vids}. None — у периода нет отчётов.
+    """
+    hashes = tuple(prof_store.weekly_report_hashes(period_id))
+    if not hashes:
+        return None
+    versions = prof_store.get_input_versions()
+    key = ("unmatched", period_id, hashes, versions.get("nomenclature", 0), versions.get("mappings", 0))
+
+    def compute() -> dict:
+        base, _ = _period_bases({period_id: hashes})[period_id]
+        all_articles = base["артикул"].unique().tolist()
+        custom_mappings = prof_store.get_custom_mappings()
+        # case-insensitive lookup
+        combined_lower = _period_combined_map(period_id, hashes, base, versions, custom_mappings)
+        unmatched = [a for a in all_articles if a and combined_lower.get(a.lower()) is None]
+        # Список всех известных видов для UI
+        all_vids = sorted(set(prof_store.list_nomenclature_vids()) | set(custom_mappings.values()))
+        return {"unmatched": sorted(unmatched), "all_vids": all_vids}
+
+    return _memo(key, compute)
+
+
+def _suggestion_indexes(versions: dict) -> tuple[dict, dict]:
+    """
+    Индексы подсказок (profitability_suggest.build_index): по файлу видов — пересобирается только при новой
+    номенклатуре, и небольшой по кастомным маппингам — при их изменении.
+    """
+    lookups = _lookups(versions)
+
+    def docs(mapping: dict[str, str]) -> list[tuple[str, str]]:
+        return list(mapping.items()) + [(vid, vid) for vid in sorted(set(mapping.values()))]
+
+    nomenclature_index = _memo(
+        ("suggest_index", "nomenclature", versions.get("nomenclature", 0)),
+        lambda: prof_suggest.build_index(docs(lookups["nomenclature_map"])),
+    )
+    custom_index = _memo(
+        ("suggest_index", "custom", versions.get("nomenclature", 0), versions.get("mappings", 0)),
+        lambda: prof_suggest.build_index(docs(lookups["custom_mappings"]), reference=nomenclature_index),
+    )
+    return nomenclature_index, custom_index
+
+
+def suggest_vids(period_id: str, limit: int = 3) -> Optional[dict]:
+    """
+    Виды-кандидаты для несопоставленных артикулов периода: {suggestions: {артикул: [{vid, score}]}}.
+    Кандидаты — по похожим известным артикулам и названиям видов (индекс profitability_suggest)
+    и по видам артикулов того же бренда в периоде. None — у периода нет отчётов.
+    """
+    data = unmatched_articles(period_id)
+    if data is None:
+        return None
+    hashes = tuple(prof_store.weekly_report_hashes(period_id))
+    versions = prof_store.get_input_versions()
+    key = ("suggestions", period_id, hashes, versions.get("nomenclature", 0), versions.get("mappings", 0), limit)
+
+    def compute() -> dict:
+        base, _ = _period_bases({period_id: hashes})[period_id]
+        nomenclature_index, custom_index = _suggestion_indexes(versions)
+        custom_mappings = _lookups(versions)["custom_mappings"]
+        custom_lower = {k.lower() for k in custom_mappings}
+        combined_lower = _period_combined_map(period_id, hashes, base, versions, custom_mappings)
+
+        # Доли видов среди сопоставленных артикулов каждого бренда
+        brand_counts: dict[str, dict[str, int]] = {}
+        article_brand: dict[str, str] = {}
+        for article, brand in zip(base["артикул"].tolist(), base["бренд"].str.strip().str.lower().tolist()):
+            vid = combined_lower.get(article.lower())
+            if vid:
+                counts = brand_counts.setdefault(brand, {})
+                counts[vid] = counts.get(vid, 0) + 1
+            else:
+                article_brand.setdefault(article, brand)
+        brand_shares = {
+            brand: {vid: n / sum(counts.values()) for vid, n in counts.items()}
+            for brand, counts in brand_counts.items()
+        }
+
+        suggestions = {}
+        for article in data["unmatched"]:
+            # Документы файла видов, переопределённые кастомным маппингом, берутся из индекса маппингов
+            hits = [
+                (nomenclature_index["labels"][i], score)
+                for i, score in prof_suggest.search(nomenclature_index, article)
+                if nomenclature_index["keys"][i] not in custom_lower
+            ]
+            hits += [(custom_index["labels"][i], score) for i, score in prof_suggest.search(custom_index, article)]
+            suggestions[article] = prof_suggest.rank_vids(
+                hits, brand_shares.get(article_brand.get(article, "")), limit=limit
+            )
+        return {"suggestions": suggestions}
+
+    return _memo(key, compute)
+
+
+def accept_suggestions(
+    period_id: str,
+    articles: Optional[list[str]] = None,
+    min_score: float = 0.0,
+    username: str = "unknown",
+) -> Optional[dict]:
+    """
+    Принять подсказки (suggest_vids) как кастомные маппинги.
+    Для перечисленных articles принимается лучший вид (как в подсказках), если его оценка не ниже min_score.
+    Без articles — для всех несопоставленных артикулов периода, только при min_score > 0 и только кандидаты
+    со сходством текста (кандидаты лишь по бренду пропускаются). Возвращает {mappings}; None — нет отчётов.
+    """
+    if articles is None and not min_score > 0:
+        raise ValueError("Укажите артикулы или min_score больше 0")
+    data = suggest_vids(period_id)
+    if data is None:
+        return None
+    chosen = {}
+    if articles is not None:
+        for article in dict.fromkeys(articles):
+            candidates = data["suggestions"].get(article)
+            if candidates and candidates[0]["score"] >= min_score:
+                chosen[article] = candidates[0]["vid"]
+    else:
+        for article, candidates in data["suggestions"].items():
+            best = next((c for c in candidates if c["text_score"] > 0), None)
+            if best is not None and best["score"] >= min_score:
+                chosen[article] = best["vid"]
+    if chosen:
+        prof_store.set_custom_mappings_bulk(chosen, username=username)
+    return {"mappings": chosen}
+
+
+# Метрики ряда: суммируемые показатели вида/артикула и доли, пересчитываемые из сумм
+SERIES_RATIOS = ("рентабельность_пct", "доля_себестоимости", "средняя_цена")
+
+
+def _series_values(grouped: pd.DataFrame, keys: list[str], periods: list[str]) -> list[dict]:
+    """Строки ряда: ключи + {метрика: [значение по каждому периоду или None]}; порядок — по реализации за все периоды."""
+    wide = grouped.unstack("period").reindex(columns=pd.MultiIndex.from_product([grouped.columns, periods]))
+    values = {col: wide[col].to_numpy(dtype=float) for col in prof_parser.SUM_COLS}
+    order = np.argsort(-np.nan_to_num(values["реализация"]).sum(axis=1), kind="stable")
+
+    def ratio(num: np.ndarray, den: np.ndarray, scale: float) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(den != 0, num / den * scale, 0.0)
+
+    values["рентабельность_пct"] = ratio(values["маржа_после_рекламы"], values["реализация"], 100)
+    values["доля_себестоимости"] = ratio(values["итого_себестоимость"], values["реализация"], 100)
+    values["средняя_цена"] = ratio(values["реализация"], values["количество"], 1)
+    lists = {
+        col: [[None if v != v else v for v in row] for row in np.round(arr[order], 2).tolist()]
+        for col, arr in values.items()
+    }
+    index = wide.index[order].tolist()
+    return [
+        {
+            **dict(zip(keys, key if isinstance(key, tuple) else (key,))),
+            "metrics": {col: lists[col][i] for col in lists},
+        }
+        for i, key in enumerate(index)
+    ]
+
+
+def period_series(period_ids: list[str], include_articles: bool = False, vid: Optional[str] = None) -> dict:
+    """
+    Показатели рентабельности по видам номенклатуры (и по артикулам) сразу за несколько периодов.
+    Считается по сохранённым свёрткам периодов (без разбора отчётов), значения — по порядку period_ids.
+    vid — оставить только артикулы этого вида ("Без вида" — артикулы без вида).
+    """
+    versions = prof_store.get_input_versions()
+    inputs = _period_inputs(period_ids)
+    periods = [p for p in dict.fromkeys(period_ids) if p in inputs]
+    labels = {p["id"]: p.get("label") or p["id"] for p in prof_store.list_periods()}
+    result = {
+        "periods": [{"id": p, "label": labels.get(p, p)} for p in periods],
+        "metrics": [*prof_parser.SUM_COLS, *SERIES_RATIOS],
+        "types": [],
+        "articles": [] if include_articles else None,
+    }
+    if not periods:
+        return result
+
+    bases = _period_bases({p: inputs[p][0] for p in periods})
+    lookups = _lookups(versions)
+    frames = []
+    for period_id in periods:
+        hashes, work_rates = inputs[period_id]
+        agg = _period_metrics(period_id, hashes, work_rates, bases[period_id], versions, lookups)
+        frame = agg[["артикул", "вид", *prof_parser.SUM_COLS]].copy()
+        frame["вид"] = frame["вид"].where(frame["вид"] != "", "Без вида")
+        frame["period"] = period_id
+        frames.append(frame)
+    data = pd.concat(frames, ignore_index=True)
+
+    by_type = data.groupby(["вид", "period"])[prof_parser.SUM_COLS].sum()
+    result["types"] = _series_values(by_type, ["вид"], periods)
+    if include_articles:
+        articles = data if not vid else data[data["вид"] == vid]
+        by_article = articles.groupby(["артикул", "вид", "period"])[prof_parser.SUM_COLS].sum()
+        result["articles"] = _series_values(by_article, ["артикул", "вид"], periods)
+    return result
@@ -9,6 +9,7 @@
 
 import io
 import re
+import numpy as np
 import pandas as pd
 from typing import Optional
 
@@ -59,6 +60,84 @@ _ADS_LOGISTICS_PATTERNS = ["wb медиа", "wb продвижение", "wibes"
 # Строки-типы которые нужно удалить (по колонке AQ)
 _SKIP_LOGISTICS_KINDS = {"возмещение издержек по перевозке"}
 
+# Колонки отчёта, которые читает parse_weekly_report (остальные колонки WB не читаются)
+_WEEKLY_COLUMNS = (
+    _COL_BRAND, _COL_ARTICLE, _COL_TYPE, _COL_TYPE_ALT, _COL_SALE_DATE, _COL_QTY, _COL_PRICE,
+    _COL_ACQUIRING, _COL_PAYOUT, _COL_LOGISTICS, _COL_LOGISTICS_KINDS, _COL_ADS, _COL_WITHHOLDINGS,
+)
+_WEEKLY_REQUIRED = (_COL_BRAND, _COL_ARTICLE, _COL_QTY, _COL_PRICE)
+
+# Сколько строк читать для определения недели отчёта
+WEEK_SAMPLE_ROWS = 2000
+
+# Значения, которые pd.read_excel читает как пустые (плюс ошибки Excel)
+_NA_TEXT = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#NULL!",
+}
+
+
+def _cell_text(value):
+    """Значение ячейки как строка — так же, как pd.read_excel(..., dtype=str); пустое — NaN."""
+    if value is None:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value)
+    return np.nan if text in _NA_TEXT else text
+
+
+def read_report_columns(file_bytes: bytes, columns, max_rows: Optional[int] = None) -> pd.DataFrame:
+    """
+    Читает из первого листа только колонки columns (по заголовку в первой строке), значения — строки.
+    Совпадает с pd.read_excel(..., header=0, dtype=str)[найденные колонки], но не строит остальные колонки.
+    max_rows — прочитать только первые (примерно) max_rows строк (проба).
+    Все заголовки листа — в df.attrs["header"].
+    """
+    from openpyxl import load_workbook
+
+    wanted = set(columns)
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = [str(_cell_text(v)).strip() if v is not None else "" for v in (next(rows, None) or ())]
+        picked: dict[str, int] = {}
+        for i, name in enumerate(header):
+            if name in wanted and name not in picked:
+                picked[name] = i
+        data: dict[str, list] = {name: [] for name in picked}
+        count = 0
+        blank = 0  # пустые строки пишутся, только если после них есть данные (как в pandas)
+        for row in rows:
+            if all(v is None or v == "" for v in row):
+                blank += 1
+                continue
+            for name, i in picked.items():
+                column = data[name]
+                column.extend([np.nan] * blank)
+                column.append(_cell_text(row[i]) if i < len(row) else np.nan)
+            count += blank + 1
+            blank = 0
+            if max_rows is not None and count >= max_rows:
+                break
+    finally:
+        wb.close()
+    df = pd.DataFrame(data, dtype=object)
+    df.attrs["header"] = header
+    return df
+
+
+def validate_weekly_report(file_bytes: bytes) -> None:
+    """Быстрая проверка отчёта по заголовку и первой строке: ValueError, если нет обязательных колонок."""
+    df = read_report_columns(file_bytes, _WEEKLY_REQUIRED, max_rows=1)
+    if not all(c in df.columns for c in _WEEKLY_REQUIRED):
+        raise ValueError(
+            f"Не найдены обязательные колонки. Найдены: {df.attrs['header'][:20]}"
+        )
+
 
 def parse_weekly_report(file_bytes: bytes) -> pd.DataFrame:
     """
@@ -68,9 +147,8 @@ def parse_weekly_report(file_bytes: bytes) -> pd.DataFrame:
       количество, цена, реализация,
       эквайринг, к_перечислению, услуги_мп, логистика, реклама
     """
-    df = pd.read_excel(io.BytesIO(file_bytes), header=0, dtype=str)
-    # Убираем пробелы из заголовков
-    df.columns = [str(c).strip() for c in df.columns]
+    # Читаются только нужные колонки (заголовки — без пробелов по краям)
+    df = read_report_columns(file_bytes, _WEEKLY_COLUMNS)
 
     def col(name: str, alt: Optional[str] = None) -> Optional[str]:
         """Возвращает имя колонки если есть, иначе alt или None."""
@@ -94,7 +172,7 @@ def parse_weekly_report(file_bytes: bytes) -> pd.DataFrame:
 
     if not all([brand_col, article_col, qty_col, price_col]):
         raise ValueError(
-            f"Не найдены обязательные колонки. Найдены: {list(df.columns[:20])}"
+            f"Не найдены обязательные колонки. Найдены: {df.attrs['header'][:20]}"
         )
 
     # --- Определяем строки-продажи и строки-сервисные ---
@@ -179,11 +257,11 @@ def detect_week_from_report(file_bytes: bytes) -> Optional[str]:
     """
     Определяет ISO-неделю из данных WB-отчёта по колонке "Дата продажи".
     Возвращает строку вида "2026-W12" или None.
-    Выбирает неделю с наибольшим числом строк продаж.
+    Выбирает неделю с наибольшим числом строк продаж среди первых WEEK_SAMPLE_ROWS строк
+    (читается только колонка даты).
     """
     try:
-        df = pd.read_excel(io.BytesIO(file_bytes), header=0, dtype=str)
-        df.columns = [str(c).strip() for c in df.columns]
+        df = read_report_columns(file_bytes, [_COL_SALE_DATE], max_rows=WEEK_SAMPLE_ROWS)
         date_col = _COL_SALE_DATE if _COL_SALE_DATE in df.columns else None
         if not date_col:
             return None
@@ -229,50 +307,56 @@ def parse_nomenclature_file(file_bytes: bytes) -> dict[str, str]:
         sheet = xl.sheet_names[0]
 
     df = pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet, header=None)
+    col0 = _text_column(df, 0)
+    col1 = _text_column(df, 1)
 
-    # Определяем формат по первой непустой строке
+    # Определяем формат по первой строке
     # Плоский формат: первая строка содержит "артикул" в col0 и непустое значение в col1
-    first_row = df.iloc[0] if len(df) > 0 else None
-    is_flat = False
-    if first_row is not None:
-        v0 = str(first_row.iloc[0]).strip().lower() if not pd.isna(first_row.iloc[0]) else ""
-        v1 = str(first_row.iloc[1]).strip().lower() if len(first_row) > 1 and not pd.isna(first_row.iloc[1]) else ""
-        if "артикул" in v0 and v1:
-            is_flat = True
-
-    mapping: dict[str, str] = {}
+    is_flat = len(df) > 0 and "артикул" in col0.iloc[0].lower() and col1.iloc[0] != ""
 
     if is_flat:
         # Плоский формат: пропускаем строку заголовка и пустые строки
-        for _, row in df.iloc[1:].iterrows():
-            art = row.iloc[0] if len(row) > 0 else None
-            vid = row.iloc[1] if len(row) > 1 else None
-            if pd.isna(art) or pd.isna(vid):
-                continue
-            art = str(art).strip()
-            vid = str(vid).strip()
-            if art and vid:
-                mapping[art] = vid
-    else:
-        # Иерархический 1C-формат
-        current_vid = None
-        _SKIP = {"Артикул", "Категория", "Номенклатура.Вид номенклатуры",
-                 "Номенклатура.Артикул", "Отчет по категориям товаров"}
-        for _, row in df.iterrows():
-            v0 = row.iloc[0] if len(row) > 0 else None
-            v1 = row.iloc[1] if len(row) > 1 else None
-            if pd.isna(v0):
-                continue
-            v0 = str(v0).strip()
-            if not v0 or v0 in _SKIP:
-                continue
-            if pd.isna(v1) or str(v1).strip() == "":
-                current_vid = v0
-            else:
-                if current_vid:
-                    mapping[v0] = current_vid
-
-    return mapping
+        arts, vids = col0.iloc[1:], col1.iloc[1:]
+        keep = (arts != "") & (vids != "")
+        return dict(zip(arts[keep].tolist(), vids[keep].tolist()))
+
+    # Иерархический 1C-формат: строка без col1 — вид, следующие за ней строки — его артикулы
+    _SKIP = {"Артикул", "Категория", "Номенклатура.Вид номенклатуры",
+             "Номенклатура.Артикул", "Отчет по категориям товаров"}
+    rows = (col0 != "") & ~col0.isin(_SKIP)
+    names, values = col0[rows], col1[rows]
+    is_vid = values == ""
+    current_vid = names.where(is_vid).ffill()
+    articles = ~is_vid & current_vid.notna()
+    return dict(zip(names[articles].tolist(), current_vid[articles].tolist()))
+
+
+def _text_column(df: pd.DataFrame, i: int) -> pd.Series:
+    """Колонка i листа как строки без пробелов по краям; пустые ячейки и отсутствующая колонка — ""."""
+    if i >= df.shape[1]:
+        return pd.Series("", index=df.index, dtype=object)
+    col = df.iloc[:, i]
+    return col.astype(object).where(col.notna(), "").astype(str).str.strip()
+
+
+def _float_column(df: pd.DataFrame, i: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Колонка i листа как float (пустые — 0.0) и маска строк, где значение не число.
+    Преобразование — как float(): непонятые pd.to_numeric значения проверяются поштучно.
+    """
+    if i >= df.shape[1]:
+        return np.zeros(len(df)), np.zeros(len(df), dtype=bool)
+    col = df.iloc[:, i]
+    values = pd.to_numeric(col, errors="coerce").to_numpy(dtype=float, na_value=np.nan, copy=True)
+    missing = col.isna().to_numpy()
+    bad = np.zeros(len(df), dtype=bool)
+    for j in np.flatnonzero(np.isnan(values) & ~missing):
+        try:
+            values[j] = float(col.iloc[j])
+        except (ValueError, TypeError):
+            bad[j] = True
+    values[missing] = 0.0
+    return values, bad
 
 
 # ---------------------------------------------------------------------------
@@ -309,126 +393,176 @@ def parse_costs_file(
     df = pd.read_excel(io.BytesIO(file_bytes), header=None)
 
     # Первые 4 строки — служебные заголовки 1C
-    data = df.iloc[4:].copy()
-    data.columns = range(len(data.columns))
+    data = df.iloc[4:].reset_index(drop=True)
 
     # case-insensitive множество известных артикулов из файла видов
     article_names_lower: set[str] = set()
     if nomenclature_map:
         article_names_lower = {k.lower() for k in nomenclature_map.keys()}
 
-    costs: dict[str, dict] = {}
-
     # Строки-итоги 1C (организации, итоговые строки) — пропускаем
     _SKIP_NAMES = {"подарки оптом ооо"}
 
-    for _, row in data.iterrows():
-        name = row.iloc[0] if len(row) > 0 else None
-        qty_val = row.iloc[8] if len(row) > 8 else None
-        cost_val = row.iloc[13] if len(row) > 13 else None
+    names = _text_column(data, 0)
+    lower = names.str.lower()
+    qty, qty_bad = _float_column(data, 8)
+    cost, cost_bad = _float_column(data, 13)
+    keep = ((names != "") & ~lower.isin(_SKIP_NAMES)).to_numpy() & ~qty_bad & ~cost_bad
+
+    # Дубли → агрегация (суммы по порядку строк, как при поэлементном сложении)
+    codes, uniques = pd.factorize(names[keep])
+    qty_sum = np.zeros(len(uniques))
+    cost_sum = np.zeros(len(uniques))
+    np.add.at(qty_sum, codes, qty[keep])
+    np.add.at(cost_sum, codes, cost[keep])
+    unit_cost = np.zeros(len(uniques))
+    np.divide(cost_sum, qty_sum, out=unit_cost, where=qty_sum != 0)
+
+    # Уровень: артикул (из номенклатурного файла) или вид
+    return {
+        name: {
+            "qty": q, "total_cost": c,
+            "level": "article" if name.lower() in article_names_lower else "vid",
+            "unit_cost": u,
+        }
+        for name, q, c, u in zip(uniques.tolist(), qty_sum.tolist(), cost_sum.tolist(), unit_cost.tolist())
+    }
 
-        if pd.isna(name) or not str(name).strip():
-            continue
 
-        name = str(name).strip()
-
-        if name.lower() in _SKIP_NAMES:
-            continue
+# ---------------------------------------------------------------------------
+# Расчёт рентабельности
+# ---------------------------------------------------------------------------
 
-        try:
-            qty = float(qty_val) if not pd.isna(qty_val) else 0.0
-            cost = float(cost_val) if not pd.isna(cost_val) else 0.0
-        except (ValueError, TypeError):
-            continue
+# Рублёвые метрики, для которых считаются показатели на единицу
+RUB_METRIC_COLS = [
+    "реализация", "себестоимость", "работа", "итого_себестоимость",
+    "логистика", "услуги_мп", "реклама",
+    "маржа_до_рекламы", "маржа_после_рекламы",
+]
 
-        # Определяем уровень: артикул (из номенклатурного файла) или вид
-        level = "article" if name.lower() in article_names_lower else "vid"
+# Суммируемые колонки для итогов по виду
+SUM_COLS = [
+    "количество", "реализация", "эквайринг", "услуги_мп",
+    "логистика", "реклама", "себестоимость", "работа",
+    "итого_себестоимость", "маржа_до_рекламы", "маржа_после_рекламы",
+]
 
-        if name in costs:
-            costs[name]["qty"] += qty
-            costs[name]["total_cost"] += cost
-        else:
-            costs[name] = {"qty": qty, "total_cost": cost, "level": level}
 
-    # Рассчитываем unit_cost
-    for c in costs.values():
-        c["unit_cost"] = c["total_cost"] / c["qty"] if c["qty"] != 0 else 0.0
+def _ratio(num: pd.Series, den: pd.Series) -> pd.Series:
+    """Поэлементно num / den, 0.0 там, где den == 0."""
+    n = num.to_numpy(dtype=float)
+    d = den.to_numpy(dtype=float)
+    out = np.zeros(len(n))
+    np.divide(n, d, out=out, where=d != 0)
+    return pd.Series(out, index=num.index)
 
-    return costs
 
+def _repacking_vid(nomenclature_map: dict[str, str], marker: str) -> Optional[str]:
+    """Вид переупаковки, содержащий marker (люминарк / ламинар) и «переупаковк»."""
+    for vid in set(nomenclature_map.values()):
+        vid_lower = vid.lower()
+        if marker in vid_lower and "переупаковк" in vid_lower:
+            return vid
+    return None
 
-# ---------------------------------------------------------------------------
-# Расчёт рентабельности
-# ---------------------------------------------------------------------------
 
-def calculate_profitability(
-    report_df: pd.DataFrame,
+def prepare_lookups(
     nomenclature_map: dict[str, str],
     costs_map: dict[str, dict],
     custom_mappings: dict[str, str],
-    work_rates: dict[str, float],  # {luminarc: X, engraving: X, tea: X}
-) -> tuple[list[dict], list[str]]:
+) -> dict:
     """
-    Рассчитывает рентабельность по артикулам и видам номенклатуры.
-
-    Возвращает:
-      - rows: список строк для таблицы (иерархия: вид → артикулы)
-      - unmatched: список артикулов без вида номенклатуры
+    Предобработка справочников для calculate_profitability (не зависит от отчёта и ставок):
+    объединённый маппинг артикул → вид, виды переупаковки, себестоимость единицы по артикулу и по виду.
+    Один результат можно использовать для расчёта нескольких периодов.
     """
-    df = report_df.copy()
-
     # Объединённый маппинг (case-insensitive): сначала кастомный, потом из файла
     combined_map_lower = {k.lower(): v for k, v in nomenclature_map.items()}
     combined_map_lower.update({k.lower(): v for k, v in custom_mappings.items()})
 
-    df["вид"] = df["артикул"].str.lower().map(combined_map_lower).fillna("")
+    # Себестоимость единицы (материальная):
+    # 1. article-level по артикулу (case-insensitive) — приоритет
+    # 2. fallback: vid-level по виду номенклатуры
+    costs_lower = {k.lower(): v for k, v in costs_map.items()}
+    article_cost = {k: v["unit_cost"] for k, v in costs_lower.items() if v.get("level") == "article"}
+
+    luminarc_repacking_vid = _repacking_vid(nomenclature_map, "люминарк")
+    laminar_repacking_vid = _repacking_vid(nomenclature_map, "ламинар")
+
+    vid_cost = {}
+    for vid in set(combined_map_lower.values()) | {luminarc_repacking_vid, laminar_repacking_vid}:
+        if vid:
+            vid_rec = costs_map.get(vid) or costs_lower.get(vid.lower())
+            if vid_rec:
+                vid_cost[vid] = vid_rec["unit_cost"]
+
+    return {
+        "combined_map_lower": combined_map_lower,
+        "luminarc_repacking_vid": luminarc_repacking_vid,
+        "laminar_repacking_vid": laminar_repacking_vid,
+        "article_cost": article_cost,
+        "vid_cost": vid_cost,
+    }
+
+
+def aggregate_report(report_df: pd.DataFrame) -> tuple[pd.DataFrame, float]:
+    """
+    Свёртка отчёта по (артикул, бренд, направление) — не зависит от справочников и ставок,
+    поэтому её можно хранить и пересчитывать рентабельность без исходного отчёта.
+    Возвращает (свёртка, общая реклама отчёта).
+    """
+    # Суммируем общую рекламу из отчёта (3 строки — не привязаны к артикулам)
+    # Они распределятся пропорционально реализации после группировки
+    total_реклама = float(report_df["реклама"].sum())
+
+    base = report_df.groupby(["артикул", "бренд", "направление"], as_index=False).agg(
+        количество=("количество", "sum"),
+        реализация=("реализация", "sum"),
+        эквайринг=("эквайринг", "sum"),
+        услуги_мп=("услуги_мп", "sum"),
+        логистика=("логистика", "sum"),
+    )
+    return base, total_реклама
+
+
+def assign_vids(base: pd.DataFrame, lookups: dict) -> pd.Series:
+    """Вид номенклатуры для строк свёртки: маппинг по артикулу, затем авто-маппинг по бренду; "" — без вида."""
+    vids = base["артикул"].str.lower().map(lookups["combined_map_lower"]).fillna("")
 
     # Авто-маппинг по бренду (для артикулов без вида)
     # Бренд "Luminarc" / "Люминарк" → вид содержащий "люминарк" + "переупаковк"
-    luminarc_repacking_vid = None
-    for vid in set(nomenclature_map.values()):
-        vid_lower = vid.lower()
-        if "люминарк" in vid_lower and "переупаковк" in vid_lower:
-            luminarc_repacking_vid = vid
-            break
+    luminarc_repacking_vid = lookups["luminarc_repacking_vid"]
     if luminarc_repacking_vid:
-        art_has_luminarc = df["артикул"].str.lower().str.contains("luminarc", na=False)
+        art_has_luminarc = base["артикул"].str.lower().str.contains("luminarc", na=False)
         mask_lum = (
-            (df["направление"] == "luminarc") | art_has_luminarc
-        ) & (df["вид"] == "")
-        df.loc[mask_lum, "вид"] = luminarc_repacking_vid
+            (base["направление"] == "luminarc") | art_has_luminarc
+        ) & (vids == "")
+        vids = vids.mask(mask_lum, luminarc_repacking_vid)
 
     # Бренд "Люминар" (не Люминарк) → вид содержащий "ламинар" + "переупаковк"
-    laminar_repacking_vid = None
-    for vid in set(nomenclature_map.values()):
-        vid_lower = vid.lower()
-        if "ламинар" in vid_lower and "переупаковк" in vid_lower:
-            laminar_repacking_vid = vid
-            break
+    laminar_repacking_vid = lookups["laminar_repacking_vid"]
     if laminar_repacking_vid:
-        brand_lower = df["бренд"].str.strip().str.lower()
+        brand_lower = base["бренд"].str.strip().str.lower()
         mask_laminar = (
             brand_lower.str.contains("люминар", na=False)
             & ~brand_lower.str.contains("люминарк", na=False)
-            & (df["вид"] == "")
+            & (vids == "")
         )
-        df.loc[mask_laminar, "вид"] = laminar_repacking_vid
+        vids = vids.mask(mask_laminar, laminar_repacking_vid)
 
-    unmatched = sorted(df[df["вид"] == ""]["артикул"].unique().tolist())
+    return vids
 
-    # Суммируем общую рекламу из отчёта (3 строки — не привязаны к артикулам)
-    # Они распределятся пропорционально реализации после группировки
-    total_реклама = df["реклама"].sum()
 
-    # Группировка по артикулу (без реклама — распределим после)
-    grp_cols = ["артикул", "бренд", "направление", "вид"]
-    agg = df.groupby(grp_cols, as_index=False).agg(
-        количество=("количество", "sum"),
-        реализация=("реализация", "sum"),
-        эквайринг=("эквайринг", "sum"),
-        услуги_мп=("услуги_мп", "sum"),
-        логистика=("логистика", "sum"),
-    )
+def article_metrics(
+    base: pd.DataFrame,
+    vids: pd.Series,
+    lookups: dict,
+    work_rates: dict[str, float],
+    total_реклама: float,
+) -> pd.DataFrame:
+    """Показатели рентабельности по строкам свёртки (aggregate_report) с видами vids."""
+    agg = base.copy()
+    agg.insert(3, "вид", vids.values)
 
     # Распределяем рекламу пропорционально реализации
     total_реал_все = agg["реализация"].sum()
@@ -437,47 +571,34 @@ def calculate_profitability(
     else:
         agg["реклама"] = 0.0
 
-    # Себестоимость единицы (материальная):
-    # 1. article-level по артикулу (case-insensitive) — приоритет
-    # 2. fallback: vid-level по виду номенклатуры
-    costs_lower = {k.lower(): v for k, v in costs_map.items()}
+    # Колонки себестоимости создаются до работы — порядок колонок результата не меняется
+    agg["себестоимость_единица"] = 0.0
+    agg["себестоимость"] = 0.0
 
-    def get_unit_cost(art: str, vid: str) -> float:
-        art_rec = costs_lower.get(art.lower())
-        if art_rec and art_rec.get("level") == "article":
-            return art_rec["unit_cost"]
-        if vid:
-            vid_rec = costs_map.get(vid) or costs_lower.get(vid.lower())
-            if vid_rec:
-                return vid_rec["unit_cost"]
-        return 0.0
+    # ЗП (стоимость работы)
+    rate_by_direction = {d: float(r) for d, r in work_rates.items()}
+    agg["работа"] = agg["количество"] * agg["направление"].map(rate_by_direction).fillna(0.0).astype(float)
 
-    agg["себестоимость_единица"] = agg.apply(
-        lambda r: get_unit_cost(r["артикул"], r["вид"]), axis=1
-    )
-    agg["себестоимость"] = agg["себестоимость_единица"] * agg["количество"]
+    _vid_metrics(agg, lookups)
+    return agg
 
-    # ЗП (стоимость работы)
-    def get_work_rate(direction: str) -> float:
-        return float(work_rates.get(direction, 0.0))
 
-    agg["работа"] = agg["количество"] * agg["направление"].apply(get_work_rate)
+def _vid_metrics(agg: pd.DataFrame, lookups: dict) -> None:
+    """Показатели, зависящие от вида (себестоимость и всё, что из неё следует), — на месте; реклама и работа уже посчитаны."""
+    # Себестоимость единицы: по артикулу (article-level), иначе по виду (хэш-таблицы из prepare_lookups)
+    unit_cost = agg["артикул"].str.lower().map(lookups["article_cost"])
+    unit_cost = unit_cost.where(unit_cost.notna(), agg["вид"].map(lookups["vid_cost"]))
+    agg["себестоимость_единица"] = unit_cost.fillna(0.0).astype(float)
+    agg["себестоимость"] = agg["себестоимость_единица"] * agg["количество"]
 
     # Итого себестоимость = материальная + работа
     agg["итого_себестоимость"] = agg["себестоимость"] + agg["работа"]
 
     # Доля себестоимости в реализации (%)
-    agg["доля_себестоимости"] = agg.apply(
-        lambda r: r["итого_себестоимость"] / r["реализация"] * 100
-        if r["реализация"] != 0 else 0.0,
-        axis=1,
-    )
+    agg["доля_себестоимости"] = _ratio(agg["итого_себестоимость"], agg["реализация"]) * 100
 
     # Средняя цена = реализация / количество
-    agg["средняя_цена"] = agg.apply(
-        lambda r: r["реализация"] / r["количество"] if r["количество"] != 0 else 0.0,
-        axis=1,
-    )
+    agg["средняя_цена"] = _ratio(agg["реализация"], agg["количество"])
 
     # Финальные метрики
     agg["маржа_до_рекламы"] = (
@@ -488,64 +609,131 @@ def calculate_profitability(
         - agg["работа"]
     )
     agg["маржа_после_рекламы"] = agg["маржа_до_рекламы"] - agg["реклама"]
-    agg["рентабельность_пct"] = agg.apply(
-        lambda r: r["маржа_после_рекламы"] / r["реализация"] * 100
-        if r["реализация"] != 0 else 0.0,
-        axis=1,
-    )
+    agg["рентабельность_пct"] = _ratio(agg["маржа_после_рекламы"], agg["реализация"]) * 100
 
     # Показатели на единицу (только рублёвые метрики)
+    for c in RUB_METRIC_COLS:
+        agg[f"{c}_на_ед"] = _ratio(agg[c], agg["количество"])
+
+
+def rebucket_articles(agg: pd.DataFrame, base: pd.DataFrame, positions: list[int], lookups: dict) -> pd.DataFrame:
+    """
+    Копия показателей article_metrics, где для строк positions заново определены вид и зависящие от него показатели
+    (после изменения маппингов). Реклама и работа от вида не зависят и не пересчитываются.
+    """
+    agg = agg.copy()
+    if not positions:
+        return agg
+    part = agg.iloc[positions].copy()
+    part["вид"] = assign_vids(base.iloc[positions], lookups).values
+    _vid_metrics(part, lookups)
+    for c in part.columns:
+        agg.iloc[positions, agg.columns.get_loc(c)] = part[c].to_numpy()
+    return agg
+
+
+def _vid_row(vid: str, sum_values: dict[str, np.ndarray], idx: np.ndarray, articles: list[dict]) -> dict:
+    """Строка вида: итоги по строкам idx (суммы — последовательно в порядке idx) и доли, пересчитанные из сумм."""
     def per_unit(val: float, qty: float) -> float:
         return val / qty if qty != 0 else 0.0
 
-    rub_metric_cols = [
-        "реализация", "себестоимость", "работа", "итого_себестоимость",
-        "логистика", "услуги_мп", "реклама",
-        "маржа_до_рекламы", "маржа_после_рекламы",
-    ]
-    for c in rub_metric_cols:
-        agg[f"{c}_на_ед"] = agg.apply(
-            lambda r, col=c: per_unit(r[col], r["количество"]), axis=1
-        )
+    totals: dict = {"вид": vid, "тип": "вид", "артикулы": articles}
+    for col in SUM_COLS:
+        totals[col] = np.cumsum(sum_values[col][idx])[-1].item()
+
+    реал = totals["реализация"]
+    qty = totals["количество"]
+    totals["рентабельность_пct"] = (
+        totals["маржа_после_рекламы"] / реал * 100 if реал != 0 else 0.0
+    )
+    totals["доля_себестоимости"] = (
+        totals["итого_себестоимость"] / реал * 100 if реал != 0 else 0.0
+    )
+    totals["средняя_цена"] = реал / qty if qty != 0 else 0.0
 
-    # Группировка по виду номенклатуры
-    vid_groups: dict[str, list[dict]] = {}
-    for _, row in agg.iterrows():
-        vid = row["вид"] or "Без вида"
-        if vid not in vid_groups:
-            vid_groups[vid] = []
-        vid_groups[vid].append(row.to_dict())
-
-    # Суммируемые колонки для итогов по виду
-    sum_cols = [
-        "количество", "реализация", "эквайринг", "услуги_мп",
-        "логистика", "реклама", "себестоимость", "работа",
-        "итого_себестоимость", "маржа_до_рекламы", "маржа_после_рекламы",
-    ]
+    for c in RUB_METRIC_COLS:
+        totals[f"{c}_на_ед"] = per_unit(totals[c], qty)
+    return totals
+
+
+def _vid_groups(agg: pd.DataFrame) -> dict[str, list[int]]:
+    """Строки агрегата по виду (порядок внутри вида — как в агрегате); пустой вид — «Без вида»."""
+    groups: dict[str, list[int]] = {}
+    for i, vid in enumerate(agg["вид"].tolist()):
+        groups.setdefault(vid or "Без вида", []).append(i)
+    return groups
+
+
+def _article_records(agg: pd.DataFrame) -> list[dict]:
+    columns = list(agg.columns)
+    records = [dict(zip(columns, values)) for values in zip(*(agg[c].tolist() for c in columns))]
+    for record in records:
+        record["тип"] = "артикул"
+    return records
+
+
+def build_profitability_rows(agg: pd.DataFrame) -> list[dict]:
+    """Строки таблицы рентабельности (вид → артикулы) по показателям article_metrics."""
+    # Дерево вид → артикулы: строки агрегата группируются по виду (порядок внутри вида — как в агрегате),
+    # итоги вида суммируются последовательно по этому порядку
+    records = _article_records(agg)
+    sum_values = {col: agg[col].to_numpy() for col in SUM_COLS}
+    realization = agg["реализация"].tolist()
 
     rows: list[dict] = []
-    for vid, articles in sorted(vid_groups.items()):
-        totals: dict = {"вид": vid, "тип": "вид", "артикулы": []}
-        for col in sum_cols:
-            totals[col] = sum(a[col] for a in articles)
-
-        реал = totals["реализация"]
-        qty = totals["количество"]
-        totals["рентабельность_пct"] = (
-            totals["маржа_после_рекламы"] / реал * 100 if реал != 0 else 0.0
-        )
-        totals["доля_себестоимости"] = (
-            totals["итого_себестоимость"] / реал * 100 if реал != 0 else 0.0
-        )
-        totals["средняя_цена"] = реал / qty if qty != 0 else 0.0
+    for vid, idx in sorted(_vid_groups(agg).items()):
+        articles = [records[i] for i in sorted(idx, key=lambda i: -realization[i])]
+        rows.append(_vid_row(vid, sum_values, np.asarray(idx), articles))
+    return rows
 
-        for c in rub_metric_cols:
-            totals[f"{c}_на_ед"] = per_unit(totals[c], qty)
 
-        for art in sorted(articles, key=lambda x: -x["реализация"]):
-            art["тип"] = "артикул"
-            totals["артикулы"].append(art)
+def update_profitability_rows(rows: list[dict], agg: pd.DataFrame, positions: list[int], vids) -> list[dict]:
+    """
+    Строки таблицы после изменения видов строк positions (rebucket_articles): группы видов vids ("" — без вида)
+    перестраиваются, остальные берутся из rows без изменений. Записи неизменённых артикулов переиспользуются.
+    """
+    names = {vid or "Без вида" for vid in vids}
+    kept = [row for row in rows if row["вид"] not in names]
+    old_records = {
+        (art["артикул"], art["бренд"], art["направление"]): art
+        for row in rows if row["вид"] in names for art in row["артикулы"]
+    }
+    raw = set(vids) | ({"", "Без вида"} if "Без вида" in names else set())
+    members = np.flatnonzero(agg["вид"].isin(raw).to_numpy())
+    new_records = dict(zip(positions, _article_records(agg.iloc[positions])))
+    keys = zip(*(agg[c].to_numpy()[members].tolist() for c in ("артикул", "бренд", "направление")))
+    records = {i: new_records.get(i) or old_records[key] for i, key in zip(members.tolist(), keys)}
+
+    sum_values = {col: agg[col].to_numpy() for col in SUM_COLS}
+    realization = sum_values["реализация"]
+    groups: dict[str, list[int]] = {}
+    for i, vid in zip(members.tolist(), agg["вид"].to_numpy()[members].tolist()):
+        groups.setdefault(vid or "Без вида", []).append(i)
+    for vid, idx in groups.items():
+        articles = [records[i] for i in sorted(idx, key=lambda i: -realization[i])]
+        kept.append(_vid_row(vid, sum_values, np.asarray(idx), articles))
+    return sorted(kept, key=lambda row: row["вид"])
 
-        rows.append(totals)
 
-    return rows, unmatched
+def calculate_profitability(
+    report_df: pd.DataFrame,
+    nomenclature_map: dict[str, str],
+    costs_map: dict[str, dict],
+    custom_mappings: dict[str, str],
+    work_rates: dict[str, float],  # {luminarc: X, engraving: X, tea: X}
+    lookups: Optional[dict] = None,
+) -> tuple[list[dict], list[str]]:
+    """
+    Рассчитывает рентабельность по артикулам и видам номенклатуры.
+    lookups — готовый результат prepare_lookups для этих же справочников (иначе считается здесь).
+
+    Возвращает:
+      - rows: список строк для таблицы (иерархия: вид → артикулы)
+      - unmatched: список артикулов без вида номенклатуры
+    """
+    if lookups is None:
+        lookups = prepare_lookups(nomenclature_map, costs_map, custom_mappings)
+    base, total_реклама = aggregate_report(report_df)
+    agg = article_metrics(base, assign_vids(base, lookups), lookups, work_rates, total_реклама)
+    unmatched = sorted(agg.loc[agg["вид"] == "", "артикул"].unique().tolist())
+    return build_profitability_rows(agg), unmatched
@@ -3,22 +3,43 @@
 
 Файловая структура в DATA_DIR/profitability/:
   uploads/
-    weekly/     — еженедельные отчёты (.xlsx), имя файла = {period_id}.xlsx
+    weekly/     — еженедельные отчёты: {period_id}/manifest.json — уникальные отчёты периода
+                  [{hash, filename, uploaded_at}] (старый формат {period_id}/N.xlsx, {period_id}.xlsx переносится)
+    weekly_by_hash/ — файлы еженедельных отчётов, имя = {sha256 содержимого}.xlsx (один файл на содержимое)
     nomenclature/ — виды номенклатуры (.xlsx)
     costs/      — себестоимости (.xlsx)
   periods.json  — метаданные периодов
   work_rates.json — ставки работы {period_id: {luminarc, engraving, tea}}
   custom_mappings.json — {артикул: вид_номенклатуры}
-  mappings_history.json — история изменений маппинга
+  mappings_history.jsonl — журнал изменений маппинга (только дописывается;
+    mappings_history.json — история прежнего формата, читается перед журналом)
+  versions.json — счётчики версий входных данных расчёта {nomenclature, costs, mappings, rates}
+  parsed/
+    weekly/     — разобранные еженедельные отчёты (DataFrame, pickle), имя = {sha256 содержимого}.v{версия}.pkl
+  aggregates/   — свёртка отчётов периода по артикулам (aggregate_report), {period_id}.pkl
+  reference.sqlite3 — разобранные виды номенклатуры и себестоимости, индексы по имени в нижнем регистре
+    (заменяет nomenclature_parsed.json / costs_parsed.json, которые переносятся один раз и переименовываются в *.migrated)
 """
 
+import hashlib
 import json
 import os
+import sqlite3
+import threading
 import time
+from contextlib import closing
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
+
+import pandas as pd
 
 import database as db
+import profitability_parser as prof_parser
+
+# Версия формата разобранного отчёта: при изменении парсера старые артефакты не используются
+WEEKLY_PARSED_VERSION = 1
+# Версия схемы reference.sqlite3 (разобранные номенклатура и себестоимость)
+REFERENCE_FORMAT_VERSION = 1
 
 
 def _prof_dir() -> Path:
@@ -48,8 +69,40 @@ def _read_json(name: str, default):
 
 
 def _write_json(name: str, data) -> None:
+    """Запись через временный файл: читатель видит либо прежнее, либо новое содержимое, не обрезанный файл."""
     p = _json_path(name)
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp = p.with_name(f"{p.name}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+# ---------------------------------------------------------------------------
+# Версии входных данных
+# ---------------------------------------------------------------------------
+
+# Запись входных данных и увеличение их версии — под одной блокировкой (read_inputs читает под ней же)
+_inputs_lock = threading.RLock()
+
+
+def get_input_versions() -> dict[str, int]:
+    """Версии входных данных расчёта: растут при каждой записи номенклатуры, себестоимостей, маппингов, ставок."""
+    return _read_json("versions.json", {})
+
+
+def _bump_version(kind: str) -> None:
+    with _inputs_lock:
+        versions = get_input_versions()
+        versions[kind] = int(versions.get(kind, 0)) + 1
+        _write_json("versions.json", versions)
+
+
+def read_inputs(loader: Callable[[], Any]) -> tuple[dict[str, int], Any]:
+    """
+    Прочитать входные данные (loader) вместе с их версиями, не пересекаясь с записью:
+    (версии, результат loader) соответствуют друг другу.
+    """
+    with _inputs_lock:
+        return get_input_versions(), loader()
 
 
 # ---------------------------------------------------------------------------
@@ -89,15 +142,33 @@ def delete_period(period_id: str) -> bool:
     if len(new) == len(periods):
         return False
     _write_json("periods.json", new)
-    # Удаляем файл (старый формат) или директорию (новый формат)
-    d = _uploads_dir("weekly")
-    old_file = d / f"{period_id}.xlsx"
-    if old_file.exists():
-        old_file.unlink()
-    period_dir = d / period_id
-    if period_dir.exists():
-        import shutil
-        shutil.rmtree(period_dir)
+    with _weekly_lock:
+        try:
+            hashes = {e["hash"] for e in _weekly_manifest(period_id)}
+        except RuntimeError:
+            hashes = set()  # отчёты повреждённого манифеста неизвестны — их файлы не трогаем
+        # Удаляем манифест периода (и файл старого формата, если остался)
+        d = _uploads_dir("weekly")
+        old_file = d / f"{period_id}.xlsx"
+        if old_file.exists():
+            old_file.unlink()
+        period_dir = d / period_id
+        if period_dir.exists():
+            import shutil
+            shutil.rmtree(period_dir)
+        # Файлы отчётов удаляются, только если на них не ссылаются другие периоды
+        for p in new:
+            try:
+                hashes -= {e["hash"] for e in _weekly_manifest(p["id"])}
+            except RuntimeError:
+                hashes = set()  # неизвестно, на что ссылается другой период, — ничего не удаляем
+                break
+        for report_hash in hashes:
+            _weekly_blob_path(report_hash).unlink(missing_ok=True)
+            # Разобранный отчёт (в т.ч. прежних версий разбора) без исходного файла не нужен
+            for parsed in _parsed_weekly_path(report_hash).parent.glob(f"{report_hash}.v*.pkl"):
+                parsed.unlink(missing_ok=True)
+    _aggregate_path(period_id).unlink(missing_ok=True)
     return True
 
 
@@ -109,51 +180,232 @@ def save_upload(kind: str, file_bytes: bytes, period_id: Optional[str] = None) -
     """
     Сохраняет загруженный файл.
     kind: 'weekly' | 'nomenclature' | 'costs'
-    Для 'weekly': файлы хранятся в uploads/weekly/{period_id}/, можно загрузить несколько.
+    Для 'weekly': отчёт добавляется в период (add_weekly_report), можно загрузить несколько;
+    повторная загрузка того же файла в период ничего не меняет.
     Для остальных — перезаписывает единственный файл.
     Возвращает путь к сохранённому файлу.
     """
-    d = _uploads_dir(kind)
     if kind == "weekly":
         if not period_id:
             raise ValueError("period_id обязателен для еженедельного отчёта")
-        period_dir = d / period_id
-        period_dir.mkdir(parents=True, exist_ok=True)
-        idx = len(list(period_dir.glob("*.xlsx"))) + 1
-        path = period_dir / f"{idx}.xlsx"
-    else:
-        path = d / "latest.xlsx"
+        report_hash, _ = add_weekly_report(period_id, file_bytes)
+        return str(_weekly_blob_path(report_hash))
 
+    path = _uploads_dir(kind) / "latest.xlsx"
     path.write_bytes(file_bytes)
     return str(path)
 
 
-def load_weekly_reports(period_id: str) -> list[bytes]:
+# Манифесты периодов меняются под блокировкой (загрузка, перенос старого формата, удаление)
+_weekly_lock = threading.RLock()
+
+
+def _weekly_blob_path(report_hash: str) -> Path:
+    return _uploads_dir("weekly_by_hash") / f"{report_hash}.xlsx"
+
+
+def _weekly_manifest_path(period_id: str) -> Path:
+    return _uploads_dir("weekly") / period_id / "manifest.json"
+
+
+def _write_weekly_manifest(period_id: str, entries: list[dict]) -> None:
+    path = _weekly_manifest_path(period_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _weekly_manifest(period_id: str) -> list[dict]:
     """
-    Возвращает список байт всех загруженных отчётов для периода.
-    Поддерживает старый формат (один файл {period_id}.xlsx) и
-    новый формат (директория {period_id}/ с несколькими файлами).
+    Уникальные отчёты периода [{hash, filename, uploaded_at}] в порядке загрузки.
+    Файлы старого формата ({period_id}/N.xlsx, {period_id}.xlsx) при первом обращении переносятся
+    в хранилище по хэшу; повторы одного и того же файла при этом отбрасываются. Файлы сначала копируются,
+    старые удаляются только после записи манифеста — при сбое перенос повторится с начала.
+    Нечитаемый манифест — RuntimeError: пустым он не считается, иначе следующая запись затёрла бы отчёты периода.
     """
+    path = _weekly_manifest_path(period_id)
+    if path.exists():
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except ValueError:
+            entries = None
+        if not isinstance(entries, list):
+            raise RuntimeError(f"Манифест отчётов периода {period_id} повреждён: {path}")
+        return entries
     d = _uploads_dir("weekly")
-    results: list[bytes] = []
+    legacy = sorted((d / period_id).glob("*.xlsx")) if (d / period_id).exists() else []
+    if (d / f"{period_id}.xlsx").exists():
+        legacy.append(d / f"{period_id}.xlsx")
+    if not legacy:
+        return []
+    with _weekly_lock:
+        if path.exists():
+            return _weekly_manifest(period_id)
+        entries: list[dict] = []
+        for file in legacy:
+            file_bytes = file.read_bytes()
+            report_hash = content_hash(file_bytes)
+            if all(e["hash"] != report_hash for e in entries):
+                entries.append({"hash": report_hash, "filename": file.name, "uploaded_at": file.stat().st_mtime})
+            blob = _weekly_blob_path(report_hash)
+            if not blob.exists():
+                tmp = blob.with_suffix(".tmp")
+                tmp.write_bytes(file_bytes)
+                os.replace(tmp, blob)
+        _write_weekly_manifest(period_id, entries)
+        for file in legacy:
+            file.unlink(missing_ok=True)
+        return entries
+
+
+def add_weekly_report(period_id: str, file_bytes: bytes, filename: str = "") -> tuple[str, bool]:
+    """
+    Добавляет отчёт в период: файл хранится один раз по хэшу содержимого (uploads/weekly_by_hash/),
+    период ссылается на него из манифеста. Возвращает (хэш, добавлен ли); False — такой файл в периоде уже есть.
+    Повреждённый манифест не перезаписывается (RuntimeError из _weekly_manifest).
+    """
+    report_hash = content_hash(file_bytes)
+    with _weekly_lock:
+        entries = _weekly_manifest(period_id)
+        if any(e["hash"] == report_hash for e in entries):
+            return report_hash, False
+        blob = _weekly_blob_path(report_hash)
+        if not blob.exists():
+            tmp = blob.with_suffix(".tmp")
+            tmp.write_bytes(file_bytes)
+            os.replace(tmp, blob)
+        entries.append({"hash": report_hash, "filename": filename, "uploaded_at": time.time()})
+        _write_weekly_manifest(period_id, entries)
+    return report_hash, True
+
+
+def has_weekly_report(period_id: str, report_hash: str) -> bool:
+    """Есть ли в периоде отчёт с таким хэшем содержимого."""
+    return any(e["hash"] == report_hash for e in _weekly_manifest(period_id))
+
+
+def find_weekly_report(report_hash: str) -> list[str]:
+    """Периоды, в которые уже загружен отчёт с таким хэшем содержимого (по манифестам, без чтения отчётов)."""
+    found = []
+    for p in list_periods():
+        try:
+            if has_weekly_report(p["id"], report_hash):
+                found.append(p["id"])
+        except RuntimeError:
+            continue  # период с повреждённым манифестом не предлагаем
+    return found
+
+
+def _weekly_reports(period_id: str) -> list[tuple[str, Path]]:
+    """Отчёты периода [(хэш, путь к файлу)] в порядке загрузки."""
+    return [(e["hash"], _weekly_blob_path(e["hash"])) for e in _weekly_manifest(period_id)]
+
+
+def _weekly_report_files(period_id: str) -> list[Path]:
+    return [path for _, path in _weekly_reports(period_id)]
+
+
+def load_weekly_reports(period_id: str) -> list[bytes]:
+    """Возвращает список байт всех (уникальных) загруженных отчётов для периода."""
+    return [f.read_bytes() for f in _weekly_report_files(period_id)]
+
+
+def content_hash(file_bytes: bytes) -> str:
+    """Хэш содержимого загруженного файла (sha256, hex)."""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def _parsed_weekly_path(report_hash: str) -> Path:
+    d = _prof_dir() / "parsed" / "weekly"
+    d.mkdir(parents=True, exist_ok=True)
+    return d / f"{report_hash}.v{WEEKLY_PARSED_VERSION}.pkl"
 
-    # Новый формат: директория
-    period_dir = d / period_id
-    if period_dir.exists():
-        for f in sorted(period_dir.glob("*.xlsx")):
-            results.append(f.read_bytes())
 
-    # Старый формат: одиночный файл (обратная совместимость)
-    old_file = d / f"{period_id}.xlsx"
-    if old_file.exists():
-        results.append(old_file.read_bytes())
+def save_parsed_weekly(report_hash: str, df: pd.DataFrame) -> None:
+    """Сохраняет разобранный отчёт (результат parse_weekly_report) под хэшем содержимого файла."""
+    path = _parsed_weekly_path(report_hash)
+    tmp = path.with_suffix(".tmp")
+    df.to_pickle(tmp)
+    os.replace(tmp, path)
 
-    return results
+
+def has_parsed_weekly(report_hash: str) -> bool:
+    return _parsed_weekly_path(report_hash).exists()
+
+
+def load_parsed_weekly(report_hash: str) -> Optional[pd.DataFrame]:
+    """Разобранный отчёт по хэшу содержимого или None, если его ещё нет."""
+    path = _parsed_weekly_path(report_hash)
+    if not path.exists():
+        return None
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        return None
+
+
+def weekly_report_hashes(period_id: str) -> list[str]:
+    """Хэши содержимого отчётов периода (в порядке load_weekly_reports) — из манифеста, файлы не читаются."""
+    return [e["hash"] for e in _weekly_manifest(period_id)]
+
+
+def unparsed_weekly_reports(period_id: str) -> list[tuple[str, Path]]:
+    """Отчёты периода без разобранного артефакта: [(хэш, путь)] (файлы, загруженные до появления артефактов)."""
+    return [(h, path) for h, path in _weekly_reports(period_id) if not has_parsed_weekly(h)]
+
+
+def load_weekly_frames(period_id: str) -> list[pd.DataFrame]:
+    """
+    Разобранные отчёты периода (в порядке load_weekly_reports).
+    Каждый файл разбирается один раз: при загрузке или при первом обращении (файлы, загруженные раньше).
+    """
+    frames: list[pd.DataFrame] = []
+    for report_hash, path in _weekly_reports(period_id):
+        df = load_parsed_weekly(report_hash)
+        if df is None:
+            df = prof_parser.parse_weekly_report(path.read_bytes())
+            save_parsed_weekly(report_hash, df)
+        frames.append(df)
+    return frames
+
+
+def _aggregate_path(period_id: str) -> Path:
+    d = _prof_dir() / "aggregates"
+    d.mkdir(parents=True, exist_ok=True)
+    return d / f"{period_id}.pkl"
+
+
+def save_period_aggregate(period_id: str, report_hashes: list[str], base: pd.DataFrame, total_ads: float) -> None:
+    """Сохраняет свёртку отчётов периода (aggregate_report) вместе с хэшами отчётов, из которых она построена."""
+    path = _aggregate_path(period_id)
+    tmp = path.with_suffix(".tmp")
+    pd.to_pickle({
+        "version": WEEKLY_PARSED_VERSION,
+        "reports": list(report_hashes),
+        "base": base,
+        "total_ads": float(total_ads),
+    }, tmp)
+    os.replace(tmp, path)
+
+
+def load_period_aggregate(period_id: str, report_hashes: list[str]) -> Optional[tuple[pd.DataFrame, float]]:
+    """Свёртка отчётов периода (свёртка, общая реклама) или None, если её нет или отчёты периода изменились."""
+    path = _aggregate_path(period_id)
+    if not path.exists():
+        return None
+    try:
+        data = pd.read_pickle(path)
+    except Exception:
+        return None
+    if data.get("version") != WEEKLY_PARSED_VERSION or data.get("reports") != list(report_hashes):
+        return None
+    return data["base"], data["total_ads"]
 
 
 def count_weekly_reports(period_id: str) -> int:
-    """Количество загруженных отчётов для периода."""
-    return len(load_weekly_reports(period_id))
+    """Количество загруженных (уникальных) отчётов для периода."""
+    return len(_weekly_manifest(period_id))
 
 
 def load_upload(kind: str, period_id: Optional[str] = None) -> Optional[bytes]:
@@ -204,13 +456,15 @@ def set_work_rates(period_id: str, rates: dict) -> None:
     Устанавливает ставки для периода (или 'default').
     rates: {luminarc: float, engraving: float, tea: float}
     """
-    all_rates = get_work_rates()
-    all_rates[period_id] = {
-        "luminarc": float(rates.get("luminarc", 0.0)),
-        "engraving": float(rates.get("engraving", 0.0)),
-        "tea": float(rates.get("tea", 0.0)),
-    }
-    _write_json("work_rates.json", all_rates)
+    with _inputs_lock:
+        all_rates = get_work_rates()
+        all_rates[period_id] = {
+            "luminarc": float(rates.get("luminarc", 0.0)),
+            "engraving": float(rates.get("engraving", 0.0)),
+            "tea": float(rates.get("tea", 0.0)),
+        }
+        _write_json("work_rates.json", all_rates)
+        _bump_version("rates")
 
 
 # ---------------------------------------------------------------------------
@@ -222,74 +476,244 @@ def get_custom_mappings() -> dict[str, str]:
     return _read_json("custom_mappings.json", {})
 
 
+def _append_mappings_history(entries: list[dict]) -> None:
+    """Дописывает записи в журнал mappings_history.jsonl (по строке JSON на запись, файл не перезаписывается)."""
+    if not entries:
+        return
+    lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+    with open(_json_path("mappings_history.jsonl"), "a", encoding="utf-8") as f:
+        f.write(lines)
+
+
 def set_custom_mapping(article: str, vid: str, username: str = "unknown") -> None:
     """Добавляет или обновляет кастомный маппинг."""
-    mappings = get_custom_mappings()
-    old_vid = mappings.get(article)
-    mappings[article] = vid
-    _write_json("custom_mappings.json", mappings)
-
-    # История изменений
-    history = _read_json("mappings_history.json", [])
-    history.append({
-        "ts": time.time(),
-        "article": article,
-        "old_vid": old_vid,
-        "new_vid": vid,
-        "by": username,
-    })
-    _write_json("mappings_history.json", history)
+    set_custom_mappings_bulk({article: vid}, username=username)
 
 
 def set_custom_mappings_bulk(mappings_dict: dict[str, str], username: str = "unknown") -> None:
     """Bulk-обновление маппингов."""
-    mappings = get_custom_mappings()
+    with _inputs_lock:
+        mappings = get_custom_mappings()
+        history = []
+        for article, vid in mappings_dict.items():
+            old = mappings.get(article)
+            mappings[article] = vid
+            history.append({
+                "ts": time.time(),
+                "article": article,
+                "old_vid": old,
+                "new_vid": vid,
+                "by": username,
+            })
+        _write_json("custom_mappings.json", mappings)
+        _bump_version("mappings")
+        _append_mappings_history(history)
+
+
+def get_mappings_history(limit: Optional[int] = None) -> list:
+    """
+    История изменений маппинга (старые записи — первыми): mappings_history.json прежнего формата,
+    затем журнал mappings_history.jsonl. limit — только последние limit записей.
+    """
     history = _read_json("mappings_history.json", [])
-    for article, vid in mappings_dict.items():
-        old = mappings.get(article)
-        mappings[article] = vid
-        history.append({
-            "ts": time.time(),
-            "article": article,
-            "old_vid": old,
-            "new_vid": vid,
-            "by": username,
-        })
-    _write_json("custom_mappings.json", mappings)
-    _write_json("mappings_history.json", history)
-
-
-def get_mappings_history() -> list:
-    return _read_json("mappings_history.json", [])
+    log = _json_path("mappings_history.jsonl")
+    if log.exists():
+        with open(log, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    continue  # недописанная строка
+    return history[-limit:] if limit else history
 
 
 # ---------------------------------------------------------------------------
-# Кэш номенклатуры и себестоимости (parsed)
+# Разобранные номенклатура и себестоимость (reference.sqlite3)
 # ---------------------------------------------------------------------------
 
+# Отдельные операторы (не executescript: он фиксирует транзакцию), выполняются внутри BEGIN IMMEDIATE
+_REFERENCE_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS nomenclature (
+        pos INTEGER PRIMARY KEY,
+        article TEXT NOT NULL,
+        article_lower TEXT NOT NULL,
+        vid TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_nomenclature_article_lower ON nomenclature (article_lower)",
+    """CREATE TABLE IF NOT EXISTS costs (
+        pos INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        name_lower TEXT NOT NULL,
+        qty REAL NOT NULL,
+        total_cost REAL NOT NULL,
+        unit_cost REAL NOT NULL,
+        level TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_costs_name_lower ON costs (name_lower)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+)
+_reference_lock = threading.Lock()
+
+
+def _reference_format(conn: sqlite3.Connection) -> Optional[str]:
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+# Шаги переноса схемы reference.sqlite3: формат -> SQL-операторы, переводящие его в формат +1.
+# При увеличении REFERENCE_FORMAT_VERSION сюда добавляется шаг со старой версии — данные не пересоздаются.
+_REFERENCE_MIGRATIONS: dict[str, tuple[str, ...]] = {}
+
+_LEGACY_REFERENCE_FILES = ("nomenclature_parsed.json", "costs_parsed.json")
+
+
+def _migrate_reference(conn: sqlite3.Connection, current: str) -> None:
+    version = current
+    while version != str(REFERENCE_FORMAT_VERSION):
+        steps = _REFERENCE_MIGRATIONS.get(version)
+        if steps is None:
+            raise RuntimeError(
+                f"reference.sqlite3: нет переноса с формата {version} на {REFERENCE_FORMAT_VERSION}"
+            )
+        for statement in steps:
+            conn.execute(statement)
+        version = str(int(version) + 1)
+
+
+def _reference_connect() -> sqlite3.Connection:
+    """
+    Соединение с reference.sqlite3. Новая база создаётся по _REFERENCE_SCHEMA, и в неё один раз
+    переносятся старые nomenclature_parsed.json / costs_parsed.json (после переноса они
+    переименовываются в *.migrated). Базы прежнего формата обновляются шагами _REFERENCE_MIGRATIONS
+    без потери данных. Всё — одна транзакция (BEGIN IMMEDIATE): при сбое остаётся прежнее состояние.
+    """
+    conn = sqlite3.connect(str(_prof_dir() / "reference.sqlite3"), timeout=30)
+    if _reference_format(conn) == str(REFERENCE_FORMAT_VERSION):
+        return conn
+    imported_legacy = False
+    try:
+        with _reference_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            with conn:
+                # Другой поток или процесс мог подготовить базу, пока ждали блокировку
+                current = _reference_format(conn)
+                if current == str(REFERENCE_FORMAT_VERSION):
+                    return conn
+                if current is not None:
+                    _migrate_reference(conn, current)
+                else:
+                    for statement in _REFERENCE_SCHEMA:
+                        conn.execute(statement)
+                    legacy_nomenclature = _read_json("nomenclature_parsed.json", None)
+                    if isinstance(legacy_nomenclature, dict):
+                        _write_nomenclature(conn, legacy_nomenclature)
+                    legacy_costs = _read_json("costs_parsed.json", None)
+                    if isinstance(legacy_costs, dict):
+                        _write_costs(conn, legacy_costs)
+                    imported_legacy = True
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('format', ?)", (str(REFERENCE_FORMAT_VERSION),)
+                )
+            if imported_legacy:
+                # Перенесённые файлы больше не читаются — повторный импорт затёр бы новые справочники
+                for name in _LEGACY_REFERENCE_FILES:
+                    path = _json_path(name)
+                    if path.exists():
+                        os.replace(path, path.with_name(f"{path.name}.migrated"))
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def _write_nomenclature(conn: sqlite3.Connection, data: dict) -> None:
+    conn.execute("DELETE FROM nomenclature")
+    conn.executemany(
+        "INSERT INTO nomenclature (pos, article, article_lower, vid) VALUES (?, ?, ?, ?)",
+        [(i, str(k), str(k).lower(), str(v)) for i, (k, v) in enumerate(data.items())],
+    )
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('nomenclature', '1')")
+
+
+def _write_costs(conn: sqlite3.Connection, data: dict) -> None:
+    conn.execute("DELETE FROM costs")
+    conn.executemany(
+        "INSERT INTO costs (pos, name, name_lower, qty, total_cost, unit_cost, level) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (i, str(k), str(k).lower(), float(v.get("qty", 0.0)), float(v.get("total_cost", 0.0)),
+             float(v.get("unit_cost", 0.0)), str(v.get("level", "vid")))
+            for i, (k, v) in enumerate(data.items())
+        ],
+    )
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('costs', '1')")
+
+
+def _has_reference(conn: sqlite3.Connection, kind: str) -> bool:
+    return conn.execute("SELECT 1 FROM meta WHERE key = ?", (kind,)).fetchone() is not None
+
+
+def _chunks(items: list, size: int = 500):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 def save_parsed_nomenclature(data: dict) -> None:
-    _write_json("nomenclature_parsed.json", data)
+    with _inputs_lock:
+        with closing(_reference_connect()) as conn, conn:
+            _write_nomenclature(conn, data)
+        _bump_version("nomenclature")
 
 
 def load_parsed_nomenclature() -> Optional[dict]:
-    d = _prof_dir() / "nomenclature_parsed.json"
-    if d.exists():
-        try:
-            return json.loads(d.read_text(encoding="utf-8"))
-        except Exception:
+    """Весь маппинг {артикул: вид} в порядке файла; None — файл видов не загружался."""
+    with closing(_reference_connect()) as conn:
+        if not _has_reference(conn, "nomenclature"):
             return None
-    return None
+        return dict(conn.execute("SELECT article, vid FROM nomenclature ORDER BY pos"))
+
+
+def load_nomenclature_for(articles) -> dict[str, str]:
+    """
+    Виды только для указанных артикулов (по индексу, без чтения всего справочника):
+    {артикул в нижнем регистре: вид}; при дублях без учёта регистра — последний, как в prepare_lookups.
+    """
+    keys = sorted({str(a).lower() for a in articles})
+    result: dict[str, str] = {}
+    with closing(_reference_connect()) as conn:
+        for chunk in _chunks(keys):
+            rows = conn.execute(
+                f"SELECT article_lower, vid FROM nomenclature WHERE article_lower IN ({','.join('?' * len(chunk))}) "
+                "ORDER BY pos",
+                chunk,
+            )
+            result.update(rows)
+    return result
+
+
+def list_nomenclature_vids() -> list[str]:
+    """Все виды из файла видов."""
+    with closing(_reference_connect()) as conn:
+        return [r[0] for r in conn.execute("SELECT DISTINCT vid FROM nomenclature")]
 
 
 def save_parsed_costs(data: dict) -> None:
-    _write_json("costs_parsed.json", data)
+    with _inputs_lock:
+        with closing(_reference_connect()) as conn, conn:
+            _write_costs(conn, data)
+        _bump_version("costs")
+
+
+def _cost_record(qty, total_cost, unit_cost, level) -> dict:
+    return {"qty": qty, "total_cost": total_cost, "level": level, "unit_cost": unit_cost}
 
 
 def load_parsed_costs() -> Optional[dict]:
-    d = _prof_dir() / "costs_parsed.json"
-    if d.exists():
-        try:
-            return json.loads(d.read_text(encoding="utf-8"))
-        except Exception:
+    """Все себестоимости {имя: {qty, total_cost, level, unit_cost}}; None — файл не загружался."""
+    with closing(_reference_connect()) as conn:
+        if not _has_reference(conn, "costs"):
             return None
-    return None
+        rows = conn.execute("SELECT name, qty, total_cost, unit_cost, level FROM costs ORDER BY pos")
+        return {name: _cost_record(*rest) for name, *rest in rows}
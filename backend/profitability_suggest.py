@@ -0,0 +1,123 @@
+"""
+Подсказки видов номенклатуры для несопоставленных артикулов.
+
+Индекс — инвертированный: признак → номера документов (np.ndarray). Документы — известные артикулы
+(файл видов, кастомные маппинги) с их видом и названия самих видов. Признаки текста — триграммы символов
+и токены (буквенные и цифровые части артикула). Сходство — косинус по весам idf, поэтому для запроса
+просматриваются только документы с общими признаками, а не все пары «артикул × вид».
+Слишком частые признаки (более чем в MAX_POSTINGS_SHARE документов) при поиске пропускаются.
+"""
+
+import math
+import re
+from typing import Optional
+
+import numpy as np
+
+MAX_POSTINGS_SHARE = 0.2
+# Сколько лучших документов рассматривается при выборе видов
+TOP_DOCS = 50
+
+_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+")
+
+
+def normalize(text) -> str:
+    """Текст для сравнения: нижний регистр, «ё» = «е», разделители — одиночные пробелы."""
+    text = str(text or "").lower().replace("ё", "е")
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+def features(text) -> set[str]:
+    """Признаки текста: токены (буквы и цифры отдельно, от 2 символов) и триграммы символов."""
+    norm = normalize(text)
+    result = {"w:" + token for token in _TOKEN_RE.findall(norm) if len(token) > 1}
+    padded = f" {norm} "
+    result.update("g:" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def build_index(docs: list[tuple[str, str]], reference: Optional[dict] = None) -> dict:
+    """
+    Индекс по документам [(текст, вид)]:
+    {keys: текст в нижнем регистре, labels: виды, postings: {признак: номера документов}, idf, common, norms}.
+    reference — индекс, чьи веса idf и частые признаки используются (для небольшого индекса поверх большого,
+    чтобы оценки двух индексов были сопоставимы).
+    """
+    postings: dict[str, list[int]] = {}
+    doc_features = []
+    for i, (text, _) in enumerate(docs):
+        feats = features(text)
+        doc_features.append(feats)
+        for f in feats:
+            postings.setdefault(f, []).append(i)
+    if reference is not None and reference["size"]:
+        n = reference["size"]
+        idf = {f: reference["idf"].get(f, math.log(n + 1) + 1.0) for f in postings}
+        common = reference["common"]
+    else:
+        n = len(docs)
+        idf = {f: math.log((n + 1) / (len(ids) + 1)) + 1.0 for f, ids in postings.items()}
+        common = {f for f, ids in postings.items() if len(ids) > max(1, n * MAX_POSTINGS_SHARE)}
+    norms = np.array([math.sqrt(sum(idf[f] ** 2 for f in feats)) or 1.0 for feats in doc_features])
+    return {
+        "size": n,
+        "keys": [str(text).lower() for text, _ in docs],
+        "labels": [vid for _, vid in docs],
+        "postings": {f: np.asarray(ids, dtype=np.int32) for f, ids in postings.items()},
+        "idf": idf,
+        "common": common,
+        "norms": norms,
+    }
+
+
+def search(index: dict, text, top: int = TOP_DOCS) -> list[tuple[int, float]]:
+    """Лучшие документы индекса для текста: [(номер, косинусное сходство)] по убыванию."""
+    n = len(index["labels"])
+    if not n:
+        return []
+    idf, postings, common = index["idf"], index["postings"], index["common"]
+    feats = features(text)
+    ids, weights = [], []
+    for f in feats:
+        posting = postings.get(f)
+        if posting is None or f in common:
+            continue
+        ids.append(posting)
+        weights.append(np.full(len(posting), idf[f] ** 2))
+    if not ids:
+        return []
+    scores = np.bincount(np.concatenate(ids), weights=np.concatenate(weights), minlength=n)
+    # Норма запроса — по весам индекса; признаки, которых нет в индексе, — с наибольшим весом
+    default_idf = math.log(index["size"] + 1) + 1.0
+    query_norm = math.sqrt(sum(idf.get(f, default_idf) ** 2 for f in feats))
+    scores = scores / (index["norms"] * query_norm)
+    candidates = np.flatnonzero(scores)
+    if len(candidates) > top:
+        candidates = candidates[np.argpartition(-scores[candidates], top)[:top]]
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(i), float(scores[i])) for i in order]
+
+
+def rank_vids(
+    hits: list[tuple[str, float]],
+    brand_shares: Optional[dict[str, float]] = None,
+    brand_weight: float = 0.2,
+    limit: int = 3,
+) -> list[dict]:
+    """
+    Виды-кандидаты по найденным документам [(вид, сходство)]: у вида — лучшее сходство его документов
+    плюс brand_weight × доля вида среди сопоставленных артикулов того же бренда.
+    [{vid, score, text_score}] по убыванию score; text_score — сходство текста (0 — кандидат только по бренду).
+    """
+    text: dict[str, float] = {}
+    for vid, score in hits:
+        if vid and score > text.get(vid, 0.0):
+            text[vid] = score
+    best = dict(text)
+    for vid, share in (brand_shares or {}).items():
+        best[vid] = best.get(vid, 0.0) + brand_weight * share
+    ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return [
+        {"vid": vid, "score": round(score, 3), "text_score": round(text.get(vid, 0.0), 3)}
+        for vid, score in ranked
+    ]
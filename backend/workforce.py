@@ -1,12 +1,19 @@
 """Управление табелями, графиками работы и справочниками."""
 
-import json
 import os
+import threading
 import uuid
 import calendar
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from types import MappingProxyType
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+import workforce_store
 
 DATA_DIR = Path(os.environ.get("DATA_DIR", Path(__file__).resolve().parent.parent / "data"))
 WORKFORCE_DIR = DATA_DIR / "workforce"
@@ -22,64 +29,172 @@ def _ensure_dir():
     WORKFORCE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def _read_json(path: Path, default):
-    if path.exists():
+def _db():
+    """Соединение с хранилищем workforce (SQLite в WORKFORCE_DIR, см. workforce_store)."""
+    return workforce_store.connect(WORKFORCE_DIR)
+
+
+_month_locks: dict[tuple, threading.Lock] = {}
+_month_locks_guard = threading.Lock()
+
+
+def _month_lock(kind: str, production: str, year: int, month: int) -> threading.Lock:
+    """Блокировка записи одного месяца (табеля или графика): правки одного месяца идут по очереди."""
+    key = (kind, production, int(year), int(month))
+    with _month_locks_guard:
+        lock = _month_locks.get(key)
+        if lock is None:
+            lock = _month_locks[key] = threading.Lock()
+        return lock
+
+
+# ─── Кэш чтения ──────────────────────────────────────────────────────────────
+# Справочник, графики, табели и списки сотрудников читаются из хранилища один раз и дальше
+# отдаются из памяти в виде неизменяемых представлений (MappingProxyType / tuple).
+# Каждое значение помнит ревизии своих источников (workforce_store.revision_key): запись месяца сбрасывает
+# только значения, построенные по этому месяцу; журнал изменений ревизий не меняет.
+# Таблица ревизий перечитывается после записи через этот модуль и при изменении файлов БД
+# (запись из другого процесса). Публичные get_* возвращают изменяемые копии, как и раньше.
+
+_read_cache: dict[tuple, tuple[Any, tuple]] = {}
+_revisions: dict[str, int] = {}
+_revisions_stamp: Optional[tuple] = None
+_read_cache_guard = threading.Lock()
+
+
+def _store_stamp() -> tuple:
+    """Отпечаток файлов БД (основной файл и WAL): время изменения и размер."""
+    db_path = WORKFORCE_DIR / workforce_store.DB_FILENAME
+    stamp = []
+    for path in (db_path, db_path.with_name(db_path.name + "-wal")):
         try:
-            return json.loads(path.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return default
+            st = path.stat()
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
 
 
-def _write_json(path: Path, data) -> None:
-    _ensure_dir()
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
 
 
-# ─── Журнал изменений ────────────────────────────────────────────────────────
+def _thaw(value):
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
 
-def _changelog_path() -> Path:
-    return WORKFORCE_DIR / "changelog.json"
+def _rev(kind: str, *parts) -> str:
+    return workforce_store.revision_key(kind, *parts)
 
 
-def _get_changelog() -> list:
-    _ensure_dir()
-    return _read_json(_changelog_path(), [])
+def _current_revisions() -> dict[str, int]:
+    """Ревизии хранилища; перечитываются, только если файлы БД изменились или была запись через модуль."""
+    global _revisions, _revisions_stamp
+    stamp = _store_stamp()
+    with _read_cache_guard:
+        if stamp == _revisions_stamp:
+            return _revisions
+    # Отпечаток снимается до чтения: запись после него изменит файлы и вызовет повторное чтение
+    with _db() as conn:
+        revisions = workforce_store.load_revisions(conn)
+    with _read_cache_guard:
+        _revisions, _revisions_stamp = revisions, stamp
+    return revisions
 
 
+def _invalidate_reads() -> None:
+    """После записи через модуль: перечитать ревизии при следующем чтении (сами значения сбрасываются по ревизиям)."""
+    global _revisions_stamp
+    with _read_cache_guard:
+        _revisions_stamp = None
+
+
+def _cached(key: tuple, loader: Callable[[], Any], sources: tuple):
+    """
+    Неизменяемое представление значения из кэша (loader вызывается только при промахе).
+    sources — ключи ревизий, по которым строится значение: оно действительно, пока их ревизии не изменились.
+    """
+    revisions = _current_revisions()
+    state = tuple(revisions.get(src, 0) for src in sources)
+    with _read_cache_guard:
+        hit = _read_cache.get(key)
+        if hit is not None and hit[1] == state:
+            return hit[0]
+    # Ревизии сняты до чтения: если запись пройдёт во время чтения, значение сбросится при следующем обращении
+    value = _freeze(loader())
+    with _read_cache_guard:
+        _read_cache[key] = (value, state)
+    return value
+
+
+# ─── Журнал изменений ────────────────────────────────────────────────────────
+
 def log_change(username: str, action: str, production: Optional[str], year: Optional[int], month: Optional[int], details: str = "") -> None:
     """Записать событие редактирования в журнал (хранит последние 2000 записей)."""
     try:
-        log = _get_changelog()
-        log.append({
-            "at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "username": username,
-            "action": action,
-            "production": production,
-            "year": year,
-            "month": month,
-            "details": details,
-        })
-        _write_json(_changelog_path(), log[-2000:])
+        with _db() as conn:
+            workforce_store.append_changelog(conn, {
+                "at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "username": username,
+                "action": action,
+                "production": production,
+                "year": year,
+                "month": month,
+                "details": details,
+            }, keep=2000)
     except Exception:
         pass
 
 
-def get_changelog(limit: int = 200) -> list:
-    """Вернуть последние N записей журнала в обратном порядке (новые сверху)."""
-    log = _get_changelog()
-    return log[-limit:][::-1]
+def get_changelog(
+    limit: int = 200,
+    production: Optional[str] = None,
+    username: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    before: Optional[int] = None,
+) -> list:
+    """
+    Вернуть последние N записей журнала в обратном порядке (новые сверху).
+    Фильтры: производство, пользователь, период (дата «YYYY-MM-DD» или время ISO);
+    before — id записи, с которой продолжить (курсор: id последней записи предыдущей страницы).
+    """
+    if date_to and len(date_to) == 10:
+        date_to = f"{date_to}T23:59:59Z"
+    with _db() as conn:
+        return workforce_store.tail_changelog(
+            conn, limit, production=production, username=username,
+            at_from=date_from or None, at_to=date_to or None, before_id=before,
+        )
 
 
 # ─── Справочник ───────────────────────────────────────────────────────────────
 
+def _load_reference() -> list:
+    with _db() as conn:
+        return workforce_store.load_reference(conn)
+
+
+def _reference_view() -> tuple:
+    return _cached(("reference",), _load_reference, (_rev("reference"),))
+
+
 def get_reference() -> list:
-    _ensure_dir()
-    return _read_json(WORKFORCE_DIR / "reference.json", [])
+    return _thaw(_reference_view())
 
 
 def save_reference(entries: list) -> None:
-    _write_json(WORKFORCE_DIR / "reference.json", entries)
+    with _db() as conn:
+        workforce_store.save_reference(conn, entries)
+    _invalidate_reads()
 
 
 def _parse_rate(val: str):
@@ -157,22 +272,39 @@ def import_reference_from_tsv(tsv: str) -> list:
 
 # ─── График (Schedule) ────────────────────────────────────────────────────────
 
-def _schedule_path(production: str, year: int, month: int) -> Path:
-    return WORKFORCE_DIR / f"schedule_{production}_{year}_{month:02d}.json"
+def schedule_exists(production: str, year: int, month: int) -> bool:
+    """Сохранён ли график за месяц (без переноса из предыдущего)."""
+    with _db() as conn:
+        return workforce_store.schedule_exists(conn, production, year, month)
 
 
-def get_schedule(production: str, year: int, month: int) -> dict:
-    _ensure_dir()
-    path = _schedule_path(production, year, month)
-    default = {"production": production, "year": year, "month": month, "employees": []}
+def _schedule_sources(production: str, year: int, month: int) -> tuple:
+    """Ревизии графика месяца: его собственная и предыдущего месяца (из него переносится несохранённый график)."""
+    prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return _rev("schedule", production, year, month), _rev("schedule", production, prev_year, prev_month)
 
-    # Если файл уже существует — возвращаем его как есть
-    if path.exists():
-        return _read_json(path, default)
 
-    # Файл не существует → пробуем перенести сотрудников из предыдущего месяца
-    prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
-    prev = _read_json(_schedule_path(production, prev_year, prev_month), {})
+def _schedule_view(production: str, year: int, month: int) -> Mapping:
+    return _cached(
+        ("schedule", production, year, month),
+        lambda: _load_schedule(production, year, month),
+        _schedule_sources(production, year, month),
+    )
+
+
+def get_schedule(production: str, year: int, month: int) -> dict:
+    return _thaw(_schedule_view(production, year, month))
+
+
+def _load_schedule(production: str, year: int, month: int) -> dict:
+    # Если график уже сохранён — возвращаем его как есть
+    with _db() as conn:
+        saved = workforce_store.load_schedule(conn, production, year, month)
+        if saved is not None:
+            return saved
+        # Графика нет → пробуем перенести сотрудников из предыдущего месяца
+        prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+        prev = workforce_store.load_schedule(conn, production, prev_year, prev_month) or {}
     prev_employees = prev.get("employees", [])
 
     # Берём всех, кроме уволенных; рабочие дни сбрасываем в {}
@@ -197,7 +329,9 @@ def save_schedule(production: str, year: int, month: int, data: dict) -> None:
     data["production"] = production
     data["year"] = year
     data["month"] = month
-    _write_json(_schedule_path(production, year, month), data)
+    with _month_lock("schedule", production, year, month), _db() as conn:
+        workforce_store.save_schedule(conn, production, year, month, data)
+    _invalidate_reads()
 
 
 def import_schedule_from_tsv(production: str, year: int, month: int, tsv: str) -> dict:
@@ -260,39 +394,53 @@ def import_schedule_from_tsv(production: str, year: int, month: int, tsv: str) -
 
 # ─── Табель (Timesheet) ────────────────────────────────────────────────────────
 
-def _timesheet_path(production: str, year: int, month: int) -> Path:
-    return WORKFORCE_DIR / f"timesheet_{production}_{year}_{month:02d}.json"
+def _load_timesheet(production: str, year: int, month: int) -> dict:
+    default = {"production": production, "year": year, "month": month, "records": {}}
+    with _db() as conn:
+        return workforce_store.load_timesheet(conn, production, year, month) or default
+
+
+def _timesheet_view(production: str, year: int, month: int) -> Mapping:
+    return _cached(
+        ("timesheet", production, year, month),
+        lambda: _load_timesheet(production, year, month),
+        (_rev("timesheet", production, year, month),),
+    )
 
 
 def get_timesheet(production: str, year: int, month: int) -> dict:
-    _ensure_dir()
-    default = {"production": production, "year": year, "month": month, "records": {}}
-    return _read_json(_timesheet_path(production, year, month), default)
+    return _thaw(_timesheet_view(production, year, month))
 
 
 def save_timesheet(production: str, year: int, month: int, data: dict) -> None:
     data["production"] = production
     data["year"] = year
     data["month"] = month
-    _write_json(_timesheet_path(production, year, month), data)
+    with _month_lock("timesheet", production, year, month), _db() as conn:
+        workforce_store.save_timesheet(conn, production, year, month, data)
+    _invalidate_reads()
 
 
 def update_timesheet_cell(
     production: str, year: int, month: int,
     employee_id: str, day: str, hours: Optional[float]
 ) -> dict:
-    """Обновить один день в табеле для сотрудника."""
-    ts = get_timesheet(production, year, month)
-    records = ts.get("records", {})
-    if hours is None:
-        records.get(employee_id, {}).pop(day, None)
-    else:
-        if employee_id not in records:
-            records[employee_id] = {}
-        records[employee_id][day] = hours
-    ts["records"] = records
-    save_timesheet(production, year, month, ts)
-    return ts
+    """Обновить один день в табеле для сотрудника (меняется одна строка хранилища)."""
+    return update_timesheet_cells(production, year, month, [(employee_id, day, hours)])
+
+
+def update_timesheet_cells(
+    production: str, year: int, month: int,
+    edits: list[tuple[str, str, Optional[float]]],
+) -> dict:
+    """
+    Применить пачку правок табеля [(employee_id, day, hours)] одной транзакцией.
+    Чужие правки того же месяца не затираются: меняются только переданные ячейки.
+    """
+    with _month_lock("timesheet", production, year, month), _db() as conn:
+        workforce_store.set_timesheet_cells(conn, production, year, month, edits)
+    _invalidate_reads()
+    return get_timesheet(production, year, month)
 
 
 # ─── Аналитика ────────────────────────────────────────────────────────────────
@@ -315,199 +463,190 @@ def _to_float(v, default: float = 0.0) -> float:
         return default
 
 
-def get_monthly_analytics(year: int, month: int) -> dict:
-    """Расширенная аналитика: по дням (план/факт) с разбивкой по производствам и статусам."""
-    reference = get_reference()
+def _rate_lookup() -> dict:
+    """Ставка по (должность, статус) из справочника."""
     rate_lookup = {}
-    for r in reference:
+    for r in _reference_view():
         try:
             key = (r.get("position", ""), r.get("status", ""))
             rate_lookup[key] = _to_float(r.get("hourly_rate", 0))
         except Exception:
             pass
+    return rate_lookup
+
+
+def _day_index(day_str, num_days: int) -> Optional[int]:
+    """Индекс столбца дня (0..num_days-1); None — нечисловой день или день вне месяца."""
+    try:
+        d = int(day_str)
+    except (ValueError, TypeError):
+        return None
+    if d < 1 or d > num_days:
+        return None
+    return d - 1
+
+
+def _month_matrices(production: str, year: int, month: int) -> Mapping:
+    """Матрицы месяца (сотрудник × день) для производства; кэшируются вместе с графиком и табелем."""
+    return _cached(
+        ("month_matrices", production, year, month),
+        lambda: _build_month_matrices(production, year, month),
+        (
+            _rev("reference"),
+            *_schedule_sources(production, year, month),
+            _rev("timesheet", production, year, month),
+        ),
+    )
+
+
+def _build_month_matrices(production: str, year: int, month: int) -> dict:
+    """
+    Строки — сотрудники графика, столбцы — дни месяца:
+      plan_hours / plan_mask — плановые часы и признак планового дня (день есть в графике);
+      fact_hours             — часы по табелю в плановые дни (если значение в табеле есть);
+      extra_hours            — часы по табелю во внеплановые дни (только > 0);
+      rates                  — ставка сотрудника по (должность, статус);
+      status_matrix          — индикатор статуса (статус × сотрудник) для свёртки по статусам.
+    """
+    rate_lookup = _rate_lookup()
     num_days = calendar.monthrange(year, month)[1]
+    schedule = _schedule_view(production, year, month)
+    timesheet = _timesheet_view(production, year, month)
+    employees = schedule.get("employees", []) if isinstance(schedule, Mapping) else []
+    ts_records = timesheet.get("records", {}) if isinstance(timesheet, Mapping) else {}
+    rows = [emp for emp in employees if isinstance(emp, Mapping)]
+
+    n = len(rows)
+    plan_hours  = np.zeros((n, num_days))
+    plan_mask   = np.zeros((n, num_days), dtype=bool)
+    fact_hours  = np.zeros((n, num_days))
+    extra_hours = np.zeros((n, num_days))
+    rates       = np.zeros(n)
+    status_idx  = np.zeros(n, dtype=np.intp)
+    statuses: dict[str, int] = {}
+
+    for i, emp in enumerate(rows):
+        position = emp.get("position", "") or ""
+        status   = emp.get("status", "") or ""
+        rates[i] = rate_lookup.get((position, status), 0.0)
+        status_idx[i] = statuses.setdefault(status, len(statuses))
+        working_days = emp.get("working_days") or {}
+        ts_emp = ts_records.get(emp.get("id") or "") or {}
+
+        for day_str, planned_h_raw in working_days.items():
+            d = _day_index(day_str, num_days)
+            if d is None:
+                continue
+            plan_mask[i, d] = True
+            plan_hours[i, d] = _to_float(planned_h_raw)
+            actual_h_raw = ts_emp.get(day_str)
+            if actual_h_raw is not None:
+                fact_hours[i, d] = _to_float(actual_h_raw)
+
+        # Внеплановые дни: в табеле есть часы, но дня нет в графике
+        for day_str, actual_h_raw in ts_emp.items():
+            if day_str in working_days:
+                continue
+            actual_h = _to_float(actual_h_raw)
+            if actual_h <= 0:
+                continue
+            d = _day_index(day_str, num_days)
+            if d is not None:
+                extra_hours[i, d] += actual_h
+
+    status_matrix = np.zeros((len(statuses), n))
+    status_matrix[status_idx, np.arange(n)] = 1.0
+    arrays = {
+        "plan_hours": plan_hours,
+        "plan_mask": plan_mask,
+        "fact_hours": fact_hours,
+        "extra_hours": extra_hours,
+        "rates": rates,
+        "status_matrix": status_matrix,
+    }
+    for arr in arrays.values():
+        arr.setflags(write=False)
+    return {
+        "num_days": num_days,
+        "total_employees": len(employees),
+        "statuses": list(statuses),
+        **arrays,
+    }
+
+
+def _by_day(values, cast=float) -> dict:
+    """Вектор по дням → {"1": ..., "2": ..., ...}."""
+    return {str(d): cast(v) for d, v in enumerate(values, start=1)}
 
+
+def get_monthly_analytics(year: int, month: int) -> dict:
+    """Расширенная аналитика: по дням (план/факт) с разбивкой по производствам и статусам."""
     result = {}
     for prod in PRODUCTIONS:
-        schedule = get_schedule(prod, year, month)
-        timesheet = get_timesheet(prod, year, month)
-        employees = schedule.get("employees", []) if isinstance(schedule, dict) else []
-        ts_records = timesheet.get("records", {}) if isinstance(timesheet, dict) else {}
-
-        # Итого по производству
-        daily_planned      = _empty_day_dict(num_days)
-        daily_actual       = _empty_day_dict(num_days)
-        daily_planned_cost = _empty_cost_dict(num_days)
-        daily_actual_cost  = _empty_cost_dict(num_days)
-
-        total_planned_cost  = 0.0
-        total_actual_cost   = 0.0
-        total_planned_hours = 0.0
-        total_actual_hours  = 0.0
-        status_counts: dict = {}
-
-        # По статусам
-        st_emp_count:        dict[str, int]   = {}
-        st_daily_planned:    dict[str, dict]  = {}
-        st_daily_actual:     dict[str, dict]  = {}
-        st_daily_plan_cost:  dict[str, dict]  = {}
-        st_daily_fact_cost:  dict[str, dict]  = {}
-        st_total_plan_cost:  dict[str, float] = {}
-        st_total_fact_cost:  dict[str, float] = {}
-        st_total_plan_hours: dict[str, float] = {}
-        st_total_fact_hours: dict[str, float] = {}
-
-        for emp in employees:
-            if not isinstance(emp, dict):
-                continue
-            emp_id   = emp.get("id") or ""
-            position = emp.get("position", "") or ""
-            status   = emp.get("status", "") or ""
-            rate     = rate_lookup.get((position, status), 0.0)
-            working_days: dict = emp.get("working_days") or {}
-            ts_emp:  dict = ts_records.get(emp_id) or {}
-
-            status_counts[status] = status_counts.get(status, 0) + 1
-            st_emp_count[status]  = st_emp_count.get(status, 0) + 1
-
-            # Инициализация статусных словарей
-            if status not in st_daily_planned:
-                st_daily_planned[status]   = _empty_day_dict(num_days)
-                st_daily_actual[status]    = _empty_day_dict(num_days)
-                st_daily_plan_cost[status] = _empty_cost_dict(num_days)
-                st_daily_fact_cost[status] = _empty_cost_dict(num_days)
-                st_total_plan_cost[status] = 0.0
-                st_total_fact_cost[status] = 0.0
-                st_total_plan_hours[status] = 0.0
-                st_total_fact_hours[status] = 0.0
-
-            # 1) Запланированные дни (план + факт по табелю)
-            for day_str, planned_h_raw in working_days.items():
-                # Защита от нечисловых значений и выхода за пределы месяца
-                try:
-                    d = int(day_str)
-                    if d < 1 or d > num_days:
-                        continue
-                except (ValueError, TypeError):
-                    continue
-                planned_h = _to_float(planned_h_raw)
-                cost = planned_h * rate
-                # Итого по производству
-                daily_planned[day_str]      += 1
-                daily_planned_cost[day_str] += cost
-                total_planned_cost          += cost
-                total_planned_hours         += planned_h
-                # По статусу
-                st_daily_planned[status][day_str]   += 1
-                st_daily_plan_cost[status][day_str] += cost
-                st_total_plan_cost[status]          += cost
-                st_total_plan_hours[status]         = st_total_plan_hours.get(status, 0.0) + planned_h
-
-                actual_h_raw = ts_emp.get(day_str)
-                if actual_h_raw is not None:
-                    actual_h = _to_float(actual_h_raw)
-                    actual_cost = actual_h * rate
-                    if actual_h > 0:
-                        daily_actual[day_str]                += 1
-                        st_daily_actual[status][day_str]     += 1
-                    daily_actual_cost[day_str]               += actual_cost
-                    st_daily_fact_cost[status][day_str]      += actual_cost
-                    total_actual_cost                        += actual_cost
-                    total_actual_hours                       += actual_h
-                    st_total_fact_cost[status]               += actual_cost
-                    st_total_fact_hours[status]              = st_total_fact_hours.get(status, 0.0) + actual_h
-
-            # 2) Внеплановые дни: в табеле есть часы, но дня нет в графике — учитываем в факте
-            for day_str, actual_h_raw in ts_emp.items():
-                if day_str in working_days:
-                    continue  # уже учтено выше
-                actual_h = _to_float(actual_h_raw)
-                if actual_h <= 0:
-                    continue
-                try:
-                    d = int(day_str)
-                    if d < 1 or d > num_days:
-                        continue  # день вне месяца
-                except (ValueError, TypeError):
-                    continue
-                actual_cost = actual_h * rate
-                daily_actual[day_str]               += 1
-                daily_actual_cost[day_str]            += actual_cost
-                st_daily_actual[status][day_str]     += 1
-                st_daily_fact_cost[status][day_str]  += actual_cost
-                total_actual_cost                     += actual_cost
-                total_actual_hours                    += actual_h
-                st_total_fact_cost[status]            += actual_cost
+        m = _month_matrices(prod, year, month)
+        rates = m["rates"][:, None]
+        statuses = m["statuses"]
+        status_matrix = m["status_matrix"]
+
+        plan_count  = m["plan_mask"].astype(float)
+        plan_cost   = m["plan_hours"] * rates
+        fact_hours  = m["fact_hours"] + m["extra_hours"]
+        fact_cost   = fact_hours * rates
+        fact_count  = ((m["fact_hours"] > 0) | (m["extra_hours"] > 0)).astype(float)
+
+        # Свёртки по статусам: (статус × сотрудник) @ (сотрудник × день)
+        st_planned   = status_matrix @ plan_count
+        st_actual    = status_matrix @ fact_count
+        st_plan_cost = status_matrix @ plan_cost
+        st_fact_cost = status_matrix @ fact_cost
+        st_plan_hours = status_matrix @ m["plan_hours"].sum(axis=1)
+        # Часы факта по статусам — только по плановым дням (как и раньше)
+        st_fact_hours = status_matrix @ m["fact_hours"].sum(axis=1)
+        st_emp_count = {s: int(c) for s, c in zip(statuses, status_matrix.sum(axis=1))}
 
         result[prod] = {
             "name": PRODUCTIONS[prod],
-            "total_employees": len(employees),
-            "status_counts":   status_counts,
-            "daily_planned":   daily_planned,
-            "daily_actual":    daily_actual,
-            "daily_planned_cost": daily_planned_cost,
-            "daily_actual_cost":  daily_actual_cost,
-            "total_planned_cost":  total_planned_cost,
-            "total_actual_cost":   total_actual_cost,
-            "total_planned_hours": total_planned_hours,
-            "total_actual_hours":  total_actual_hours,
+            "total_employees": m["total_employees"],
+            "status_counts":   dict(st_emp_count),
+            "daily_planned":   _by_day(plan_count.sum(axis=0), int),
+            "daily_actual":    _by_day(fact_count.sum(axis=0), int),
+            "daily_planned_cost": _by_day(plan_cost.sum(axis=0)),
+            "daily_actual_cost":  _by_day(fact_cost.sum(axis=0)),
+            "total_planned_cost":  float(plan_cost.sum()),
+            "total_actual_cost":   float(fact_cost.sum()),
+            "total_planned_hours": float(m["plan_hours"].sum()),
+            "total_actual_hours":  float(fact_hours.sum()),
             # Разбивка по статусам
             "status_employee_count":    st_emp_count,
-            "status_daily_planned":     st_daily_planned,
-            "status_daily_actual":      st_daily_actual,
-            "status_daily_plan_cost":   st_daily_plan_cost,
-            "status_daily_fact_cost":   st_daily_fact_cost,
-            "status_total_plan_cost":   st_total_plan_cost,
-            "status_total_fact_cost":   st_total_fact_cost,
-            "status_total_plan_hours":  st_total_plan_hours,
-            "status_total_fact_hours":  st_total_fact_hours,
+            "status_daily_planned":     {s: _by_day(st_planned[k], int) for k, s in enumerate(statuses)},
+            "status_daily_actual":      {s: _by_day(st_actual[k], int) for k, s in enumerate(statuses)},
+            "status_daily_plan_cost":   {s: _by_day(st_plan_cost[k]) for k, s in enumerate(statuses)},
+            "status_daily_fact_cost":   {s: _by_day(st_fact_cost[k]) for k, s in enumerate(statuses)},
+            "status_total_plan_cost":   {s: float(st_plan_cost[k].sum()) for k, s in enumerate(statuses)},
+            "status_total_fact_cost":   {s: float(st_fact_cost[k].sum()) for k, s in enumerate(statuses)},
+            "status_total_plan_hours":  {s: float(st_plan_hours[k]) for k, s in enumerate(statuses)},
+            "status_total_fact_hours":  {s: float(st_fact_hours[k]) for k, s in enumerate(statuses)},
         }
 
     return {"year": year, "month": month, "productions": result}
 
 
 def get_day_analytics(year: int, month: int, day: int) -> dict:
-    """Аналитика по конкретному дню: план/факт по всем производствам."""
-    reference = get_reference()
-    rate_lookup = {}
-    for r in reference:
-        try:
-            key = (r.get("position", ""), r.get("status", ""))
-            rate_lookup[key] = _to_float(r.get("hourly_rate", 0))
-        except Exception:
-            pass
-    day_str = str(day)
+    """Аналитика по конкретному дню: план/факт по всем производствам (столбец матриц месяца)."""
     result = {}
-
     for prod in PRODUCTIONS:
-        schedule = get_schedule(prod, year, month)
-        timesheet = get_timesheet(prod, year, month)
-        employees = schedule.get("employees", []) if isinstance(schedule, dict) else []
-        ts_records = timesheet.get("records", {}) if isinstance(timesheet, dict) else {}
-
-        planned_count = 0
-        actual_count = 0
-        planned_cost = 0.0
-        actual_cost = 0.0
-
-        for emp in employees:
-            if not isinstance(emp, dict):
-                continue
-            emp_id = emp.get("id") or ""
-            position = emp.get("position", "") or ""
-            status = emp.get("status", "") or ""
-            rate = rate_lookup.get((position, status), 0.0)
-            working_days = emp.get("working_days") or {}
-            ts_emp = ts_records.get(emp_id) or {}
-
-            if day_str in working_days:
-                planned_count += 1
-                planned_cost += _to_float(working_days[day_str]) * rate
-
-            actual_h = _to_float(ts_emp.get(day_str))
-            if actual_h > 0:
-                actual_count += 1
-                actual_cost += actual_h * rate
+        m = _month_matrices(prod, year, month)
+        d = _day_index(day, m["num_days"])
+        planned_count = actual_count = 0
+        planned_cost = actual_cost = 0.0
+        if d is not None:
+            rates = m["rates"]
+            fact_h = m["fact_hours"][:, d] + m["extra_hours"][:, d]
+            fact_h = np.where(fact_h > 0, fact_h, 0.0)
+            planned_count = int(m["plan_mask"][:, d].sum())
+            actual_count = int((fact_h > 0).sum())
+            planned_cost = float(m["plan_hours"][:, d] @ rates)
+            actual_cost = float(fact_h @ rates)
 
         result[prod] = {
             "name": PRODUCTIONS[prod],
@@ -612,165 +751,266 @@ def import_combined_from_tsv(production: str, year: int, month: int, tsv: str):
 
 # ─── Список сотрудников производства ─────────────────────────────────────────
 
-def _employees_path(production: str) -> Path:
-    return WORKFORCE_DIR / f"employees_{production}.json"
+def _load_employees(production: str) -> list:
+    with _db() as conn:
+        return workforce_store.load_employees(conn, production)
+
+
+# Правила участков: для каждого производства — «infer» (участок по должности) и «normalize»
+# (приведение записанного участка к каноническому имени карточки дашборда).
+# Правило подходит, если хотя бы одна группа из "any" целиком (все подстроки) входит в строку
+# в нижнем регистре; правила проверяются по порядку. "empty" — ответ для пустой строки,
+# "default" — если ни одно правило не подошло (None — оставить строку как есть).
+# Правила можно переопределить без изменения кода (save_section_rules, хранятся в БД workforce).
+DEFAULT_SECTION_RULES: dict = {
+    "engraving": {
+        "infer": {
+            "empty": "Вспомогательный персонал",
+            "default": "Вспомогательный персонал",
+            "rules": [
+                {"section": "Гравировочный цех", "any": [["гравер"], ["гравиров"], ["лазер"]]},
+                {"section": "Резка МДФ", "any": [["резка", "мдф"]]},
+                {"section": "Шелкография", "any": [["шелкограф"]]},
+                {"section": "Сборка МДФ", "any": [["сборщик", "короб"], ["сборка", "мдф"], ["сборщик", "мдф"]]},
+                {"section": "Сборочный цех", "any": [["упаков"], ["комплектовщ"]]},
+                {"section": "Валковый пресс", "any": [["валков"], ["пресс"]]},
+            ],
+        },
+        "normalize": {
+            "empty": "—",
+            "default": None,
+            "rules": [
+                {"section": "Гравировка", "any": [["гравиров"]]},
+                {"section": "Резка МДФ", "any": [["резка", "мдф"]]},
+                {"section": "Сборка МДФ", "any": [["сборка", "мдф"]]},
+                {"section": "Валковый пресс", "any": [["валков"], ["пресс"]]},
+                {"section": "Шелкография", "any": [["шелкограф"]]},
+                {"section": "Выпуск готовой продукции", "any": [["сбороч"], ["выпуск"]]},
+                {"section": "Вспомогательный персонал", "any": [
+                    ["руковод"], ["начальник"], ["мастер"], ["техник"], ["уборщ"], ["кладов"], ["оператор"],
+                ]},
+            ],
+        },
+    },
+    "tea": {
+        "infer": {
+            "empty": "Вспомогательный персонал",
+            "default": "Вспомогательный персонал",
+            "rules": [
+                {"section": "Купажный цех", "any": [["купаж"]]},
+                {"section": "Фасовочный цех", "any": [["фасов"]]},
+                {"section": "Шелкография", "any": [["шелкограф"]]},
+                {"section": "Картон/Дерево", "any": [["картон"], ["дерево"], ["резка"], ["мдф"]]},
+                {"section": "Сборочный цех", "any": [["сборочн"], ["термо"], ["туннель"], ["упаков"]]},
+            ],
+        },
+        # Также переводит старые названия (Термотуннель, Упаковка) → Сборочный цех
+        "normalize": {
+            "empty": "—",
+            "default": None,
+            "rules": [
+                {"section": "Купажный цех", "any": [["купаж"]]},
+                {"section": "Фасовочный цех", "any": [["фасов"]]},
+                {"section": "Шелкография", "any": [["шелкограф"]]},
+                {"section": "Картон/Дерево", "any": [["картон"], ["дерево"], ["мдф"]]},
+                {"section": "Сборочный цех", "any": [["сборочн"], ["термо"], ["туннель"], ["упаков"]]},
+                {"section": "Вспомогательный персонал", "any": [["вспомогател"], ["руковод"], ["начальник"], ["мастер"]]},
+            ],
+        },
+    },
+    "luminarc": {
+        "infer": {
+            "empty": "Вспомогательный персонал",
+            "default": "Вспомогательный персонал",
+            "rules": [
+                {"section": "Склад", "any": [["склад"], ["кладов"]]},
+                {"section": "Комплекты", "any": [["комплект"]]},
+                {"section": "Упаковка", "any": [["упаков"], ["сборщ"], ["сборка"]]},
+            ],
+        },
+        "normalize": {"empty": "—", "default": None, "rules": []},
+    },
+}
 
+_SECTION_RULES_SETTING = "section_rules"
+
+
+def validate_section_rules(rules) -> None:
+    """Проверить структуру правил участков; ValueError с описанием ошибки."""
+    if not isinstance(rules, dict):
+        raise ValueError("Правила — объект {производство: {infer, normalize}}")
+    for production, kinds in rules.items():
+        if production not in PRODUCTIONS:
+            raise ValueError(f"Неизвестное производство: {production}")
+        if not isinstance(kinds, dict):
+            raise ValueError(f"{production}: ожидается объект {{infer, normalize}}")
+        for kind, table in kinds.items():
+            if kind not in ("infer", "normalize"):
+                raise ValueError(f"{production}: неизвестный вид правил «{kind}»")
+            if not isinstance(table, dict) or not isinstance(table.get("rules", []), list):
+                raise ValueError(f"{production}.{kind}: ожидается объект с полем rules (список)")
+            for rule in table.get("rules", []):
+                groups = rule.get("any") if isinstance(rule, dict) else None
+                if (
+                    not isinstance(rule, dict)
+                    or not isinstance(rule.get("section"), str)
+                    or not isinstance(groups, list)
+                    or not all(isinstance(g, list) and g and all(isinstance(k, str) and k for k in g) for g in groups)
+                ):
+                    raise ValueError(f"{production}.{kind}: правило {rule!r} — нужны section и any: [[подстроки]]")
+
+
+def _load_section_rules() -> dict:
+    with _db() as conn:
+        custom = workforce_store.get_setting(conn, _SECTION_RULES_SETTING)
+    rules = {p: dict(kinds) for p, kinds in DEFAULT_SECTION_RULES.items()}
+    if isinstance(custom, dict):
+        for production, kinds in custom.items():
+            rules.setdefault(production, {}).update(kinds)
+    return rules
+
+
+def get_section_rules() -> dict:
+    """Действующие правила участков (стандартные с учётом сохранённых переопределений)."""
+    return _thaw(_section_rules_view())
+
+
+def save_section_rules(rules: Optional[dict]) -> None:
+    """Сохранить переопределения правил участков (None — вернуть стандартные)."""
+    if rules is not None:
+        validate_section_rules(rules)
+    with _db() as conn:
+        workforce_store.set_setting(conn, _SECTION_RULES_SETTING, rules)
+    _invalidate_reads()
+
+
+def _section_rules_view() -> Mapping:
+    return _cached(("section_rules",), _load_section_rules, (_rev("setting", _SECTION_RULES_SETTING),))
+
+
+def _compile_section_rules(table: Mapping) -> Callable[[str], str]:
+    """Собрать функцию сопоставления по таблице правил; результат запоминается для каждой строки."""
+    empty = table.get("empty", "")
+    default = table.get("default")
+    rules = tuple(
+        (rule["section"], tuple(tuple(k.lower() for k in group) for group in rule["any"]))
+        for rule in table.get("rules", ())
+    )
+    memo: dict[str, str] = {}
+
+    def _match(value: str) -> str:
+        s = (value or "").strip()
+        result = memo.get(s)
+        if result is not None:
+            return result
+        low = s.lower()
+        if not low:
+            result = empty
+        else:
+            result = s if default is None else default
+            for section, groups in rules:
+                if any(all(k in low for k in group) for group in groups):
+                    result = section
+                    break
+        memo[s] = result
+        return result
 
-def _infer_section_for_engraving(position: str) -> str:
-    """
-    Определить участок по должности.
-    Правила: гравировщики→Гравировка, Резка МДФ→Резка МДФ, шелкографист→Шелкография,
-    сборщик коробок→Сборка МДФ, упаковщик/комплектовщик→Сборочный цех, остальные→Вспомогательный персонал.
-    """
-    p = (position or "").lower().strip()
-    if not p:
-        return "Вспомогательный персонал"
-
-    if "гравер" in p or "гравиров" in p or "лазер" in p:
-        return "Гравировочный цех"
-    if "резка" in p and "мдф" in p:
-        return "Резка МДФ"
-    if "шелкограф" in p:
-        return "Шелкография"
-    if "сборщик" in p and "короб" in p:
-        return "Сборка МДФ"
-    if ("сборка" in p or "сборщик" in p) and "мдф" in p:
-        return "Сборка МДФ"
-    if "упаков" in p:
-        return "Сборочный цех"
-    if "комплектовщ" in p:
-        return "Сборочный цех"
-    if "валков" in p or "пресс" in p:
-        return "Валковый пресс"
-
-    return "Вспомогательный персонал"
+    return _match
 
 
-def _normalize_engraving_section(section: str) -> str:
-    """
-    Нормализация названия участка гравировки к каноническим именам карточек
-    на дашборде (независимо от того, как он записан в списке сотрудников).
-    """
-    s = (section or "").strip()
-    if not s:
-        return "—"
-    low = s.lower()
+_compiled_section_rules: dict = {"source": None, "matchers": {}}
 
-    # Гравировка
-    if "гравиров" in low:
-        return "Гравировка"
 
-    # Резка МДФ
-    if "резка" in low and "мдф" in low:
-        return "Резка МДФ"
-
-    # Сборка МДФ
-    if "сборка" in low and "мдф" in low:
-        return "Сборка МДФ"
-
-    # Валковый пресс
-    if "валков" in low or "пресс" in low:
-        return "Валковый пресс"
+def _section_matcher(production: str, kind: str) -> Optional[Callable[[str], str]]:
+    """Скомпилированные правила вида kind ("infer"/"normalize") для производства; None — правил нет."""
+    global _compiled_section_rules
+    rules = _section_rules_view()
+    if _compiled_section_rules["source"] is not rules:
+        _compiled_section_rules = {
+            "source": rules,
+            "matchers": {
+                (prod, k): _compile_section_rules(table)
+                for prod, kinds in rules.items()
+                for k, table in kinds.items()
+            },
+        }
+    return _compiled_section_rules["matchers"].get((production, kind))
 
-    # Шелкография
-    if "шелкограф" in low:
-        return "Шелкография"
 
-    # Выпуск готовой продукции / сборочный
-    if "сбороч" in low or "выпуск" in low:
-        return "Выпуск готовой продукции"
+def _infer_section_for_engraving(position: str) -> str:
+    """Определить участок гравировки по должности (правила DEFAULT_SECTION_RULES["engraving"])."""
+    return _section_matcher("engraving", "infer")(position)
 
-    # Вспомогательный персонал
-    if any(k in low for k in ["руковод", "начальник", "мастер", "техник", "уборщ", "кладов", "оператор"]):
-        return "Вспомогательный персонал"
 
-    return s
+def _normalize_engraving_section(section: str) -> str:
+    """
+    Нормализация названия участка гравировки к каноническим именам карточек
+    на дашборде (независимо от того, как он записан в списке сотрудников).
+    """
+    return _section_matcher("engraving", "normalize")(section)
 
 
 def _infer_section_for_tea(position: str) -> str:
     """Определить участок по должности для ЧАЙ."""
-    p = (position or "").lower().strip()
-    if not p:
-        return "Вспомогательный персонал"
-    if "купаж" in p:
-        return "Купажный цех"
-    if "фасов" in p:
-        return "Фасовочный цех"
-    if "шелкограф" in p:
-        return "Шелкография"
-    if "картон" in p or "дерево" in p or "резка" in p or "мдф" in p:
-        return "Картон/Дерево"
-    if "сборочн" in p or "термо" in p or "туннель" in p or "упаков" in p:
-        return "Сборочный цех"
-    return "Вспомогательный персонал"
+    return _section_matcher("tea", "infer")(position)
 
 
 def _normalize_tea_section(section: str) -> str:
-    """Нормализация участков чая к каноническим именам дашборда.
-    Также переводит старые названия (Термотуннель, Упаковка) → Сборочный цех.
-    """
-    s = (section or "").strip()
-    if not s:
-        return "—"
-    low = s.lower()
-    if "купаж" in low:
-        return "Купажный цех"
-    if "фасов" in low:
-        return "Фасовочный цех"
-    if "шелкограф" in low:
-        return "Шелкография"
-    if "картон" in low or "дерево" in low or "мдф" in low:
-        return "Картон/Дерево"
-    if "сборочн" in low or "термо" in low or "туннель" in low or "упаков" in low:
-        return "Сборочный цех"
-    if any(k in low for k in ["вспомогател", "руковод", "начальник", "мастер"]):
-        return "Вспомогательный персонал"
-    return s or "—"
+    """Нормализация участков чая к каноническим именам дашборда."""
+    return _section_matcher("tea", "normalize")(section)
 
 
 def _infer_section_for_luminarc(position: str) -> str:
     """Определить участок по должности для ЛЮМИНАРК."""
-    p = (position or "").lower().strip()
-    if not p:
-        return "Вспомогательный персонал"
-    if "склад" in p or "кладов" in p:
-        return "Склад"
-    if "комплект" in p:
-        return "Комплекты"
-    if "упаков" in p or "сборщ" in p or "сборка" in p:
-        return "Упаковка"
-    return "Вспомогательный персонал"
+    return _section_matcher("luminarc", "infer")(position)
+
+
+def assign_sections(productions: Optional[list] = None) -> dict[str, int]:
+    """
+    Проставить участки по должности всем сотрудникам производств (по умолчанию — всех, для которых есть правила).
+    Должность сопоставляется один раз на каждое различное значение. Возвращает {производство: кол-во сотрудников}.
+    """
+    result = {}
+    for production in productions or list(PRODUCTIONS):
+        infer_fn = _section_matcher(production, "infer")
+        if infer_fn is None:
+            continue
+        employees = _load_employees(production)
+        sections = {p: infer_fn(p) for p in {emp.get("position", "") for emp in employees}}
+        for emp in employees:
+            emp["section"] = sections[emp.get("position", "")]
+        save_employees(production, employees)
+        result[production] = len(employees)
+    return result
 
 
 def assign_sections_for_tea() -> int:
     """Проставить участки всем сотрудникам чая по должности."""
-    _ensure_dir()
-    employees = _read_json(_employees_path("tea"), [])
-    for emp in employees:
-        emp["section"] = _infer_section_for_tea(emp.get("position", ""))
-    save_employees("tea", employees)
-    return len(employees)
+    return assign_sections(["tea"])["tea"]
 
 
 def assign_sections_for_luminarc() -> int:
     """Проставить участки всем сотрудникам люминарка по должности."""
-    _ensure_dir()
-    employees = _read_json(_employees_path("luminarc"), [])
-    for emp in employees:
-        emp["section"] = _infer_section_for_luminarc(emp.get("position", ""))
-    save_employees("luminarc", employees)
-    return len(employees)
+    return assign_sections(["luminarc"])["luminarc"]
+
+
+def _employees_view(production: str) -> tuple:
+    return _cached(
+        ("employees", production),
+        lambda: _read_employees(production),
+        (_rev("employees", production), _rev("setting", _SECTION_RULES_SETTING)),
+    )
 
 
 def get_employees(production: str) -> list:
     """Постоянный список сотрудников производства (не привязан к месяцу)."""
-    _ensure_dir()
-    employees = _read_json(_employees_path(production), [])
-    _infer_fn = {
-        "engraving": _infer_section_for_engraving,
-        "tea": _infer_section_for_tea,
-        "luminarc": _infer_section_for_luminarc,
-    }.get(production)
+    return _thaw(_employees_view(production))
+
+
+def _read_employees(production: str) -> list:
+    """Список сотрудников из хранилища; пустые участки проставляются по должности и сохраняются."""
+    employees = _load_employees(production)
+    _infer_fn = _section_matcher(production, "infer")
     if _infer_fn and employees:
         changed = False
         for emp in employees:
@@ -785,7 +1025,9 @@ def get_employees(production: str) -> list:
 
 
 def save_employees(production: str, employees: list) -> None:
-    _write_json(_employees_path(production), employees)
+    with _db() as conn:
+        workforce_store.save_employees(conn, production, employees)
+    _invalidate_reads()
 
 
 def assign_sections_for_engraving() -> int:
@@ -793,27 +1035,23 @@ def assign_sections_for_engraving() -> int:
     Проставить участки всем сотрудникам гравировки по должности.
     Возвращает количество сотрудников.
     """
-    _ensure_dir()
-    employees = _read_json(_employees_path("engraving"), [])
-    for emp in employees:
-        emp["section"] = _infer_section_for_engraving(emp.get("position", ""))
-    save_employees("engraving", employees)
-    return len(employees)
+    return assign_sections(["engraving"])["engraving"]
 
 
-def merge_employees_from_schedule(production: str, schedule: dict) -> int:
-    """
-    После импорта графика — добавить новых сотрудников в список производства.
-    Сопоставление по ФИО. Возвращает кол-во добавленных.
-    """
-    existing = get_employees(production)
-    existing_names = {e["full_name"].strip().lower() for e in existing}
+def _name_key(name) -> str:
+    """Ключ сопоставления сотрудников по ФИО: без регистра и лишних пробелов."""
+    return " ".join(str(name or "").split()).lower()
+
+
+def _new_list_entries(production: str, existing: list, schedule_employees) -> list:
+    """Записи для списка сотрудников по ФИО из графика, которых в списке ещё нет."""
+    existing_names = {_name_key(e.get("full_name")) for e in existing}
     added = []
-    for emp in schedule.get("employees", []):
-        name = emp.get("full_name", "").strip()
+    for emp in schedule_employees:
+        name = (emp.get("full_name") or "").strip()
         if not name:
             continue
-        if name.lower() not in existing_names:
+        if _name_key(name) not in existing_names:
             position = emp.get("position", "")
             entry = {
                 "id": str(uuid.uuid4()),
@@ -826,12 +1064,94 @@ def merge_employees_from_schedule(production: str, schedule: dict) -> int:
                 if sec:
                     entry["section"] = sec
             added.append(entry)
-            existing_names.add(name.lower())
+            existing_names.add(_name_key(name))
+    return added
+
+
+def merge_employees_from_schedule(production: str, schedule: dict) -> int:
+    """
+    После импорта графика — добавить новых сотрудников в список производства.
+    Сопоставление по ФИО. Возвращает кол-во добавленных.
+    """
+    existing = get_employees(production)
+    added = _new_list_entries(production, existing, schedule.get("employees", []))
     if added:
         save_employees(production, existing + added)
     return len(added)
 
 
+def _diff_schedule_employees(before, after) -> dict:
+    """Что изменит импорт в графике месяца: добавленные, убранные и изменённые сотрудники (по ФИО)."""
+    before_by_name = {_name_key(e.get("full_name")): e for e in before}
+    after_by_name = {_name_key(e.get("full_name")): e for e in after}
+    changed = []
+    unchanged = 0
+    for key, emp in after_by_name.items():
+        prev = before_by_name.get(key)
+        if prev is None:
+            continue
+        same = (
+            (prev.get("position") or "") == (emp.get("position") or "")
+            and (prev.get("status") or "") == (emp.get("status") or "")
+            and {d: _to_float(h) for d, h in (prev.get("working_days") or {}).items()}
+            == {d: _to_float(h) for d, h in (emp.get("working_days") or {}).items()}
+        )
+        if same:
+            unchanged += 1
+        else:
+            changed.append(emp.get("full_name", ""))
+    return {
+        "added": [e.get("full_name", "") for k, e in after_by_name.items() if k not in before_by_name],
+        "removed": [e.get("full_name", "") for k, e in before_by_name.items() if k not in after_by_name],
+        "changed": changed,
+        "unchanged": unchanged,
+    }
+
+
+def apply_month_import(production: str, year: int, month: int, schedule: dict, timesheet: Optional[dict] = None) -> dict:
+    """
+    Применить импорт графика (и табеля, если передан) за месяц.
+    Строки импорта сопоставляются с текущим графиком месяца по ФИО через словарь: найденные сотрудники
+    сохраняют свой id и поля, которых нет в таблице (телефон, участок…), поэтому табель остаётся
+    привязан к ним. График, табель и новые записи списка сотрудников пишутся одной транзакцией.
+    Возвращает {"schedule", "timesheet", "added" (новых в списке), "diff"}.
+    """
+    current = _schedule_view(production, year, month)
+    current_by_name: dict[str, Mapping] = {}
+    for emp in current.get("employees", ()):
+        current_by_name.setdefault(_name_key(emp.get("full_name")), emp)
+
+    id_map: dict[str, str] = {}
+    matched: set[str] = set()
+    employees = []
+    for emp in schedule.get("employees", []):
+        key = _name_key(emp.get("full_name"))
+        prev = current_by_name.get(key)
+        if prev is not None and key not in matched:
+            matched.add(key)
+            merged = {**_thaw(prev), **emp, "id": prev.get("id") or emp.get("id")}
+            id_map[emp.get("id")] = merged["id"]
+            employees.append(merged)
+        else:
+            employees.append(emp)
+    schedule = {**schedule, "production": production, "year": year, "month": month, "employees": employees}
+    if timesheet is not None:
+        records = {id_map.get(emp_id, emp_id): days for emp_id, days in (timesheet.get("records") or {}).items()}
+        timesheet = {**timesheet, "production": production, "year": year, "month": month, "records": records}
+
+    existing = get_employees(production)
+    added = _new_list_entries(production, existing, employees)
+    diff = _diff_schedule_employees(current.get("employees", ()), employees)
+
+    with _month_lock("schedule", production, year, month), _month_lock("timesheet", production, year, month), _db() as conn:
+        workforce_store.save_import(
+            conn, production, year, month,
+            schedule=schedule, timesheet=timesheet, employees=existing + added if added else None,
+        )
+    _invalidate_reads()
+    return {"schedule": schedule, "timesheet": timesheet, "added": len(added), "diff": diff}
+
+
 def fire_employee(production: str, employee_id: str, fired_at: str) -> dict:
     """
     Уволить сотрудника: проставить дату увольнения и удалить из будущих графиков.
@@ -857,8 +1177,7 @@ def fire_employee(production: str, employee_id: str, fired_at: str) -> dict:
             m = start.month - 1 + i
             year = start.year + m // 12
             month = m % 12 + 1
-            path = _schedule_path(production, year, month)
-            if path.exists():
+            if schedule_exists(production, year, month):
                 sched = get_schedule(production, year, month)
                 before = len(sched.get("employees", []))
                 sched["employees"] = [
@@ -882,231 +1201,302 @@ def reinstate_employee(production: str, employee_id: str) -> dict:
     return {"ok": True}
 
 
-def get_workforce_period_data(production: str, date_from, date_to) -> dict:
-    """Get employee count, total hours and costs for a production over a date range.
-    Also returns per-section counts (if employees have the 'section' field set).
-    """
-    from datetime import date as _date
+# ─── Ряды затрат на персонал по дням ─────────────────────────────────────────
+# Для каждого производства и месяца строятся ряды «факт» (табель) и «план» (график):
+# записи (день, часы, ФОТ) с накопленными суммами — итоги за диапазон дат внутри месяца считаются
+# по двум бинарным поискам, за произвольный период — сложением по месяцам, без обхода сотрудников-дней.
+# Ряд месяца кэшируется (_cached) и перестраивается только после записи своих источников:
+# графика или табеля этого месяца, справочника, списка сотрудников, правил участков.
 
-    reference = get_reference()
-    rate_lookup = {(r["position"], r["status"]): r["hourly_rate"] for r in reference}
-
-    # Determine which (year, month) pairs overlap the period
-    months: set[tuple[int, int]] = set()
-    cur = _date(date_from.year, date_from.month, 1)
-    end = _date(date_to.year, date_to.month, 1)
-    while cur <= end:
-        months.add((cur.year, cur.month))
-        if cur.month == 12:
-            cur = _date(cur.year + 1, 1, 1)
-        else:
-            cur = _date(cur.year, cur.month + 1, 1)
+def _section_resolver(production: str) -> Callable[[str, str], str]:
+    """Участок сотрудника по ФИО: поле section из списка сотрудников, иначе — по должности; с нормализацией."""
+    raw_section_map: dict[str, str] = {
+        (e.get("full_name") or "").strip(): (e.get("section") or "").strip()
+        for e in _employees_view(production)
+    }
+    infer_fn = _section_matcher(production, "infer")
+    normalize_fn = _section_matcher(production, "normalize")
 
-    employees_set: set[str] = set()
-    total_hours = 0.0
-    total_cost  = 0.0
-    daily_cost:      dict[str, float] = {}
-    daily_employees: dict[str, set]   = {}
-    use_schedule_fallback = False  # будет True если табель пуст
-
-    for year, month in sorted(months):
-        timesheet  = get_timesheet(production, year, month)
-        schedule   = get_schedule(production, year, month)
-        ts_records = timesheet.get("records", {})
-        emp_by_id  = {e["id"]: e for e in schedule.get("employees", [])}
-
-        for emp_id, days_dict in ts_records.items():
-            emp = emp_by_id.get(emp_id)
-            if not emp:
+    def _section(name: str, position: str = "") -> str:
+        sec = raw_section_map.get(name, "").strip()
+        if not sec and position and infer_fn:
+            sec = infer_fn(position)
+        sec = sec or ""
+        return normalize_fn(sec) if normalize_fn else ((sec or "—").strip() or "—")
+
+    return _section
+
+
+def _positive_hours(hours) -> Optional[float]:
+    h = _to_float(hours)
+    return h if h > 0 else None
+
+
+def _cumsum(values: list) -> list:
+    out = [0.0]
+    for v in values:
+        out.append(out[-1] + v)
+    return out
+
+
+def _range_indices(ords, lo: int, hi: int) -> tuple[int, int]:
+    return bisect_left(ords, lo), bisect_right(ords, hi)
+
+
+def _finish_series(rows: dict, section_of: Callable[[str, str], str]) -> dict:
+    """Отсортировать записи месяца и посчитать накопленные суммы: общий ряд, по сотрудникам, по ФИО, по участкам."""
+    all_entries: list = []
+    names: dict[str, set] = {}
+    sections: dict[str, dict[int, float]] = {}
+    finished = []
+    for (name, position, status), row in rows.items():
+        entries = sorted(row["entries"])
+        all_entries.extend(entries)
+        if entries:
+            names.setdefault(name, set()).update(e[0] for e in entries)
+        section = section_of(name, position)
+        sec_days = sections.setdefault(section, {})
+        for d, _, cost in entries:
+            sec_days[d] = sec_days.get(d, 0.0) + cost
+        finished.append({
+            "name": name,
+            "position": position,
+            "status": status,
+            "rate": row["rate"],
+            "section": section,
+            "seq": row["seq"],
+            "ords": [e[0] for e in entries],
+            "cum_hours": _cumsum([e[1] for e in entries]),
+            "cum_cost": _cumsum([e[2] for e in entries]),
+        })
+    all_entries.sort()
+    day_cost: dict[int, float] = {}
+    for d, _, cost in all_entries:
+        day_cost[d] = day_cost.get(d, 0.0) + cost
+    return {
+        "ords": [e[0] for e in all_entries],
+        "cum_hours": _cumsum([e[1] for e in all_entries]),
+        "cum_cost": _cumsum([e[2] for e in all_entries]),
+        "days": sorted(day_cost),
+        "day_cost": [day_cost[d] for d in sorted(day_cost)],
+        "names": {name: sorted(ords) for name, ords in names.items()},
+        "sections": {
+            sec: {"days": sorted(days), "day_cost": [days[d] for d in sorted(days)]}
+            for sec, days in sections.items()
+        },
+        "rows": finished,
+    }
+
+
+def _range_sum(series: Mapping, lo: int, hi: int) -> tuple[float, float]:
+    """Часы и ФОТ ряда (общего или сотрудника) за дни [lo, hi]."""
+    i, j = _range_indices(series["ords"], lo, hi)
+    if j <= i:
+        return 0.0, 0.0
+    return series["cum_hours"][j] - series["cum_hours"][i], series["cum_cost"][j] - series["cum_cost"][i]
+
+
+def _labor_months(production: str) -> tuple:
+    """Сохранённые месяцы производства и следующие за ними (в них график переносится из предыдущего месяца)."""
+    def _load() -> list:
+        with _db() as conn:
+            stored = workforce_store.list_months(conn, production)
+        months = set(stored)
+        for y, m in stored:
+            months.add((y, m + 1) if m < 12 else (y + 1, 1))
+        return sorted(months)
+
+    return _cached(("labor_months", production), _load, (_rev("months", production),))
+
+
+def _labor_month_sources(production: str, year: int, month: int) -> tuple:
+    """Ревизии, по которым строится ряд месяца: справочник, сотрудники, правила участков, график и табель месяца."""
+    return (
+        _rev("reference"),
+        _rev("employees", production),
+        _rev("setting", _SECTION_RULES_SETTING),
+        *_schedule_sources(production, year, month),
+        _rev("timesheet", production, year, month),
+    )
+
+
+def _labor_month(production: str, year: int, month: int) -> Mapping:
+    return _cached(
+        ("labor_month", production, year, month),
+        lambda: _build_labor_month(production, year, month),
+        _labor_month_sources(production, year, month),
+    )
+
+
+def _build_labor_month(production: str, year: int, month: int) -> dict:
+    """Ряды месяца: fact / plan (_finish_series), должности сотрудников графика, плановые дни по ФИО."""
+    from datetime import date as _date
+
+    rate_lookup = {(r["position"], r["status"]): r["hourly_rate"] for r in _reference_view()}
+    section_of = _section_resolver(production)
+    schedule = _schedule_view(production, year, month)
+    timesheet = _timesheet_view(production, year, month)
+    sched_emps = schedule.get("employees", [])
+    emp_by_id = {e["id"]: e for e in sched_emps}
+
+    # Должность — последняя запись сотрудника в графике месяца
+    positions: dict[str, str] = {}
+    planned: dict[str, set] = {}
+    for e in sched_emps:
+        name = (e.get("full_name") or "").strip()
+        if not name:
+            continue
+        positions[name] = e.get("position", "")
+        for day_str in (e.get("working_days") or {}):
+            try:
+                planned.setdefault(name, set()).add(_date(year, month, int(day_str)).toordinal())
+            except Exception:
                 continue
-            position = emp.get("position", "")
-            status   = emp.get("status", "")
-            rate     = rate_lookup.get((position, status), 0.0)
 
+    items = {
+        "fact": [
+            (days_dict, emp_by_id[emp_id])
+            for emp_id, days_dict in timesheet.get("records", {}).items()
+            if emp_by_id.get(emp_id)
+        ],
+        "plan": [(e.get("working_days") or {}, e) for e in sched_emps],
+    }
+    result = {}
+    for mode, mode_items in items.items():
+        rows: dict[tuple, dict] = {}
+        for seq, (days_dict, emp) in enumerate(mode_items):
+            position = emp.get("position", "")
+            status = emp.get("status", "")
+            key = ((emp.get("full_name") or "").strip(), position, status)
+            row = rows.setdefault(key, {
+                "rate": rate_lookup.get((position, status), 0.0),
+                "seq": seq,
+                "entries": [],
+            })
             for day_str, hours in days_dict.items():
-                if not hours or float(hours) <= 0:
+                h = _positive_hours(hours)
+                if h is None:
                     continue
                 try:
-                    d = _date(year, month, int(day_str))
+                    d = _date(year, month, int(day_str)).toordinal()
                 except Exception:
                     continue
-                if date_from <= d <= date_to:
-                    name = emp.get("full_name", "").strip()
-                    employees_set.add(name)
-                    h    = float(hours)
-                    cost = h * rate
-                    total_hours += h
-                    total_cost  += cost
-                    dk = d.isoformat()
-                    daily_cost[dk] = daily_cost.get(dk, 0.0) + cost
-                    if dk not in daily_employees:
-                        daily_employees[dk] = set()
-                    daily_employees[dk].add(name)
-
-    # Если табель пуст — используем плановые часы из графика (fallback)
-    if total_hours == 0:
-        use_schedule_fallback = True
-        for year, month in sorted(months):
-            schedule = get_schedule(production, year, month)
-            for emp in schedule.get("employees", []):
-                position = emp.get("position", "")
-                status   = emp.get("status", "")
-                rate     = rate_lookup.get((position, status), 0.0)
-                name     = emp.get("full_name", "").strip()
-                for day_str, hours in (emp.get("working_days") or {}).items():
-                    if not hours or float(hours) <= 0:
-                        continue
-                    try:
-                        d = _date(year, month, int(day_str))
-                    except Exception:
-                        continue
-                    if date_from <= d <= date_to:
-                        employees_set.add(name)
-                        h    = float(hours)
-                        cost = h * rate
-                        total_hours += h
-                        total_cost  += cost
-                        dk = d.isoformat()
-                        daily_cost[dk] = daily_cost.get(dk, 0.0) + cost
-                        if dk not in daily_employees:
-                            daily_employees[dk] = set()
-                        daily_employees[dk].add(name)
-
-    # Section-level: по полю section из списка сотрудников; если пусто — определяем по должности из графика
-    emp_records = get_employees(production)
-    raw_section_map: dict[str, str] = {
-        e.get("full_name", "").strip(): (e.get("section") or "").strip()
-        for e in emp_records
-    }
-    # Должность из графика (для подстановки участка, если в списке не проставлен)
-    name_to_position: dict[str, str] = {}
-    for y, m in sorted(months):
-        sched = get_schedule(production, y, m)
-        for e in sched.get("employees", []):
-            n = (e.get("full_name") or "").strip()
-            if n:
-                name_to_position[n] = e.get("position", "")
-
-    _infer_fns = {
-        "engraving": _infer_section_for_engraving,
-        "tea": _infer_section_for_tea,
-        "luminarc": _infer_section_for_luminarc,
+                row["entries"].append((d, h, h * row["rate"]))
+        result[mode] = _finish_series(rows, section_of)
+
+    return {
+        **result,
+        "positions": positions,
+        "planned": {name: sorted(ords) for name, ords in planned.items()},
     }
 
-    def _section_for_name(name: str, position: str = "") -> str:
-        sec = raw_section_map.get(name, "").strip()
-        if not sec and position:
-            infer_fn = _infer_fns.get(production)
-            if infer_fn:
-                sec = infer_fn(position)
-        return sec or ""
+
+def _labor_slices(production: str, ym_lo: int, ym_hi: int) -> list:
+    """Ряды месяцев производства с ym_lo по ym_hi (год * 12 + месяц - 1): [(ym, ряды месяца)] по возрастанию."""
+    return [
+        (year * 12 + month - 1, _labor_month(production, year, month))
+        for year, month in _labor_months(production)
+        if ym_lo <= year * 12 + month - 1 <= ym_hi
+    ]
+
+
+def _any_in_range(ords, lo: int, hi: int) -> bool:
+    return bisect_left(ords, lo) < bisect_right(ords, hi)
+
+
+def get_workforce_period_data(production: str, date_from, date_to) -> dict:
+    """Get employee count, total hours and costs for a production over a date range.
+    Also returns per-section counts (if employees have the 'section' field set).
+    Answered from the cached per-month daily series (_labor_month) with prefix sums.
+    """
+    from datetime import date as _date
+
+    section_of = _section_resolver(production)
+    lo, hi = date_from.toordinal(), date_to.toordinal()
+    ym_lo = date_from.year * 12 + date_from.month - 1
+    ym_hi = date_to.year * 12 + date_to.month - 1
+    slices = _labor_slices(production, ym_lo, ym_hi)
+
+    # Если табель за период пуст — используем плановые часы из графика (fallback)
+    use_schedule_fallback = not any(_any_in_range(sl["fact"]["ords"], lo, hi) for _, sl in slices)
+    mode = "plan" if use_schedule_fallback else "fact"
+
+    total_hours = total_cost = 0.0
+    daily_cost: dict[str, float] = {}
+    employees_set: set[str] = set()
+    # Должность из графика за период (последний месяц периода, где сотрудник есть)
+    name_to_position: dict[str, str] = {}
+    for _, sl in slices:
+        series = sl[mode]
+        hours, cost = _range_sum(series, lo, hi)
+        total_hours += hours
+        total_cost += cost
+        i, j = _range_indices(series["days"], lo, hi)
+        for d, day_cost in zip(series["days"][i:j], series["day_cost"][i:j]):
+            daily_cost[_date.fromordinal(d).isoformat()] = day_cost
+        employees_set.update(name for name, ords in series["names"].items() if _any_in_range(ords, lo, hi))
+        name_to_position.update(sl["positions"])
 
     section_hours: dict[str, float] = {}
     section_costs: dict[str, float] = {}
     section_employees: dict[str, set] = {}
-    daily_section_cost: dict[str, dict[str, float]] = {}
 
     def _ensure_section(sec: str) -> None:
         if sec not in section_employees:
             section_employees[sec] = set()
             section_hours[sec] = 0.0
             section_costs[sec] = 0.0
-            daily_section_cost[sec] = {}
-
-    _normalize_sec = {
-        "engraving": _normalize_engraving_section,
-        "tea": _normalize_tea_section,
-    }
-
-    def _norm(sec_raw: str) -> str:
-        fn = _normalize_sec.get(production)
-        return fn(sec_raw) if fn else ((sec_raw or "—").strip() or "—")
 
     for name in employees_set:
-        sec_raw = _section_for_name(name, name_to_position.get(name, ""))
-        sec = _norm(sec_raw)
+        sec = section_of(name, name_to_position.get(name, ""))
         _ensure_section(sec)
         section_employees[sec].add(name)
 
-    # Учитываем всех, кто встречается в daily_employees
-    for dk, names in daily_employees.items():
-        for name in names:
-            sec_raw = _section_for_name(name, name_to_position.get(name, ""))
-            sec = _norm(sec_raw)
-            _ensure_section(sec)
-            section_employees[sec].add(name)
+    # Сотрудники графика/табеля за месяцы периода: участок — по должности в этом месяце.
+    # Строки одного (ФИО, должность, статус) из разных месяцев складываются; порядок — по первому появлению.
+    touched: dict[tuple, list] = {}
+    for ym, sl in slices:
+        for row in sl[mode]["rows"]:
+            if row["name"] not in employees_set:
+                continue
+            hours, cost = _range_sum(row, lo, hi)
+            key = (row["name"], row["position"], row["status"])
+            if key in touched:
+                touched[key][2] += hours
+                touched[key][3] += cost
+            else:
+                touched[key] = [(ym, row["seq"]), row, hours, cost]
 
-    # Детализация по каждому сотруднику внутри участка
-    emp_details: dict[str, dict[str, dict]] = {}
     # emp_details[sec][name] = {position, status, rate, hours, cost}
-
-    # На уровне часов/ФОТ считаем по полю section, проходя ещё раз по табелю или графику
-    for year, month in sorted(months):
-        timesheet = get_timesheet(production, year, month)
-        schedule = get_schedule(production, year, month)
-        emp_by_id = {e["id"]: e for e in schedule.get("employees", [])}
-
-        if use_schedule_fallback:
-            items = [
-                (e.get("id", ""), e.get("working_days") or {}, e)
-                for e in schedule.get("employees", [])
-            ]
-        else:
-            ts_records = timesheet.get("records", {})
-            items = [
-                (emp_id, days_dict, emp_by_id.get(emp_id))
-                for emp_id, days_dict in ts_records.items()
-                if emp_by_id.get(emp_id)
-            ]
-
-        for emp_id, days_dict, emp in items:
-            if not emp:
-                continue
-            name = emp.get("full_name", "").strip()
-            if name not in employees_set:
+    emp_details: dict[str, dict[str, dict]] = {}
+    for _, row, hours, cost in sorted(touched.values(), key=lambda t: t[0]):
+        sec, name = row["section"], row["name"]
+        _ensure_section(sec)
+        section_employees[sec].add(name)
+        details = emp_details.setdefault(sec, {})
+        if name not in details:
+            details[name] = {
+                "position": row["position"],
+                "status":   row["status"],
+                "rate":     round(row["rate"], 2),
+                "hours":    0.0,
+                "cost":     0.0,
+            }
+        details[name]["hours"] += hours
+        details[name]["cost"]  += cost
+        section_hours[sec] += hours
+        section_costs[sec] += cost
+
+    daily_by_section = {}
+    for sec in section_employees:
+        sec_daily = daily_by_section[sec] = {}
+        for _, sl in slices:
+            sec_series = sl[mode]["sections"].get(sec)
+            if not sec_series:
                 continue
-            position = emp.get("position", "")
-            status = emp.get("status", "")
-            rate = rate_lookup.get((position, status), 0.0)
-            sec_raw = _section_for_name(name, position)
-            sec = _norm(sec_raw)
-            _ensure_section(sec)
-            section_employees[sec].add(name)
-
-            # Инициализируем запись по сотруднику
-            if sec not in emp_details:
-                emp_details[sec] = {}
-            if name not in emp_details[sec]:
-                emp_details[sec][name] = {
-                    "position": position,
-                    "status":   status,
-                    "rate":     round(rate, 2),
-                    "hours":    0.0,
-                    "cost":     0.0,
-                }
-
-            for day_str, hours in days_dict.items():
-                if not hours or float(hours) <= 0:
-                    continue
-                try:
-                    d = _date(year, month, int(day_str))
-                except Exception:
-                    continue
-                if not (date_from <= d <= date_to):
-                    continue
-                h = float(hours)
-                cost = h * rate
-                dk = d.isoformat()
-                section_hours[sec] += h
-                section_costs[sec] += cost
-                daily_section_cost[sec][dk] = daily_section_cost[sec].get(dk, 0.0) + cost
-                emp_details[sec][name]["hours"] += h
-                emp_details[sec][name]["cost"]  += cost
-
-    daily_by_section = {
-        sec: {k: round(v, 2) for k, v in days.items()}
-        for sec, days in daily_section_cost.items()
-    }
+            i, j = _range_indices(sec_series["days"], lo, hi)
+            for d, v in zip(sec_series["days"][i:j], sec_series["day_cost"][i:j]):
+                sec_daily[_date.fromordinal(d).isoformat()] = round(v, 2)
 
     sections_summary = {
         sec: {
@@ -1132,26 +1522,15 @@ def get_workforce_period_data(production: str, date_from, date_to) -> dict:
     }
 
     # Плановые сотрудники из графика (независимо от табеля) — для блока явки
-    planned_names: set[str] = set()
-    for yr, mo in sorted(months):
-        sched = get_schedule(production, yr, mo)
-        for emp in sched.get("employees", []):
-            name = (emp.get("full_name") or "").strip()
-            if not name:
-                continue
-            for day_str in (emp.get("working_days") or {}):
-                try:
-                    d = _date(yr, mo, int(day_str))
-                except Exception:
-                    continue
-                if date_from <= d <= date_to:
-                    planned_names.add(name)
-                    break  # достаточно одного дня
-
+    planned_names = {
+        name
+        for _, sl in slices
+        for name, ords in sl["planned"].items()
+        if _any_in_range(ords, lo, hi)
+    }
     planned_by_section: dict[str, int] = {}
     for name in planned_names:
-        sec_raw = _section_for_name(name, name_to_position.get(name, ""))
-        sec = _norm(sec_raw)
+        sec = section_of(name, name_to_position.get(name, ""))
         planned_by_section[sec] = planned_by_section.get(sec, 0) + 1
 
     return {
@@ -1170,64 +1549,108 @@ def get_workforce_period_data(production: str, date_from, date_to) -> dict:
     }
 
 
-# ─── Снимки графика (Snapshot) ────────────────────────────────────────────────
+def labor_versions() -> dict[tuple, tuple]:
+    """
+    Версии рядов табелей по месяцам: {(производство, год, месяц): ревизии источников ряда месяца}.
+    Версия месяца меняется только при записи его источников (журнал изменений на неё не влияет).
+    """
+    revisions = _current_revisions()
+    return {
+        (production, year, month): tuple(revisions.get(src, 0) for src in _labor_month_sources(production, year, month))
+        for production in PRODUCTIONS
+        for year, month in _labor_months(production)
+    }
 
-def _snapshot_path(production: str, year: int, month: int) -> Path:
-    return WORKFORCE_DIR / f"schedule_snapshot_{production}_{year}_{month:02d}.json"
 
+def get_daily_fact_labor(production: str, year: int, month: int) -> list:
+    """Фактические часы и ФОТ по табелю за месяц: [(день.toordinal(), ФИО, часы, ФОТ)] по кэшированному ряду месяца."""
+    out = []
+    for row in _labor_month(production, year, month)["fact"]["rows"]:
+        ch, cc = row["cum_hours"], row["cum_cost"]
+        for k, d in enumerate(row["ords"]):
+            out.append((d, row["name"], ch[k + 1] - ch[k], cc[k + 1] - cc[k]))
+    return out
+
+
+# ─── Снимки графика (Snapshot) ────────────────────────────────────────────────
 
 def save_schedule_snapshot(production: str, year: int, month: int) -> dict:
-    """Сохранить снимок текущего графика. Возвращает мета-данные снимка."""
+    """Сохранить снимок текущего графика (новой версией). Возвращает мета-данные снимка."""
     from datetime import datetime as _dt
     schedule = get_schedule(production, year, month)
     saved_at = _dt.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
     snapshot = {**schedule, "snapshot_saved_at": saved_at}
-    _write_json(_snapshot_path(production, year, month), snapshot)
-    return {"saved_at": saved_at, "employee_count": len(schedule.get("employees", []))}
+    with _db() as conn:
+        version = workforce_store.save_snapshot(conn, production, year, month, snapshot)
+    return {"saved_at": saved_at, "employee_count": len(schedule.get("employees", [])), "version": version}
 
 
-def get_schedule_snapshot(production: str, year: int, month: int) -> Optional[dict]:
-    """Вернуть сохранённый снимок или None."""
-    path = _snapshot_path(production, year, month)
-    if not path.exists():
-        return None
-    return _read_json(path, None)
+def _load_snapshot(production: str, year: int, month: int, version: Optional[int] = None) -> Optional[dict]:
+    with _db() as conn:
+        return workforce_store.load_snapshot(conn, production, year, month, version)
+
 
+def get_schedule_snapshot(production: str, year: int, month: int, version: Optional[int] = None) -> Optional[dict]:
+    """Вернуть сохранённый снимок (по умолчанию последний) или None."""
+    snapshot = _load_snapshot(production, year, month, version)
+    if snapshot is not None:
+        snapshot.pop("snapshot_days_hashes", None)
+    return snapshot
 
-def diff_schedule_with_snapshot(production: str, year: int, month: int) -> dict:
-    """Сравнить текущий график со снимком."""
-    snapshot = get_schedule_snapshot(production, year, month)
+
+def list_schedule_snapshots(production: str, year: int, month: int) -> list:
+    """Версии снимков графика за месяц, новые сверху."""
+    with _db() as conn:
+        return workforce_store.list_snapshots(conn, production, year, month)
+
+
+def diff_schedule_with_snapshot(production: str, year: int, month: int, version: Optional[int] = None) -> dict:
+    """
+    Сравнить текущий график со снимком (по умолчанию последним).
+    Сотрудники сопоставляются по ключу снимка (ФИО); у кого хэш рабочих дней совпадает
+    с сохранённым в снимке — пропускаются без сравнения по дням.
+    """
+    snapshot = _load_snapshot(production, year, month, version)
     if snapshot is None:
         return {"has_snapshot": False}
 
+    snap_hashes = snapshot.get("snapshot_days_hashes") or {}
+    snap_by_key = {
+        key: emp for key, _, _, emp in workforce_store.snapshot_entries(snapshot.get("employees", []))
+        if emp.get("full_name")
+    }
     current = get_schedule(production, year, month)
-    snap_by_name = {e.get("full_name", "").strip(): e for e in snapshot.get("employees", []) if e.get("full_name")}
-    curr_by_name = {e.get("full_name", "").strip(): e for e in current.get("employees", []) if e.get("full_name")}
+    curr_entries = [e for e in workforce_store.snapshot_entries(current.get("employees", [])) if e[3].get("full_name")]
+    curr_keys = {e[0] for e in curr_entries}
 
     added, removed, changed = [], [], []
 
-    for name, emp in curr_by_name.items():
-        if name not in snap_by_name:
+    for key, _, days_hash, emp in curr_entries:
+        name = emp.get("full_name", "").strip()
+        snap_emp = snap_by_key.get(key)
+        if snap_emp is None:
             added.append({"full_name": name, "position": emp.get("position", ""), "status": emp.get("status", "")})
-        else:
-            snap_days = snap_by_name[name].get("working_days") or {}
-            curr_days = emp.get("working_days") or {}
-            if snap_days != curr_days:
-                all_days = sorted(set(snap_days) | set(curr_days), key=lambda x: int(x) if x.isdigit() else 0)
-                day_changes = [
-                    {"day": int(d), "snapshot": snap_days.get(d), "current": curr_days.get(d)}
-                    for d in all_days if snap_days.get(d) != curr_days.get(d)
-                ]
-                if day_changes:
-                    changed.append({"full_name": name, "position": emp.get("position", ""), "status": emp.get("status", ""), "changes": day_changes})
-
-    for name in snap_by_name:
-        if name not in curr_by_name:
-            removed.append({"full_name": name, "position": snap_by_name[name].get("position", ""), "status": snap_by_name[name].get("status", "")})
+            continue
+        if snap_hashes.get(key) == days_hash:
+            continue
+        snap_days = snap_emp.get("working_days") or {}
+        curr_days = emp.get("working_days") or {}
+        all_days = sorted(set(snap_days) | set(curr_days), key=lambda x: int(x) if x.isdigit() else 0)
+        day_changes = [
+            {"day": int(d), "snapshot": snap_days.get(d), "current": curr_days.get(d)}
+            for d in all_days if snap_days.get(d) != curr_days.get(d)
+        ]
+        if day_changes:
+            changed.append({"full_name": name, "position": emp.get("position", ""), "status": emp.get("status", ""), "changes": day_changes})
+
+    for key, snap_emp in snap_by_key.items():
+        if key not in curr_keys:
+            removed.append({"full_name": snap_emp.get("full_name", "").strip(), "position": snap_emp.get("position", ""), "status": snap_emp.get("status", "")})
 
     return {
         "has_snapshot": True,
         "snapshot_saved_at": snapshot.get("snapshot_saved_at"),
+        "snapshot_version": snapshot.get("snapshot_version"),
         "production": production,
         "added": added,
         "removed": removed,
@@ -1268,3 +1691,47 @@ def import_employees_from_tsv(production: str, tsv: str) -> list:
             entry["phone"] = phone
         result.append(entry)
     return result
+
+
+def merge_imported_employees(production: str, imported: list, mode: str = "replace") -> dict:
+    """
+    Применить импортированный список сотрудников (import_employees_from_tsv).
+    Сопоставление с текущим списком по ФИО через словарь: найденные сохраняют id и поля,
+    которых нет в таблице (участок, дата увольнения…).
+      mode="replace" — список становится равен импорту (в его порядке);
+      mode="append"  — найденные обновляются на месте, новые добавляются в конец.
+    Возвращает {"employees", "diff": {"added", "updated", "removed"}}.
+    """
+    existing = get_employees(production)
+    by_name: dict[str, dict] = {}
+    for emp in existing:
+        by_name.setdefault(_name_key(emp.get("full_name")), emp)
+
+    matched: dict[int, dict] = {}  # id(запись списка) → обновлённая запись
+    matched_names: set[str] = set()
+    result, new_entries = [], []
+    added, updated = [], []
+    for entry in imported:
+        key = _name_key(entry.get("full_name"))
+        prev = by_name.get(key)
+        if prev is not None and key not in matched_names:
+            merged = {**prev, **{k: v for k, v in entry.items() if k != "id"}}
+            if merged != prev:
+                updated.append(merged.get("full_name", ""))
+            matched[id(prev)] = merged
+            matched_names.add(key)
+            result.append(merged)
+        else:
+            added.append(entry.get("full_name", ""))
+            new_entries.append(entry)
+            result.append(entry)
+
+    if mode == "append":
+        employees = [matched.get(id(e), e) for e in existing] + new_entries
+        removed = []
+    else:
+        employees = result
+        removed = [e.get("full_name", "") for e in existing if id(e) not in matched]
+
+    save_employees(production, employees)
+    return {"employees": employees, "diff": {"added": added, "updated": updated, "removed": removed}}
@@ -0,0 +1,728 @@
+"""
+Хранилище графиков, табелей, списков сотрудников, справочника и журнала (workforce) во встроенной БД SQLite.
+
+Файл: DATA_DIR/workforce/workforce.sqlite3
+  reference          — справочник ставок (должность, статус, ставка)
+  schedules          — факт существования графика за месяц + прочие поля графика
+  schedule_employees — сотрудники графика (порядок, id, ФИО, остальные поля в JSON)
+  schedule_days      — плановые часы по дням: (производство, год, месяц, сотрудник, день)
+  timesheets         — факт существования табеля за месяц + прочие поля табеля
+  timesheet_cells    — фактические часы: (производство, год, месяц, сотрудник, день)
+  employees          — постоянный список сотрудников производства (порядок + запись в JSON)
+  snapshot_versions  — версии снимков графиков (полные или дельтой к предыдущей версии)
+  changelog          — журнал изменений
+  revisions          — ревизии данных по ключам (см. revision_key) для сброса кэшей чтения
+
+Каждая запись — одна транзакция; правка ячейки табеля меняет одну строку, а не весь месяц.
+При первом открытии данные переносятся из прежних JSON-файлов в WORKFORCE_DIR (файлы не удаляются).
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+DB_FILENAME = "workforce.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS reference (
+    pos INTEGER PRIMARY KEY,
+    position TEXT,
+    status TEXT,
+    hourly_rate REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (production, year, month)
+);
+CREATE TABLE IF NOT EXISTS schedule_employees (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    employee_id TEXT,
+    full_name TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (production, year, month, pos)
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_employees_id ON schedule_employees (production, year, month, employee_id);
+CREATE TABLE IF NOT EXISTS schedule_days (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    employee_id TEXT,
+    day TEXT NOT NULL,
+    hours REAL,
+    PRIMARY KEY (production, year, month, pos, day)
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_days_emp ON schedule_days (production, year, month, employee_id, day);
+CREATE TABLE IF NOT EXISTS timesheets (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (production, year, month)
+);
+CREATE TABLE IF NOT EXISTS timesheet_cells (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    employee_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    hours REAL,
+    PRIMARY KEY (production, year, month, employee_id, day)
+);
+CREATE TABLE IF NOT EXISTS employees (
+    production TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    employee_id TEXT,
+    full_name TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (production, pos)
+);
+CREATE INDEX IF NOT EXISTS idx_employees_id ON employees (production, employee_id);
+-- прежняя таблица снимков (один на месяц); при открытии переносится в snapshot_versions
+CREATE TABLE IF NOT EXISTS snapshots (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (production, year, month)
+);
+CREATE TABLE IF NOT EXISTS snapshot_versions (
+    production TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    saved_at TEXT,
+    is_full INTEGER NOT NULL,
+    employee_count INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (production, year, month, version)
+);
+CREATE TABLE IF NOT EXISTS changelog (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    at TEXT,
+    username TEXT,
+    action TEXT,
+    production TEXT,
+    year INTEGER,
+    month INTEGER,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_changelog_production ON changelog (production, id);
+CREATE INDEX IF NOT EXISTS idx_changelog_username ON changelog (username, id);
+CREATE INDEX IF NOT EXISTS idx_changelog_at ON changelog (at);
+-- счётчик изменений по ключу данных; увеличивается в той же транзакции, что и запись (журнал его не меняет)
+CREATE TABLE IF NOT EXISTS revisions (key TEXT PRIMARY KEY, rev INTEGER NOT NULL);
+"""
+
+_lock = threading.Lock()
+_initialized: set[str] = set()
+
+
+def _db_path(workforce_dir: Path) -> Path:
+    return Path(workforce_dir) / DB_FILENAME
+
+
+@contextmanager
+def connect(workforce_dir: Path) -> Iterator[sqlite3.Connection]:
+    """Соединение с БД (схема и перенос из JSON — при первом обращении). Транзакции — через `with conn:`."""
+    workforce_dir = Path(workforce_dir)
+    workforce_dir.mkdir(parents=True, exist_ok=True)
+    path = _db_path(workforce_dir)
+    conn = sqlite3.connect(str(path), timeout=30)
+    try:
+        key = str(path)
+        if key not in _initialized:
+            with _lock:
+                if key not in _initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    _migrate_from_json(conn, workforce_dir)
+                    _migrate_legacy_snapshots(conn)
+                    _initialized.add(key)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+# ─── Ревизии ──────────────────────────────────────────────────────────────────
+
+def revision_key(kind: str, *parts) -> str:
+    """
+    Ключ ревизии: "reference", "schedule:tea:2024:5", "timesheet:tea:2024:5", "employees:tea",
+    "setting:section_rules", "months:tea" (появился новый месяц графика или табеля).
+    """
+    return ":".join(str(p) for p in (kind, *parts))
+
+
+def load_revisions(conn: sqlite3.Connection) -> dict[str, int]:
+    """Текущие ревизии {ключ: номер}; ключа нет — данные по нему не менялись (ревизия 0)."""
+    return dict(conn.execute("SELECT key, rev FROM revisions"))
+
+
+def _bump(conn: sqlite3.Connection, *keys: str) -> None:
+    conn.executemany(
+        "INSERT INTO revisions (key, rev) VALUES (?, 1) ON CONFLICT (key) DO UPDATE SET rev = rev + 1",
+        [(k,) for k in keys],
+    )
+
+
+# ─── Справочник ───────────────────────────────────────────────────────────────
+
+def load_reference(conn: sqlite3.Connection) -> list:
+    return [json.loads(d) for (d,) in conn.execute("SELECT data FROM reference ORDER BY pos")]
+
+
+def save_reference(conn: sqlite3.Connection, entries: list) -> None:
+    with conn:
+        _write_reference(conn, entries)
+
+
+def _write_reference(conn: sqlite3.Connection, entries: list) -> None:
+    rows = []
+    for i, r in enumerate(entries or []):
+        r = r if isinstance(r, dict) else {}
+        rows.append((i, r.get("position"), r.get("status"), _num(r.get("hourly_rate")), _dumps(r)))
+    conn.execute("DELETE FROM reference")
+    conn.executemany("INSERT INTO reference (pos, position, status, hourly_rate, data) VALUES (?, ?, ?, ?, ?)", rows)
+    _bump(conn, revision_key("reference"))
+
+
+def _num(v) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# ─── График ───────────────────────────────────────────────────────────────────
+
+def schedule_exists(conn: sqlite3.Connection, production: str, year: int, month: int) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM schedules WHERE production = ? AND year = ? AND month = ?", (production, year, month)
+    ).fetchone()
+    return row is not None
+
+
+def list_months(conn: sqlite3.Connection, production: str) -> list[tuple[int, int]]:
+    """Месяцы (год, месяц), за которые сохранён график или табель производства, по возрастанию."""
+    return [
+        (int(y), int(m))
+        for y, m in conn.execute(
+            "SELECT year, month FROM schedules WHERE production = ? "
+            "UNION SELECT year, month FROM timesheets WHERE production = ? ORDER BY 1, 2",
+            (production, production),
+        )
+    ]
+
+
+def load_schedule(conn: sqlite3.Connection, production: str, year: int, month: int) -> Optional[dict]:
+    """График за месяц или None, если он не сохранялся."""
+    row = conn.execute(
+        "SELECT extra FROM schedules WHERE production = ? AND year = ? AND month = ?", (production, year, month)
+    ).fetchone()
+    if row is None:
+        return None
+    data = json.loads(row[0]) if row[0] else {}
+    days_by_pos: dict[int, dict] = {}
+    for pos, day, hours in conn.execute(
+        "SELECT pos, day, hours FROM schedule_days WHERE production = ? AND year = ? AND month = ?",
+        (production, year, month),
+    ):
+        days_by_pos.setdefault(pos, {})[day] = hours
+    employees = []
+    for pos, emp_data in conn.execute(
+        "SELECT pos, data FROM schedule_employees WHERE production = ? AND year = ? AND month = ? ORDER BY pos",
+        (production, year, month),
+    ):
+        emp = json.loads(emp_data)
+        if emp.pop("__has_working_days", True):
+            emp["working_days"] = _sorted_days(days_by_pos.get(pos, {}))
+        employees.append(emp)
+    return {**data, "production": production, "year": year, "month": month, "employees": employees}
+
+
+def save_schedule(conn: sqlite3.Connection, production: str, year: int, month: int, data: dict) -> None:
+    """Записать график за месяц целиком (одна транзакция)."""
+    with conn:
+        _write_schedule(conn, production, year, month, data)
+
+
+def _write_schedule(conn: sqlite3.Connection, production: str, year: int, month: int, data: dict) -> None:
+    extra = {k: v for k, v in data.items() if k not in ("production", "year", "month", "employees")}
+    emp_rows, day_rows = [], []
+    for pos, emp in enumerate(data.get("employees") or []):
+        if not isinstance(emp, dict):
+            continue
+        working_days = emp.get("working_days")
+        rest = {k: v for k, v in emp.items() if k != "working_days"}
+        if working_days is None:
+            rest["__has_working_days"] = False
+        emp_id = emp.get("id")
+        emp_rows.append((production, year, month, pos, emp_id, emp.get("full_name"), _dumps(rest)))
+        for day, hours in (working_days or {}).items():
+            day_rows.append((production, year, month, pos, emp_id, str(day), hours))
+    key = (production, year, month)
+    _bump(conn, revision_key("schedule", *key))
+    if not schedule_exists(conn, *key):
+        _bump(conn, revision_key("months", production))
+    conn.execute("DELETE FROM schedule_days WHERE production = ? AND year = ? AND month = ?", key)
+    conn.execute("DELETE FROM schedule_employees WHERE production = ? AND year = ? AND month = ?", key)
+    conn.execute(
+        "INSERT OR REPLACE INTO schedules (production, year, month, extra) VALUES (?, ?, ?, ?)",
+        (*key, _dumps(extra)),
+    )
+    conn.executemany(
+        "INSERT INTO schedule_employees (production, year, month, pos, employee_id, full_name, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        emp_rows,
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO schedule_days (production, year, month, pos, employee_id, day, hours) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        day_rows,
+    )
+
+
+def _sorted_days(days: dict) -> dict:
+    return dict(sorted(days.items(), key=lambda kv: (0, int(kv[0])) if kv[0].isdigit() else (1, kv[0])))
+
+
+# ─── Табель ───────────────────────────────────────────────────────────────────
+
+def load_timesheet(conn: sqlite3.Connection, production: str, year: int, month: int) -> Optional[dict]:
+    """Табель за месяц или None, если он не сохранялся."""
+    row = conn.execute(
+        "SELECT extra FROM timesheets WHERE production = ? AND year = ? AND month = ?", (production, year, month)
+    ).fetchone()
+    if row is None:
+        return None
+    data = json.loads(row[0]) if row[0] else {}
+    records: dict[str, dict] = {}
+    for emp_id, day, hours in conn.execute(
+        "SELECT employee_id, day, hours FROM timesheet_cells WHERE production = ? AND year = ? AND month = ?",
+        (production, year, month),
+    ):
+        records.setdefault(emp_id, {})[day] = hours
+    for emp_id in data.pop("__empty_records", None) or []:
+        records.setdefault(emp_id, {})
+    records = {emp_id: _sorted_days(days) for emp_id, days in records.items()}
+    return {**data, "production": production, "year": year, "month": month, "records": records}
+
+
+def save_timesheet(conn: sqlite3.Connection, production: str, year: int, month: int, data: dict) -> None:
+    """Записать табель за месяц целиком (одна транзакция)."""
+    with conn:
+        _write_timesheet(conn, production, year, month, data)
+
+
+def _write_timesheet(conn: sqlite3.Connection, production: str, year: int, month: int, data: dict) -> None:
+    extra = {k: v for k, v in data.items() if k not in ("production", "year", "month", "records")}
+    rows = []
+    empty = []
+    for emp_id, days in (data.get("records") or {}).items():
+        if not days:
+            empty.append(emp_id)
+            continue
+        for day, hours in days.items():
+            rows.append((production, year, month, str(emp_id), str(day), hours))
+    if empty:
+        extra["__empty_records"] = empty
+    key = (production, year, month)
+    _bump(conn, revision_key("timesheet", *key))
+    if conn.execute("SELECT 1 FROM timesheets WHERE production = ? AND year = ? AND month = ?", key).fetchone() is None:
+        _bump(conn, revision_key("months", production))
+    conn.execute("DELETE FROM timesheet_cells WHERE production = ? AND year = ? AND month = ?", key)
+    conn.execute(
+        "INSERT OR REPLACE INTO timesheets (production, year, month, extra) VALUES (?, ?, ?, ?)",
+        (*key, _dumps(extra)),
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO timesheet_cells (production, year, month, employee_id, day, hours) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def set_timesheet_cell(
+    conn: sqlite3.Connection, production: str, year: int, month: int,
+    employee_id: str, day: str, hours: Optional[float],
+) -> None:
+    """Изменить одну ячейку табеля (hours=None — очистить)."""
+    set_timesheet_cells(conn, production, year, month, [(employee_id, day, hours)])
+
+
+def set_timesheet_cells(
+    conn: sqlite3.Connection, production: str, year: int, month: int,
+    edits: list[tuple[str, str, Optional[float]]],
+) -> None:
+    """
+    Применить пачку правок ячеек табеля [(сотрудник, день, часы)] одной транзакцией.
+    Правки применяются по порядку (последняя правка ячейки побеждает); hours=None — очистить.
+    """
+    key = (production, year, month)
+    with conn:
+        cur = conn.execute("INSERT OR IGNORE INTO timesheets (production, year, month, extra) VALUES (?, ?, ?, '{}')", key)
+        if cur.rowcount:
+            _bump(conn, revision_key("months", production))
+        _bump(conn, revision_key("timesheet", *key))
+        for employee_id, day, hours in edits:
+            if hours is None:
+                conn.execute(
+                    "DELETE FROM timesheet_cells "
+                    "WHERE production = ? AND year = ? AND month = ? AND employee_id = ? AND day = ?",
+                    (*key, str(employee_id), str(day)),
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO timesheet_cells (production, year, month, employee_id, day, hours) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (*key, str(employee_id), str(day), hours),
+                )
+
+
+# ─── Список сотрудников ──────────────────────────────────────────────────────
+
+def load_employees(conn: sqlite3.Connection, production: str) -> list:
+    return [
+        json.loads(d)
+        for (d,) in conn.execute("SELECT data FROM employees WHERE production = ? ORDER BY pos", (production,))
+    ]
+
+
+def save_employees(conn: sqlite3.Connection, production: str, employees: list) -> None:
+    with conn:
+        _write_employees(conn, production, employees)
+
+
+def _write_employees(conn: sqlite3.Connection, production: str, employees: list) -> None:
+    rows = [
+        (production, i, e.get("id"), e.get("full_name"), _dumps(e))
+        for i, e in enumerate(employees or [])
+        if isinstance(e, dict)
+    ]
+    conn.execute("DELETE FROM employees WHERE production = ?", (production,))
+    conn.executemany(
+        "INSERT INTO employees (production, pos, employee_id, full_name, data) VALUES (?, ?, ?, ?, ?)", rows
+    )
+    _bump(conn, revision_key("employees", production))
+
+
+# ─── Настройки ───────────────────────────────────────────────────────────────
+
+def get_setting(conn: sqlite3.Connection, key: str) -> Any:
+    """Значение настройки (JSON) из таблицы meta; None — не задана."""
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (f"setting:{key}",)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def set_setting(conn: sqlite3.Connection, key: str, value: Any) -> None:
+    """Сохранить настройку (None — удалить)."""
+    with conn:
+        if value is None:
+            conn.execute("DELETE FROM meta WHERE key = ?", (f"setting:{key}",))
+        else:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"setting:{key}", _dumps(value)))
+        _bump(conn, revision_key("setting", key))
+
+
+# ─── Импорт ──────────────────────────────────────────────────────────────────
+
+def save_import(
+    conn: sqlite3.Connection, production: str, year: int, month: int,
+    schedule: Optional[dict] = None, timesheet: Optional[dict] = None, employees: Optional[list] = None,
+) -> None:
+    """Записать результат импорта (график, табель, список сотрудников — что передано) одной транзакцией."""
+    with conn:
+        if schedule is not None:
+            _write_schedule(conn, production, year, month, schedule)
+        if timesheet is not None:
+            _write_timesheet(conn, production, year, month, timesheet)
+        if employees is not None:
+            _write_employees(conn, production, employees)
+
+
+# ─── Снимки графика ──────────────────────────────────────────────────────────
+# Снимков за месяц может быть много (версии 1, 2, …). Версия хранится дельтой к предыдущей:
+# порядок сотрудников с хэшами + записи только тех сотрудников, чья запись изменилась;
+# каждая SNAPSHOT_FULL_EVERY-я версия хранится целиком, чтобы цепочка восстановления была короткой.
+# Для каждого сотрудника хранятся два хэша: всей записи (для дельты) и рабочих дней (для сравнения с графиком).
+
+SNAPSHOT_FULL_EVERY = 10
+
+
+def _hours_key(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return str(v)
+
+
+def days_hash(working_days) -> str:
+    """Хэш рабочих дней сотрудника (часы приводятся к числу, порядок дней не важен)."""
+    days = {str(d): _hours_key(h) for d, h in (working_days or {}).items()}
+    return hashlib.sha1(json.dumps(days, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def snapshot_entries(employees) -> list[tuple[str, str, str, dict]]:
+    """
+    Записи снимка: (ключ, хэш записи, хэш дней, сотрудник).
+    Ключ — ФИО; для повторяющихся ФИО добавляется номер повтора.
+    """
+    seen: dict[str, int] = {}
+    entries = []
+    for emp in employees or []:
+        if not isinstance(emp, dict):
+            continue
+        name = (emp.get("full_name") or "").strip()
+        n = seen.get(name, 0)
+        seen[name] = n + 1
+        key = name if n == 0 else f"{name}\x00{n}"
+        record_hash = hashlib.sha1(_dumps(emp).encode("utf-8")).hexdigest()[:16]
+        entries.append((key, record_hash, days_hash(emp.get("working_days")), emp))
+    return entries
+
+
+def _snapshot_rows(conn: sqlite3.Connection, production: str, year: int, month: int, version: int) -> list:
+    """Строки версий от ближайшей полной до version включительно."""
+    full = conn.execute(
+        "SELECT MAX(version) FROM snapshot_versions "
+        "WHERE production = ? AND year = ? AND month = ? AND version <= ? AND is_full = 1",
+        (production, year, month, version),
+    ).fetchone()[0]
+    if full is None:
+        return []
+    return conn.execute(
+        "SELECT version, saved_at, is_full, data FROM snapshot_versions "
+        "WHERE production = ? AND year = ? AND month = ? AND version BETWEEN ? AND ? ORDER BY version",
+        (production, year, month, full, version),
+    ).fetchall()
+
+
+def _restore_snapshot(rows: list) -> tuple[dict, list]:
+    """Восстановить (заголовок, записи) по цепочке: полная версия + дельты."""
+    header: dict = {}
+    entries: list = []
+    for _, _, is_full, data in rows:
+        payload = json.loads(data)
+        header = payload.get("header") or {}
+        if is_full:
+            entries = [tuple(e) for e in payload.get("entries", [])]
+            continue
+        base = {e[0]: e for e in entries}
+        changed = payload.get("set") or {}
+        entries = [
+            (key, rh, dh, changed[key] if key in changed else base[key][3])
+            for key, rh, dh in payload.get("order", [])
+        ]
+    return header, entries
+
+
+def latest_snapshot_version(conn: sqlite3.Connection, production: str, year: int, month: int) -> Optional[int]:
+    return conn.execute(
+        "SELECT MAX(version) FROM snapshot_versions WHERE production = ? AND year = ? AND month = ?",
+        (production, year, month),
+    ).fetchone()[0]
+
+
+def list_snapshots(conn: sqlite3.Connection, production: str, year: int, month: int) -> list:
+    """Версии снимков месяца: [{version, saved_at, employee_count}], новые сверху."""
+    return [
+        {"version": v, "saved_at": saved_at, "employee_count": count}
+        for v, saved_at, count in conn.execute(
+            "SELECT version, saved_at, employee_count FROM snapshot_versions "
+            "WHERE production = ? AND year = ? AND month = ? ORDER BY version DESC",
+            (production, year, month),
+        )
+    ]
+
+
+def load_snapshot(
+    conn: sqlite3.Connection, production: str, year: int, month: int, version: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    Снимок (по умолчанию последний) или None. Помимо полей графика содержит
+    snapshot_version и snapshot_days_hashes {ключ: хэш дней} (ключи — как в snapshot_entries).
+    """
+    if version is None:
+        version = latest_snapshot_version(conn, production, year, month)
+        if version is None:
+            return None
+    rows = _snapshot_rows(conn, production, year, month, int(version))
+    if not rows or rows[-1][0] != int(version):
+        return None
+    header, entries = _restore_snapshot(rows)
+    return {
+        **header,
+        "employees": [e[3] for e in entries],
+        "snapshot_version": int(version),
+        "snapshot_days_hashes": {e[0]: e[2] for e in entries},
+    }
+
+
+def save_snapshot(conn: sqlite3.Connection, production: str, year: int, month: int, data: dict) -> int:
+    """
+    Сохранить новую версию снимка (дельтой к предыдущей). Возвращает номер версии.
+    BEGIN IMMEDIATE: номер версии (MAX + 1) вычисляется под блокировкой записи, параллельные сохранения не конфликтуют.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        return _write_snapshot(conn, production, year, month, data)
+
+
+def _write_snapshot(conn: sqlite3.Connection, production: str, year: int, month: int, data: dict) -> int:
+    header = {
+        k: v for k, v in data.items()
+        if k not in ("employees", "snapshot_version", "snapshot_days_hashes")
+    }
+    entries = snapshot_entries(data.get("employees"))
+    latest = latest_snapshot_version(conn, production, year, month)
+    version = (latest or 0) + 1
+    is_full = latest is None or (version - 1) % SNAPSHOT_FULL_EVERY == 0
+    if is_full:
+        payload = {"header": header, "entries": [list(e) for e in entries]}
+    else:
+        _, base_entries = _restore_snapshot(_snapshot_rows(conn, production, year, month, latest))
+        base_hashes = {e[0]: e[1] for e in base_entries}
+        payload = {
+            "header": header,
+            "order": [[key, rh, dh] for key, rh, dh, _ in entries],
+            "set": {key: emp for key, rh, _, emp in entries if base_hashes.get(key) != rh},
+        }
+    conn.execute(
+        "INSERT INTO snapshot_versions (production, year, month, version, saved_at, is_full, employee_count, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (production, year, month, version, data.get("snapshot_saved_at"), int(is_full), len(entries), _dumps(payload)),
+    )
+    return version
+
+
+def _migrate_legacy_snapshots(conn: sqlite3.Connection) -> None:
+    """Однократный перенос снимков из прежней таблицы snapshots (один снимок на месяц) в версии."""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'snapshots_versioned'").fetchone():
+        return
+    with conn:
+        for production, year, month, data in conn.execute(
+            "SELECT production, year, month, data FROM snapshots"
+        ).fetchall():
+            if latest_snapshot_version(conn, production, year, month) is None:
+                _write_snapshot(conn, production, year, month, json.loads(data))
+        conn.execute("DELETE FROM snapshots")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('snapshots_versioned', '1')")
+
+
+# ─── Журнал изменений ────────────────────────────────────────────────────────
+
+def append_changelog(conn: sqlite3.Connection, entry: dict, keep: int = 2000) -> None:
+    """Добавить запись журнала; хранятся последние keep записей."""
+    with conn:
+        _insert_changelog(conn, entry, keep)
+
+
+def _insert_changelog(conn: sqlite3.Connection, entry: dict, keep: int) -> None:
+    cur = conn.execute(
+        "INSERT INTO changelog (at, username, action, production, year, month, details) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (entry.get("at"), entry.get("username"), entry.get("action"), entry.get("production"),
+         entry.get("year"), entry.get("month"), entry.get("details")),
+    )
+    if keep and cur.lastrowid and cur.lastrowid % 100 == 0:
+        conn.execute("DELETE FROM changelog WHERE id <= ?", (cur.lastrowid - keep,))
+
+
+def tail_changelog(
+    conn: sqlite3.Connection, limit: int,
+    production: Optional[str] = None, username: Optional[str] = None,
+    at_from: Optional[str] = None, at_to: Optional[str] = None,
+    before_id: Optional[int] = None,
+) -> list:
+    """
+    Последние limit записей журнала, новые сверху (с id записи — курсором для следующей страницы).
+    Фильтры: производство, пользователь, время at в [at_from, at_to] (строки ISO), id < before_id.
+    Чтение идёт с хвоста по первичному ключу / индексам, без просмотра всего журнала.
+    """
+    where, params = [], []
+    if production:
+        where.append("production = ?")
+        params.append(production)
+    if username:
+        where.append("username = ?")
+        params.append(username)
+    if at_from:
+        where.append("at >= ?")
+        params.append(at_from)
+    if at_to:
+        where.append("at <= ?")
+        params.append(at_to)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(int(before_id))
+    sql = "SELECT id, at, username, action, production, year, month, details FROM changelog"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(max(int(limit), 0))
+    keys = ("id", "at", "username", "action", "production", "year", "month", "details")
+    return [dict(zip(keys, r)) for r in conn.execute(sql, params).fetchall()]
+
+
+# ─── Перенос из JSON ─────────────────────────────────────────────────────────
+
+_SCHEDULE_RE = re.compile(r"^schedule_(\w+?)_(\d{4})_(\d{2})\.json$")
+_SNAPSHOT_RE = re.compile(r"^schedule_snapshot_(\w+?)_(\d{4})_(\d{2})\.json$")
+_TIMESHEET_RE = re.compile(r"^timesheet_(\w+?)_(\d{4})_(\d{2})\.json$")
+_EMPLOYEES_RE = re.compile(r"^employees_(\w+)\.json$")
+
+
+def _read_json_file(path: Path, default):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return default
+
+
+def _migrate_from_json(conn: sqlite3.Connection, workforce_dir: Path) -> None:
+    """
+    Однократный перенос JSON-файлов workforce в БД (исходные файлы остаются как резервная копия).
+    Перенос и отметка о нём — одна транзакция: прерванный перенос откатывается целиком и не дублирует журнал.
+    """
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        ref_path = workforce_dir / "reference.json"
+        if ref_path.exists():
+            _write_reference(conn, _read_json_file(ref_path, []))
+        log_path = workforce_dir / "changelog.json"
+        if log_path.exists():
+            for entry in _read_json_file(log_path, []):
+                if isinstance(entry, dict):
+                    _insert_changelog(conn, entry, keep=0)
+        for f in sorted(workforce_dir.glob("*.json")):
+            m = _SNAPSHOT_RE.match(f.name)
+            if m:
+                data = _read_json_file(f, None)
+                if isinstance(data, dict):
+                    _write_snapshot(conn, m.group(1), int(m.group(2)), int(m.group(3)), data)
+                continue
+            m = _SCHEDULE_RE.match(f.name)
+            if m:
+                data = _read_json_file(f, None)
+                if isinstance(data, dict):
+                    _write_schedule(conn, m.group(1), int(m.group(2)), int(m.group(3)), data)
+                continue
+            m = _TIMESHEET_RE.match(f.name)
+            if m:
+                data = _read_json_file(f, None)
+                if isinstance(data, dict):
+                    _write_timesheet(conn, m.group(1), int(m.group(2)), int(m.group(3)), data)
+                continue
+            m = _EMPLOYEES_RE.match(f.name)
+            if m:
+                data = _read_json_file(f, None)
+                if isinstance(data, list):
+                    _write_employees(conn, m.group(1), data)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")